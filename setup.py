@@ -9,7 +9,11 @@ setup(name="opcua-modeler",
       packages=["uamodeler"],
       license="GNU General Public License",
       install_requires=["asyncua", "opcua-widgets", "pyqt5"],
+      extras_require={"xlsx": ["openpyxl"]},
       entry_points={'console_scripts':
-                    ['opcua-modeler = uamodeler.uamodeler:main']
+                    ['opcua-modeler = uamodeler.uamodeler:main',
+                     'opcua-modeler-diff = uamodeler.model_diff:main',
+                     'opcua-modeler-roundtrip = uamodeler.roundtrip:main',
+                     'opcua-modeler-loadtest = uamodeler.loadtest:main']
                     }
       )
@@ -1,12 +1,35 @@
 
+import os
+import gzip
+import json
 import sys
+import xml.etree.ElementTree as Et
 import pytest
 
 from asyncua import ua
+from asyncua.sync import DataTypeDictionaryBuilder
 
 from PyQt5.QtCore import QTimer, QSettings, QModelIndex, Qt, QCoreApplication
 
 from uamodeler.uamodeler import UaModeler
+from uamodeler.search_index import NodeSearchIndex
+from uamodeler.node_tracker import NodeKeySet, node_key, Change
+from uamodeler.undo import UndoStack, WriteAttributeCommand, NodeState
+from uamodeler.binary_model import BinaryModel
+from uamodeler import type_cache
+from uamodeler import model_diff
+from uamodeler import validation
+from uamodeler import roundtrip
+from uamodeler import streaming_importer
+from uamodeler.tag_import import TagImporter, read_tags
+from uamodeler.instantiation import build_plan
+from uamodeler.remote_import import RequestLimits, RemoteWalker
+from uamodeler import loadtest
+from uamodeler.ports import free_port
+from uamodeler.simulation import Ramp, Replay
+from uamodeler.server_loader import import_loader
+from uamodeler import nodeset_registry
+from uamodeler.nodeset_registry import NodesetRegistry
 from uawidgets.new_node_dialogs import NewNodeBaseDialog, NewUaObjectDialog, NewUaVariableDialog, NewUaMethodDialog
 
 
@@ -287,3 +310,907 @@ def test_add_namespace(modeler, mgr, model):
     assert urn not in urns
 
 
+
+
+def test_search_index():
+    index = NodeSearchIndex()
+    root = ua.NodeId(84)
+    motor = ua.NodeId(1000, 1)
+    speed = ua.NodeId("MotorSpeed", 1)
+    index.add(root, None, "Root", "Root")
+    index.add(motor, root, "Motor", "Main Motor", "drives the conveyor")
+    index.add(speed, motor, "MotorSpeed", "Motor Speed")
+    assert [e.nodeid for e in index.search("motor")] == [motor, speed]
+    assert [e.nodeid for e in index.search("conv")] == [motor]
+    assert [e.nodeid for e in index.search("main mot")] == [motor]
+    assert index.search("1000")[0].nodeid == motor
+    assert index.path(speed) == [root, motor, speed]
+    index.update(motor, browse_name="Pump")
+    assert [e.nodeid for e in index.search("pump")] == [motor]
+    index.remove(speed)
+    assert [e.nodeid for e in index.search("speed")] == []
+
+
+def test_search_index_removed_during_build():
+    index = NodeSearchIndex()
+    motor = ua.NodeId(1000, 1)
+    generation = index.generation  # a builder starts
+    index.add(motor, None, "Motor")
+    index.remove(motor)  # node deleted while the builder runs
+    index.add(motor, None, "Motor", since=generation)
+    assert motor not in index
+    index.add(motor, None, "Motor")  # recreated, by undo for example
+    assert motor in index
+    index.add(motor, None, "Pump", since=generation)
+    assert [e.nodeid for e in index.search("pump")] == [motor]
+
+
+def test_search_added_node(modeler, mgr, model):
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "MySearchedFolder")
+    hits = mgr.search_index.search("mysearched")
+    assert [hit.nodeid for hit in hits] == [folder.nodeid]
+    path = mgr.search_index.path(folder.nodeid)
+    assert path[0] == ua.NodeId(ua.ObjectIds.RootFolder)
+    modeler.tree_ui.expand_to_node("Root")
+    assert modeler.expand_to_path(path)
+    assert modeler.tree_ui.get_current_node() == folder
+
+
+def test_node_key_set(modeler, mgr, model):
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "myfolder")
+    assert folder in mgr.new_nodes
+    assert folder.nodeid in mgr.new_nodes
+    assert node_key(folder) in mgr.new_nodes
+    assert list(mgr.new_nodes) == [folder.nodeid]
+    keys = NodeKeySet([ua.NodeId("a", 2), ua.NodeId(5, 2), ua.NodeId("5", 2)])
+    assert len(keys) == 3
+    keys.discard(ua.NodeId(5, 2))
+    assert ua.NodeId(5, 2) not in keys
+    assert ua.NodeId("5", 2) in keys
+
+
+def test_incremental_save(modeler, mgr, model, tmp_path):
+    path = str(tmp_path / "incremental_save.xml")
+    modeler.tree_ui.expand_to_node("Objects")
+    mgr.add_folder(1, "myfolder")
+    var = mgr.add_variable(1, "myvar", 0.1)
+    mgr.save_xml(path)
+    assert not mgr.modified
+
+    var2 = mgr.add_variable(1, "myvar2", 0.2)
+    assert mgr.changes.get(var2) == Change.CREATED
+    mgr.delete_node(var, interactive=False)
+    assert mgr.changes.get(var) == Change.DELETED
+
+    def full_export(*args):
+        raise AssertionError("only changed nodes should be exported")
+    mgr.server_mgr.export_xml = full_export
+    mgr.save_xml(path)
+    del mgr.server_mgr.export_xml
+    assert not mgr.modified
+
+    # the tree current node moved with the keyboard, the node shown in the attribute view is the one written
+    objects = mgr.server_mgr.nodes.objects
+    assert modeler.expand_to_path([mgr.server_mgr.nodes.root.nodeid, objects.nodeid, var2.nodeid])
+    modeler.ui.treeView.setCurrentIndex(modeler.ui.treeView.currentIndex().sibling(0, 0))
+    assert modeler.tree_ui.get_current_node() != var2
+    dv = ua.DataValue(ua.Variant(ua.LocalizedText("renamed")))
+    var2.write_attribute(ua.AttributeIds.DisplayName, dv)
+    modeler.attrs_ui.attr_written.emit(ua.AttributeIds.DisplayName, dv)
+    assert mgr.changes.get(var2) == Change.ATTRIBUTES
+    assert mgr.changes.get(modeler.tree_ui.get_current_node()) == 0
+    mgr.server_mgr.export_xml = full_export
+    mgr.save_xml(path)
+    del mgr.server_mgr.export_xml
+
+    mgr.close_model()
+    mgr.open_xml(path)
+    names = [child.read_browse_name().Name for child in mgr.server_mgr.nodes.objects.get_children()]
+    assert "myfolder" in names
+    assert "myvar2" in names
+    assert "myvar" not in names
+    assert mgr.server_mgr.get_node(var2.nodeid).read_display_name().Text == "renamed"
+
+
+def test_journal_recovery(modeler, mgr, model, tmp_path):
+    path = str(tmp_path / "journal_recovery.xml")
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "myfolder")
+    mgr.save_xml(path)
+
+    var = mgr.add_variable(1, "myvar", 0.5)
+    mgr.delete_node(folder, interactive=False)
+    mgr.delete_node(var, interactive=False)
+    mgr._journal_op("delete_node", var)  # ops which no longer apply are skipped
+    var2 = mgr.add_variable(1, "myvar2", [1, 2])
+    objects = mgr.server_mgr.nodes.objects
+    assert modeler.expand_to_path([mgr.server_mgr.nodes.root.nodeid, objects.nodeid, var2.nodeid])
+    modeler.ui.treeView.setCurrentIndex(modeler.ui.treeView.currentIndex().sibling(0, 0))
+    assert modeler.tree_ui.get_current_node() != var2
+    dv = ua.DataValue(ua.Variant(ua.LocalizedText("renamed")))
+    var2.write_attribute(ua.AttributeIds.DisplayName, dv)
+    modeler.attrs_ui.attr_written.emit(ua.AttributeIds.DisplayName, dv)
+    # simulate a crash, journal is left behind
+    mgr._journal.close()
+    mgr._journal = None
+    mgr.close_model(force=True)
+
+    mgr.open_xml(path)
+    assert mgr.modified
+    names = [child.read_browse_name().Name for child in mgr.server_mgr.nodes.objects.get_children()]
+    assert "myfolder" not in names
+    assert "myvar" not in names
+    assert "myvar2" in names
+    assert [child.read_display_name().Text for child in mgr.server_mgr.nodes.objects.get_children()].count("renamed") == 1
+    assert mgr.server_mgr.nodes.objects.get_child("1:myvar2").read_display_name().Text == "renamed"
+    mgr.close_model(force=True)
+    assert not os.path.exists(str(tmp_path / "journal_recovery.journal"))
+
+
+def test_undo_redo(modeler, mgr, model):
+    modeler.tree_ui.expand_to_node("Objects")
+    objects = mgr.server_mgr.nodes.objects
+    folder = mgr.add_folder(1, "myfolder")
+    var = folder.add_variable(1, "myvar", 0.5)
+    folder.add_folder(1, "mysubfolder").add_property(1, "myprop", "val")
+
+    mgr.paste_node(folder)
+    copies = [n for n in objects.get_children() if n.read_browse_name().Name == "myfolder"]
+    assert len(copies) == 2
+    mgr.undo()
+    assert len([n for n in objects.get_children() if n.read_browse_name().Name == "myfolder"]) == 1
+    mgr.redo()
+    assert len([n for n in objects.get_children() if n.read_browse_name().Name == "myfolder"]) == 2
+
+    mgr.delete_node(folder, interactive=False)
+    assert folder not in objects.get_children()
+    mgr.undo()
+    assert folder in objects.get_children()
+    assert folder in mgr.new_nodes
+    assert var.read_value() == 0.5
+    assert var.read_display_name().Text == "myvar"
+    assert mgr.server_mgr.get_node(folder.nodeid).get_child(["1:mysubfolder", "1:myprop"]).read_value() == "val"
+
+    assert modeler.expand_to_path([mgr.server_mgr.nodes.root.nodeid, objects.nodeid])
+    dv = ua.DataValue(ua.Variant(ua.LocalizedText("renamed")))
+    objects.write_attribute(ua.AttributeIds.DisplayName, dv)
+    modeler.attrs_ui.attr_written.emit(ua.AttributeIds.DisplayName, dv)
+    mgr.undo()
+    assert objects.read_display_name().Text == "Objects"
+    mgr.redo()
+    assert objects.read_display_name().Text == "renamed"
+
+    # writes can be undone after the tree current node moved with the keyboard
+    assert modeler.expand_to_path([mgr.server_mgr.nodes.root.nodeid, objects.nodeid])
+    modeler.ui.treeView.setCurrentIndex(modeler.ui.treeView.currentIndex().parent())
+    dv = ua.DataValue(ua.Variant(ua.LocalizedText("renamed again")))
+    objects.write_attribute(ua.AttributeIds.DisplayName, dv)
+    modeler.attrs_ui.attr_written.emit(ua.AttributeIds.DisplayName, dv)
+    assert mgr.undo_stack.undo_text() == "Write DisplayName"
+    mgr.undo()
+    assert objects.read_display_name().Text == "renamed"
+
+    stack = UndoStack(max_depth=2)
+    for i in range(3):
+        stack.push(WriteAttributeCommand("", objects.nodeid, ua.AttributeIds.Value, None, None))
+    assert len(stack) == 2
+
+
+def test_save_structs_not_undoable(modeler, mgr, model, tmp_path):
+    path = [ua.ObjectIds.RootFolder, ua.ObjectIds.TypesFolder, ua.ObjectIds.DataTypesFolder, ua.ObjectIds.BaseDataType, ua.ObjectIds.Structure]
+    assert modeler.expand_to_path([ua.NodeId(nodeid) for nodeid in path])
+    mystruct = mgr.add_data_type(1, "MyStruct")
+    assert modeler.expand_to_path([ua.NodeId(nodeid) for nodeid in path] + [mystruct.nodeid])
+    mgr.add_variable(1, "MyFloat", 0.1, ua.VariantType.Float)
+    assert len(mgr.undo_stack) == 2
+    mgr.save_xml(str(tmp_path / "structs.xml"))
+    assert len(mgr.undo_stack) == 2
+    assert mgr.undo_stack.undo_text() == "Add variable"
+    assert [child.read_browse_name().Name for child in mystruct.get_children()] == ["MyFloat"]
+
+
+def test_streaming_import(modeler, mgr, model, monkeypatch, tmp_path):
+    path = str(tmp_path / "streaming_import.xml")
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "myfolder")
+    var = folder.add_variable(1, "myvar", [1, 2])
+    sub = folder.add_folder(1, "mysubfolder")
+    mgr.new_nodes.update([var, sub, sub.add_property(1, "myprop", "val")])
+    mgr.save_xml(path)
+    mgr.close_model()
+    # children before parents, nodes must wait for their parent
+    tree = Et.parse(path)
+    root = tree.getroot()
+    nodes = [el for el in root if el.tag.split("}")[-1].startswith("UA")]
+    for el in nodes:
+        root.remove(el)
+    root.extend(reversed(nodes))
+    tree.write(path)
+
+    mgr.new_model()
+    nodeids = mgr.server_mgr.import_xml(path, streaming=True, batch_size=2)
+    assert len(nodeids) == len(nodes)
+    folder = mgr.server_mgr.get_node(folder.nodeid)
+    assert folder.get_parent() == mgr.server_mgr.nodes.objects
+    assert mgr.server_mgr.get_node(var.nodeid).read_browse_name().Name == "myvar"
+    assert folder.get_child(["1:mysubfolder", "1:myprop"]).read_browse_name().Name == "myprop"
+    mgr.close_model(force=True)
+
+    # parent of nodes without ParentNodeId is found from the references of a previous batch
+    orphans_path = str(tmp_path / "streaming_orphans.xml")
+    for el in nodes:
+        root.remove(el)
+        if el.tag.endswith("UAVariable"):
+            # only the forward reference of the parent gives it
+            el.attrib.pop("ParentNodeId", None)
+            refs = next(child for child in el if child.tag.endswith("References"))
+            for ref in [ref for ref in refs if ref.get("IsForward") == "false"]:
+                refs.remove(ref)
+    root.extend(nodes)
+    tree.write(orphans_path)
+    mgr.new_model()
+    assert len(mgr.server_mgr.import_xml(orphans_path, streaming=True, batch_size=1)) == len(nodes)
+    folder = mgr.server_mgr.get_node(folder.nodeid)
+    assert mgr.server_mgr.get_node(var.nodeid).get_parent() == folder
+    assert folder.get_child(["1:mysubfolder", "1:myprop"]).read_browse_name().Name == "myprop"
+    mgr.close_model(force=True)
+
+    # asyncua without the internals the streaming importer relies on
+    monkeypatch.setattr(streaming_importer, "_IMPORTER_INTERNALS", ("_no_such_method",))
+    mgr.new_model()
+    assert len(mgr.server_mgr.import_xml(path, streaming=True)) == len(nodes)
+    assert mgr.server_mgr.get_node(var.nodeid).read_browse_name().Name == "myvar"
+
+
+def test_compressed_save_open(modeler, mgr, model, tmp_path):
+    path = str(tmp_path / "compressed.xml.gz")
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "myfolder")
+    mgr.save_xml(path)
+    mgr.save_ua_model(path)
+    with gzip.open(path) as f:
+        assert b"myfolder" in f.read()
+    mgr.close_model()
+
+    mgr.open(path)
+    assert mgr.server_mgr.get_node(folder.nodeid).read_browse_name().Name == "myfolder"
+    mgr.close_model()
+
+
+def test_binary_model(modeler, mgr, model, tmp_path):
+    path = str(tmp_path / "binary_model.uamb")
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "myfolder")
+    var = folder.add_variable(1, "myvar", [1, 2])
+    mgr.new_nodes.add(var)
+    objtype = mgr.server_mgr.nodes.base_object_type.add_object_type(1, "MyType")
+    obj = mgr.server_mgr.nodes.objects.add_object(1, "myobj", objtype)
+    mgr.new_nodes.update([objtype, obj])
+    assert mgr.save_ua_model(path) == path
+    mgr.close_model()
+    with BinaryModel(path) as bmodel:
+        assert bmodel.node_count == 4
+        assert bmodel.node_items(1, 2)[0].BrowseName.Name in ("myvar", "MyType", "myobj", "myfolder")
+
+    mgr.open(path)
+    assert mgr.binary_model
+    assert not mgr.modified
+    folder = mgr.server_mgr.get_node(folder.nodeid)
+    assert folder.get_parent() == mgr.server_mgr.nodes.objects
+    assert folder.get_child("1:myvar").read_value() == [1, 2]
+    assert mgr.server_mgr.get_node(obj.nodeid).read_type_definition() == objtype.nodeid
+    assert var.nodeid in mgr.new_nodes
+    mgr.close_model()
+
+
+def test_binary_model_reference_nodesets(modeler, mgr, model, tmp_path, monkeypatch):
+    nodeset = str(tmp_path / "reference.xml")
+    roundtrip.generate_nodeset(nodeset, nodes=10, uri="urn:test:reference")
+    modeler.nodesets_ui.import_nodeset(nodeset)
+    assert modeler.expand_to_path([mgr.server_mgr.nodes.root.nodeid, mgr.server_mgr.nodes.objects.nodeid])
+    mgr.add_folder(1, "myfolder")
+    path = mgr.save_ua_model(str(tmp_path / "model.uamb"))
+    mgr.close_model()
+    # the model is opened from another working directory
+    monkeypatch.chdir(tmp_path.parent)
+    mgr.open(path)
+    assert modeler.nodesets_ui.nodesets == ["reference.xml"]
+    assert "urn:test:reference" in mgr.server_mgr.get_namespace_array()
+    mgr.close_model()
+
+
+def test_type_definition_cache(mgr, model, tmp_path, monkeypatch):
+    server_mgr = mgr.server_mgr
+    server_mgr.type_cache = type_cache.TypeDefinitionCache(str(tmp_path))
+    builder = DataTypeDictionaryBuilder(server_mgr.get_server(), 1, server_mgr.get_namespace_array()[1], "MyCacheDict")
+    struct = builder.create_data_type("MyCachedStruct")
+    struct.add_field("MyInt", ua.VariantType.Int32)
+    builder.set_dict_byte_string()
+    server_mgr.load_type_definitions()
+    assert len(os.listdir(tmp_path)) == 1
+
+    # second load must not generate code again
+    monkeypatch.setattr(type_cache, "StructGenerator", None)
+    structs = server_mgr.load_type_definitions()
+    assert structs["MyCachedStruct"]().MyInt == 0
+    assert structs["MyCachedStruct"] in ua.typeid_by_extension_objects
+
+
+def _write_nodeset(path, uri, required=()):
+    idx = len(required) + 1
+    uris = "".join(f"<Uri>{req}</Uri>" for req in required)
+    reqs = "".join(f'<RequiredModel ModelUri="{req}" Version="1.0" PublicationDate="2020-01-01T00:00:00Z"/>' for req in required)
+    name = uri.rsplit(":", 1)[-1]
+    path.write_text(f"""<?xml version="1.0" encoding="utf-8"?>
+<UANodeSet xmlns="http://opcfoundation.org/UA/2011/03/UANodeSet.xsd">
+  <NamespaceUris>{uris}<Uri>{uri}</Uri></NamespaceUris>
+  <Models>
+    <Model ModelUri="{uri}" Version="1.0" PublicationDate="2020-01-01T00:00:00Z">{reqs}</Model>
+  </Models>
+  <UAObject NodeId="ns={idx};i=1" BrowseName="{idx}:{name}">
+    <DisplayName>{name}</DisplayName>
+    <References>
+      <Reference ReferenceType="Organizes" IsForward="false">i=85</Reference>
+      <Reference ReferenceType="HasTypeDefinition">i=61</Reference>
+    </References>
+  </UAObject>
+</UANodeSet>
+""")
+
+
+def test_nodeset_registry(modeler, mgr, model, tmp_path, monkeypatch):
+    nodesets = tmp_path / "nodesets"
+    nodesets.mkdir()
+    _write_nodeset(nodesets / "a.xml", "urn:test:a")
+    _write_nodeset(nodesets / "b.xml", "urn:test:b", ["urn:test:a"])
+    _write_nodeset(tmp_path / "model.xml", "urn:test:model", ["urn:test:b"])
+    index = str(tmp_path / "index.json")
+    modeler.nodesets_ui.registry = NodesetRegistry([str(nodesets)], index)
+    mgr.import_xml(str(tmp_path / "model.xml"))
+    assert modeler.nodesets_ui.nodesets == ["a.xml", "b.xml"]
+    assert mgr.server_mgr.get_namespace_array()[-3:] == ["urn:test:a", "urn:test:b", "urn:test:model"]
+
+    # index is reused, unchanged files are not read again
+    monkeypatch.setattr(nodeset_registry, "read_nodeset_header", None)
+    registry = NodesetRegistry([str(nodesets)], index)
+    assert registry.scan() == 0
+    assert registry.dependencies([{"uri": "urn:test:b"}]) == [str(nodesets / "a.xml"), str(nodesets / "b.xml")]
+
+
+def test_split_namespaces(modeler, mgr, model, tmp_path):
+    ns_node = mgr.server_mgr.get_node(ua.ObjectIds.Server_NamespaceArray)
+    uris = ns_node.read_value()
+    ns_node.write_value(uris + ["urn:test:equipment"])
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "myfolder")
+    equipment = folder.add_object(2, "myequipment")
+    mgr.new_nodes.add(equipment)
+    mgr.split_namespaces = True
+    mgr.new_nodes.add(ua.NodeId(ua.ObjectIds.Server))
+    with pytest.raises(ValueError):
+        mgr.save_xml(str(tmp_path / "split.uamodel"))
+    mgr.new_nodes.discard(ua.NodeId(ua.ObjectIds.Server))
+    mgr.save_xml(str(tmp_path / "split.uamodel"))
+    model_path = mgr.save_ua_model(str(tmp_path / "split.uamodel"))
+    mgr.close_model()
+
+    manifest = Et.parse(model_path).getroot()
+    paths = [el.attrib["path"] for el in manifest.findall("Model")]
+    assert paths == ["split.http_freeopcua_defaults_modeler.xml", "split.urn_test_equipment.xml"]
+    required = [el.attrib["ModelUri"] for el in Et.parse(tmp_path / paths[1]).getroot().iterfind(".//{*}RequiredModel")]
+    assert required == ["http://opcfoundation.org/UA/", uris[1]]
+    required = [el.attrib["ModelUri"] for el in Et.parse(tmp_path / paths[0]).getroot().iterfind(".//{*}RequiredModel")]
+    assert required == ["http://opcfoundation.org/UA/"]
+
+    mgr.open(model_path)
+    assert mgr.split_namespaces
+    assert mgr.server_mgr.get_node(equipment.nodeid).get_parent().nodeid == folder.nodeid
+    mgr.close_model()
+
+
+def test_change_namespaces(modeler, mgr, model, monkeypatch):
+    uris = mgr.server_mgr.get_namespace_array()
+    mgr.server_mgr.nodes.namespace_array.write_value(uris + ["urn:test:types", "urn:test:plant"])
+    objects = mgr.server_mgr.nodes.objects
+    pump_type = mgr.server_mgr.nodes.base_object_type.add_object_type(ua.NodeId("PumpType", 2), ua.QualifiedName("PumpType", 2))
+    speed = pump_type.add_variable(ua.NodeId("PumpType.Speed", 2), ua.QualifiedName("Speed", 2), 0.0)
+    plant = objects.add_folder(ua.NodeId("Plant", 3), ua.QualifiedName("Plant", 3))
+    pump = plant.add_object(ua.NodeId("Pump1", 3), ua.QualifiedName("Pump1", 3), pump_type.nodeid)
+    pump_speed = pump.add_variable(ua.NodeId("Pump1.Speed", 3), ua.QualifiedName("Speed", 2), 1.0)
+    valve = plant.add_variable(ua.NodeId("Valve", 3), ua.QualifiedName("Valve", 3), True)
+    spare = objects.add_object(ua.NodeId("SparePump", 1), ua.QualifiedName("SparePump", 1), pump_type.nodeid)
+    mgr.new_nodes.update([pump_type, speed, plant, pump, pump_speed, valve, spare])
+
+    # a change which fails is not journaled
+    ops = []
+    monkeypatch.setattr(mgr, "_journal_op", lambda op, *args: ops.append(op))
+    with monkeypatch.context() as patch:
+        patch.setattr(mgr.server_mgr, "renumber_namespaces", lambda *args: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            mgr.change_namespaces(uris + ["urn:test:plant", "urn:test:types"])
+    assert ops == []
+
+    assert mgr.change_namespaces(uris + ["urn:test:plant", "urn:test:types"]) == (0, 6)
+    assert mgr.server_mgr.get_namespace_array() == uris + ["urn:test:plant", "urn:test:types"]
+    plant = mgr.server_mgr.get_node(ua.NodeId("Plant", 2))
+    assert plant.read_browse_name() == ua.QualifiedName("Plant", 2)
+    assert plant.get_parent() == objects
+    pump = plant.get_child("2:Pump1")
+    assert pump.read_type_definition() == ua.NodeId("PumpType", 3)
+    assert pump.get_child("3:Speed").read_value() == 1.0
+    assert mgr.server_mgr.get_node(spare.nodeid).read_type_definition() == ua.NodeId("PumpType", 3)
+    assert ua.NodeId("Valve", 2) in mgr.new_nodes
+    assert ua.NodeId("Valve", 3) not in mgr.new_nodes
+    assert ua.NodeId("PumpType", 3) in mgr.new_nodes
+    assert ops == ["change_namespaces"]
+
+    # the spare pump and the instance of the type, with its variable, depend on the removed namespace
+    assert mgr.remove_namespace("urn:test:types") == (5, 0)
+    assert mgr.server_mgr.get_namespace_array() == uris + ["urn:test:plant"]
+    assert [child.nodeid for child in plant.get_children()] == [ua.NodeId("Valve", 2)]
+    assert spare.nodeid not in mgr.new_nodes
+    assert ua.NodeId("Pump1", 2) not in mgr.new_nodes
+    assert list(mgr.new_nodes) == [ua.NodeId("Plant", 2), ua.NodeId("Valve", 2)]
+    assert spare.nodeid not in [node.nodeid for node in objects.get_children()]
+    with pytest.raises(ValueError):
+        mgr.remove_namespace("urn:test:types")
+
+    # deleting nodes of the model does not walk the whole address space
+    monkeypatch.setattr(mgr.server_mgr._backend, "remove_references_to", lambda nodeids: 1 / 0)
+    mgr.remove_nodes([ua.NodeId("Valve", 2)])
+    assert [child.nodeid for child in plant.get_children()] == []
+
+
+def test_namespace_table_events(modeler, mgr, model):
+    table = mgr.server_mgr.namespaces
+    changes = []
+    table.observers.append(changes.append)
+    try:
+        version = table.version
+        idx = mgr.add_namespace("urn:test:events")
+        assert table.version == version + 1
+        assert list(changes[-1].added) == [idx] and not changes[-1].renamed
+        # writes by others, such as imports, are seen by the cache too
+        mgr.server_mgr.nodes.namespace_array.write_value(table.uris[:idx] + ["urn:test:renamed"])
+        assert table.version == version + 2
+        assert changes[-1].renamed == [idx]
+        assert mgr.server_mgr.get_namespace_array()[idx] == "urn:test:renamed"
+        with pytest.raises(ValueError):
+            mgr.set_namespace_uri(idx, table.uris[1])
+        mgr.set_namespace_uri(idx, "urn:test:renamed")
+        assert table.version == version + 2
+        QApplication.processEvents()
+        root = modeler.idx_ui.model.item(0, 0)
+        assert root.rowCount() == len(table)
+        assert root.child(idx, 2).text() == "urn:test:renamed"
+
+        # renumbered nodes are updated in place in the tree
+        folder = mgr.server_mgr.nodes.objects.add_folder(ua.NodeId("Area", idx), ua.QualifiedName("Area", idx))
+        level = folder.add_variable(ua.NodeId("Area.Level", idx), ua.QualifiedName("Level", idx), 1.0)
+        mgr.new_nodes.update([folder, level])
+        mgr.add_namespace("urn:test:last")
+        root_path = [mgr.server_mgr.nodes.root.nodeid, mgr.server_mgr.nodes.objects.nodeid]
+        assert modeler.expand_to_path(root_path + [folder.nodeid, level.nodeid])
+        assert modeler.expand_to_path(root_path + [folder.nodeid])
+        uris = table.uris[:idx] + ["urn:test:last", "urn:test:renamed"]
+        assert mgr.change_namespaces(uris) == (0, 2)
+        assert modeler.tree_ui.get_current_node().nodeid == ua.NodeId("Area", idx + 1)
+        current = modeler.ui.treeView.currentIndex()
+        assert current.sibling(current.row(), 1).data() == f"{idx + 1}:Area"
+        # children of renumbered items are fetched again with their new nodeids, expanded items stay expanded
+        assert modeler.ui.treeView.isExpanded(current)
+        area = modeler.tree_ui.model.itemFromIndex(current)
+        assert [area.child(row, 0).data(Qt.UserRole).nodeid for row in range(area.rowCount())] == [ua.NodeId("Area.Level", idx + 1)]
+        assert modeler.expand_to_path(root_path + [ua.NodeId("Area", idx + 1), ua.NodeId("Area.Level", idx + 1)])
+        # the current item is selected again when it was fetched again
+        uris = table.uris[:idx] + ["urn:test:renamed", "urn:test:last"]
+        assert mgr.change_namespaces(uris) == (0, 2)
+        assert modeler.tree_ui.get_current_node().nodeid == ua.NodeId("Area.Level", idx)
+        QApplication.processEvents()
+        assert [root.child(row, 2).text() for row in range(root.rowCount())] == uris
+    finally:
+        table.observers.remove(changes.append)
+
+
+def test_export_selection(modeler, mgr, model, tmp_path):
+    path = str(tmp_path / "export_selection.xml")
+    modeler.tree_ui.expand_to_node("Objects")
+    folder = mgr.add_folder(1, "myfolder")
+    other = mgr.add_folder(1, "otherfolder")
+    objtype = mgr.server_mgr.nodes.base_object_type.add_object_type(1, "MyType")
+    objtype.add_variable(1, "mytypevar", 1).set_modelling_rule(True)
+    subtype = objtype.add_object_type(1, "MySubType")
+    obj = folder.add_object(1, "myobj", objtype)
+    mgr.new_nodes.update([objtype, subtype, obj])
+
+    nodeids = mgr.export_selection([folder], path)
+    assert folder.nodeid in nodeids
+    assert obj.nodeid in nodeids
+    assert objtype.nodeid in nodeids
+    assert objtype.get_child("1:mytypevar").nodeid in nodeids
+    assert subtype.nodeid not in nodeids
+    assert other.nodeid not in nodeids
+    names = [el.find("{*}DisplayName").text for el in Et.parse(path).getroot() if el.tag.endswith("UAObject") or el.tag.endswith("UAObjectType")]
+    assert sorted(names) == ["MyType", "myfolder", "myobj"]
+
+
+def test_model_diff(modeler, mgr, model, capsys, tmp_path):
+    path = str(tmp_path / "model_diff.xml")
+    modeler.tree_ui.expand_to_node("Objects")
+    kept = mgr.add_folder(1, "kept")
+    removed = mgr.add_folder(1, "removed")
+    renamed = mgr.add_folder(1, "renamed")
+    mgr.save_xml(path)
+    assert not mgr.diff_with_file(path)
+
+    mgr.delete_node(removed, interactive=False)
+    renamed.write_attribute(ua.AttributeIds.DisplayName, ua.DataValue(ua.Variant(ua.LocalizedText("newname"))))
+    added = mgr.add_folder(1, "added")
+    diff = mgr.diff_with_file(path)
+    uri = mgr.server_mgr.get_namespace_array()[1]
+    key = lambda node: f"nsu={uri};i={node.nodeid.Identifier}"
+    assert diff.added == [key(added)]
+    assert diff.removed == [key(removed)]
+    assert diff.changed == {key(renamed): {"attributes": {"DisplayName": ["renamed", "newname"]}}}
+    modeler.show_diff(diff)
+    assert modeler.diff_ui.model.rowCount() == 3
+
+    other = str(tmp_path / "model_diff_2.xml")
+    mgr.save_xml(other)
+    assert model_diff.main([path, other, "-j", "1"]) == 1
+    assert json.loads(capsys.readouterr().out) == diff.to_dict()
+
+
+def test_merge(modeler, mgr, tmp_path):
+    base_path = str(tmp_path / "merge_base.xml")
+    their_path = str(tmp_path / "merge_theirs.xml")
+    mgr.new_model()
+    modeler.tree_ui.expand_to_node("Objects")
+    renamed, deleted, kept, conflicting = [mgr.add_folder(1, name) for name in ("renamed", "deleted", "kept", "conflicting")]
+    mgr.save_xml(base_path)
+    dname = lambda text: ua.DataValue(ua.Variant(ua.LocalizedText(text)))
+    renamed.write_attribute(ua.AttributeIds.DisplayName, dname("renamed2"))
+    conflicting.write_attribute(ua.AttributeIds.DisplayName, dname("theirs"))
+    mgr.delete_node(deleted, interactive=False)
+    added = mgr.add_folder(1, "added")
+    mgr.save_xml(their_path)
+    mgr.close_model(True)
+
+    mgr.open(base_path)
+    node = mgr.server_mgr.get_node
+    node(kept.nodeid).write_attribute(ua.AttributeIds.DisplayName, dname("kept2"))
+    node(conflicting.nodeid).write_attribute(ua.AttributeIds.DisplayName, dname("ours"))
+    plan = mgr.merge(base_path, their_path)
+    assert node(renamed.nodeid).read_display_name().Text == "renamed2"
+    assert node(kept.nodeid).read_display_name().Text == "kept2"
+    assert node(conflicting.nodeid).read_display_name().Text == "ours"
+    assert added.nodeid in mgr.new_nodes
+    assert node(added.nodeid).read_browse_name().Name == "added"
+    assert deleted.nodeid not in mgr.new_nodes
+    assert node(added.nodeid) in mgr.server_mgr.nodes.objects.get_children()
+    assert node(deleted.nodeid) not in mgr.server_mgr.nodes.objects.get_children()
+    assert [(c["kind"], c["attribute"], c["ours"], c["theirs"]) for c in plan.conflicts] == [("attribute", "DisplayName", "ours", "theirs")]
+
+    mgr.resolve_conflicts(their_path, plan.conflicts)
+    assert node(conflicting.nodeid).read_display_name().Text == "theirs"
+    mgr.close_model(True)
+
+
+def test_validation(modeler, mgr, model):
+    modeler.tree_ui.expand_to_node("Objects")
+    first = mgr.add_folder(1, "folder")
+    second = mgr.add_folder(1, "folder")
+    objtype = mgr.server_mgr.nodes.base_object_type.add_object_type(1, "MyType")
+    obj = mgr.server_mgr.nodes.objects.add_object(1, "myobj", objtype)
+    mgr.new_nodes.add(obj)
+    mgr.server_mgr.delete_nodes([objtype.nodeid], delete_references=False)
+    mgr.server_mgr.get_server().register_namespace("urn:unused")
+
+    issues = mgr.validate()
+    found = sorted((issue.rule, issue.nodeid) for issue in issues if issue.severity == validation.ERROR)
+    assert found == [("Dangling reference", obj.nodeid), ("Duplicate BrowseName", first.nodeid),
+                     ("Duplicate BrowseName", second.nodeid), ("Type definition", obj.nodeid)]
+    assert [issue.message for issue in issues if issue.rule == "Unused namespace"] == ["Namespace urn:unused is not used by the model"]
+
+    # only the renamed node and its siblings are checked again
+    mgr.write_attribute_value(second.nodeid, ua.AttributeIds.BrowseName, ua.DataValue(ua.Variant(ua.QualifiedName("other", 1))))
+    issues = mgr.validate()
+    assert sorted(issue.rule for issue in issues) == ["Dangling reference", "Type definition", "Unused namespace"]
+    modeler.show_issues(issues)
+    assert modeler.validation_ui.model.rowCount() == 3
+
+    # nodes referencing a deleted node are checked again
+    other_type = mgr.server_mgr.nodes.base_object_type.add_object_type(1, "MyOtherType")
+    other = mgr.server_mgr.nodes.objects.add_object(1, "myotherobj", other_type)
+    mgr.new_nodes.update([other_type, other])
+    mgr.changes.mark([other_type, other], Change.CREATED)
+    assert not [issue for issue in mgr.validate() if issue.nodeid == other.nodeid]
+    mgr.delete_node(other_type, interactive=False)
+    assert [issue.message for issue in mgr.validate() if issue.nodeid == other.nodeid] == ["Node has no type definition"]
+
+
+def test_roundtrip(modeler, mgr, tmp_path):
+    path = roundtrip.generate_nodeset(str(tmp_path / "generated.xml"), nodes=30, folder_size=10)
+    # values are not exported by save
+    result = roundtrip.roundtrip(mgr, path, str(tmp_path), ignore=("Value",))
+    assert result["ok"], result
+    assert result["nodes"] == 30
+    assert sorted(result["phases"]) == ["open", "reopen", "save"]
+    result = roundtrip.roundtrip(mgr, path, str(tmp_path))
+    assert not result["ok"]
+    assert set(name for names in result["changed"].values() for name in names) == {"Value"}
+
+
+def test_add_tags(modeler, mgr, model, tmp_path, monkeypatch):
+    path = tmp_path / "tags.csv"
+    path.write_text("Path;Tag Name;Data Type;Array Rank;Initial Value;NodeId\n"
+                    "Line1/Motor;speed;Double;;1.5;\n"
+                    "Line1/Motor;temps;Int32;1;1,2,3;\n"
+                    "Line1;count;UInt16;;7;\"ns=1;s=Line1.count\"\n"
+                    "\n"
+                    "Line1;bad;NoSuchType;;;\n"
+                    "Line2;name;String;;text;\n")
+    modeler.tree_ui.expand_to_node("Objects")
+    nodes = mgr.add_tags(str(path), 1)
+    assert len(nodes) == 7
+    objects = mgr.server_mgr.nodes.objects
+    motor = objects.get_child(["1:Line1", "1:Motor"])
+    assert motor.read_type_definition() == ua.NodeId(ua.ObjectIds.FolderType)
+    assert motor.get_child("1:speed").read_value() == 1.5
+    temps = motor.get_child("1:temps")
+    assert temps.read_value() == [1, 2, 3]
+    assert temps.read_value_rank() == 1
+    count = mgr.server_mgr.get_node("ns=1;s=Line1.count")
+    assert count.read_value() == 7
+    assert count.read_data_type() == ua.NodeId(ua.ObjectIds.UInt16)
+    assert all(node in mgr.new_nodes for node in nodes)
+
+    # existing folders are reused, batches split tags of the same folder
+    children = len(objects.get_children())
+    importer = TagImporter(mgr.server_mgr, objects.nodeid, 1, batch_size=1)
+    importer.run(read_tags(str(path)))
+    assert len(objects.get_children()) == children
+    assert len(objects.get_child("1:Line1").get_children()) == 2
+    assert [line for line, _ in importer.errors] == [4, 6]
+
+    # a folder that cannot be created fails its tags, the nodes already created stay tracked
+    folder_item = TagImporter._folder_item
+
+    def failing_folder_item(self, path):
+        item = folder_item(self, path)
+        if path == ("Line3",):
+            item.RequestedNewNodeId = count.nodeid
+        return item
+
+    monkeypatch.setattr(TagImporter, "_folder_item", failing_folder_item)
+    path.write_text("Path;Tag Name;Data Type;Array Rank;Initial Value;NodeId\n"
+                    "Line4;ok;Int32;;1;\n"
+                    "Line3/Sub;lost;Int32;;2;\n")
+    nodes = mgr.add_tags(str(path), 1)
+    assert len(nodes) == 2
+    assert all(node in mgr.new_nodes for node in nodes)
+    assert objects.get_child(["1:Line4", "1:ok"]).read_value() == 1
+    mgr.undo()
+    with pytest.raises(ua.UaError):
+        objects.get_child("1:Line4")
+
+    mgr.undo()
+    with pytest.raises(ua.UaError):
+        objects.get_child("1:Line2")
+
+
+def test_instantiation_plans(modeler, mgr, model):
+    from asyncua.sync import instantiate
+    base_type = mgr.server_mgr.nodes.base_object_type.add_object_type(1, "Device")
+    base_type.add_variable(1, "serial", "").set_modelling_rule(True)
+    motor_type = base_type.add_object_type(1, "Motor")
+    speed = motor_type.add_variable(1, "speed", 1.5)
+    speed.set_modelling_rule(True)
+    speed.add_property(1, "unit", "rpm").set_modelling_rule(True)
+    motor_type.add_variable(1, "torque", 0.0).set_modelling_rule(False)
+    motor_type.add_variable(1, "internal", 0)  # no modelling rule, not instantiated
+
+    def tree(node):
+        attrs = node.read_attributes([ua.AttributeIds.NodeClass, ua.AttributeIds.BrowseName, ua.AttributeIds.Value])
+        children = sorted((tree(child) for child in node.get_children()), key=str)
+        return [attr.Value.Value for attr in attrs] + [node.read_type_definition(), children]
+
+    expected = tree(instantiate(mgr.server_mgr.nodes.objects, motor_type, bname="1:motor", idx=1)[0])
+    modeler.tree_ui.expand_to_node("Objects")
+    nodes = mgr.add_object(ua.NodeId(NamespaceIndex=1), ua.QualifiedName("motor", 1), motor_type)
+    assert len(nodes) == 5
+    assert tree(nodes[0]) == expected
+    assert build_plan(mgr.server_mgr, motor_type.nodeid, instantiate_optional=False).size() == 4
+
+    nodes = mgr.add_objects(ua.NodeId("Motor", 1), ua.QualifiedName("motor", 1), motor_type, 3)
+    assert len(nodes) == 15
+    motor3 = mgr.server_mgr.get_node("ns=1;s=Motor3")
+    assert motor3.read_browse_name() == ua.QualifiedName("motor3", 1)
+    assert mgr.server_mgr.get_node("ns=1;s=Motor3.speed.unit").read_value() == "rpm"
+    assert all(node in mgr.new_nodes for node in nodes)
+
+    # plan is built again when a declaration changes
+    plan = mgr.instance_plans.get(motor_type.nodeid)
+    mgr.delete_node(motor_type.get_child("1:torque"), interactive=False)
+    assert mgr.instance_plans.get(motor_type.nodeid) is not plan
+    assert mgr.instance_plans.get(motor_type.nodeid).size() == 4
+
+
+def test_edit_selection(modeler, mgr, model):
+    modeler.tree_ui.expand_to_node("Objects")
+    folders = [mgr.add_folder(1, f"folder{idx}") for idx in range(3)]
+    tree = modeler.tree_ui.model
+    tree.fetchMore(tree.match(tree.index(0, 0), Qt.DisplayRole, "Objects", 1, Qt.MatchExactly | Qt.MatchRecursive)[0])
+    dv = ua.DataValue(ua.Variant(ua.LocalizedText("renamed")))
+    mgr.write_attribute_to_nodes(folders, ua.AttributeIds.DisplayName, dv)
+    assert [folder.read_display_name().Text for folder in folders] == ["renamed"] * 3
+    assert all(folder in mgr.changes for folder in folders)
+    assert len(tree.match(tree.index(0, 0), Qt.DisplayRole, "renamed", -1, Qt.MatchExactly | Qt.MatchRecursive)) == 3
+    mgr.undo()
+    assert [folder.read_display_name().Text for folder in folders] == ["folder0", "folder1", "folder2"]
+
+    mandatory = ua.NodeId(ua.ObjectIds.ModellingRule_Mandatory)
+    optional = ua.NodeId(ua.ObjectIds.ModellingRule_Optional)
+    folders[0].set_modelling_rule(False)
+    mgr.set_modelling_rule(folders, mandatory)
+    assert [folder.get_referenced_nodes(ua.ObjectIds.HasModellingRule) for folder in folders] == [[mgr.server_mgr.get_node(mandatory)]] * 3
+    mgr.undo()
+    assert folders[0].get_referenced_nodes(ua.ObjectIds.HasModellingRule) == [mgr.server_mgr.get_node(optional)]
+    assert folders[1].get_referenced_nodes(ua.ObjectIds.HasModellingRule) == []
+
+    organizes = ua.NodeId(ua.ObjectIds.Organizes)
+    mgr.change_references([(folder.nodeid, organizes, folders[0].nodeid, True) for folder in folders[1:]])
+    assert all(folder.get_referenced_nodes(organizes, ua.BrowseDirection.Forward) == [folders[0]] for folder in folders[1:])
+    mgr.undo()
+    assert all(folder.get_referenced_nodes(organizes, ua.BrowseDirection.Forward) == [] for folder in folders[1:])
+
+
+def test_import_from_server(modeler, mgr, model):
+    from asyncua.sync import Server
+    url = f"opc.tcp://127.0.0.1:{free_port()}/remote/"
+    remote = Server()
+    remote.set_endpoint(url)
+    remote.register_namespace("urn:remote:other")
+    idx = remote.register_namespace("urn:remote:plant")
+    pump_type = remote.nodes.base_object_type.add_object_type(idx, "PumpType")
+    pump_type.add_variable(idx, "flow", 0.0).set_modelling_rule(True)
+    plant = remote.nodes.objects.add_folder(ua.NodeId("Plant", idx), "Plant")
+    pump = plant.add_object(ua.NodeId("Plant.Pump1", idx), "Pump1", pump_type.nodeid)
+    pump.get_child(f"{idx}:flow").write_value(2.5)
+    plant.add_property(idx, "type", pump_type.nodeid)
+    remote.start()
+    try:
+        # small batches and few references per browse to go through BrowseNext
+        limits = RequestLimits(sessions=3, nodes_per_browse=50, nodes_per_read=40, references_per_node=3)
+        types = mgr.server_mgr.import_from_server(url, [ua.NodeId(ua.ObjectIds.TypesFolder)], limits=limits)
+        nodes = mgr.import_from_server(url, [f"ns={idx};s=Plant"])
+    finally:
+        remote.stop()
+    uris = mgr.server_mgr.get_namespace_array()
+    local_idx = uris.index("urn:remote:plant")
+    assert "urn:remote:other" not in uris
+    assert len(types) == 2
+    local_type = mgr.server_mgr.nodes.base_object_type.get_child(f"{local_idx}:PumpType")
+    rules = local_type.get_child(f"{local_idx}:flow").get_referenced_nodes(ua.ObjectIds.HasModellingRule)
+    assert rules == [mgr.server_mgr.get_node(ua.ObjectIds.ModellingRule_Mandatory)]
+
+    assert len(nodes) == 4
+    assert all(nodeid in mgr.new_nodes for nodeid in nodes)
+    local_plant = mgr.server_mgr.get_node(ua.NodeId("Plant", local_idx))
+    assert local_plant.get_parent() == mgr.server_mgr.nodes.objects
+    local_pump = local_plant.get_child("Pump1")
+    assert local_pump.read_type_definition() == local_type.nodeid
+    assert local_pump.get_child(f"{local_idx}:flow").read_value() == 2.5
+    assert local_plant.get_child(f"{local_idx}:type").read_value() == local_type.nodeid
+
+
+def test_import_from_server_unreadable_node():
+    import asyncio
+    readable, denied = NodeState(ua.NodeId("Plant", 1)), NodeState(ua.NodeId("Secret", 1))
+    values = {ua.AttributeIds.NodeClass: ua.Variant(ua.NodeClass.Object.value, ua.VariantType.Int32),
+              ua.AttributeIds.BrowseName: ua.Variant(ua.QualifiedName("Plant", 1))}
+
+    async def read(pairs):
+        bad = ua.DataValue(StatusCode=ua.StatusCode(ua.StatusCodes.BadUserAccessDenied))
+        return [ua.DataValue(values[attr]) if attr in values and nodeid != denied.nodeid else bad for nodeid, attr in pairs]
+
+    walker = RemoteWalker([], RequestLimits())
+    walker.read = read
+    states = asyncio.run(walker._read_states([readable, denied]))
+    assert states == [readable]
+    assert readable.nodeclass == ua.NodeClass.Object
+    assert readable.browse_name == ua.QualifiedName("Plant", 1)
+
+
+def test_load_test(modeler, mgr, model):
+    import asyncio
+    folder = mgr.server_mgr.nodes.objects.add_folder(1, "Load")
+    variables = [folder.add_variable(1, f"var{idx}", float(idx)).nodeid for idx in range(20)]
+    variables.append(folder.add_variable(1, "text", "text").nodeid)
+    nodeids = [folder.nodeid] + variables
+    assert loadtest.model_variables(mgr.server_mgr, nodeids) == variables
+    config = loadtest.LoadTestConfig(workers=2, batch_size=8, monitored_items=5, duration=0.5, update_rate=10, publishing_interval=50)
+    report = asyncio.run(loadtest.run_load_test(mgr.endpoint, nodeids, variables, config, mgr.server_mgr))
+    assert report["browse"]["requests"] == 2 * 3
+    assert report["browse"]["operations"] == 2 * len(nodeids)
+    assert report["read"]["operations"] == 2 * len(variables)
+    assert report["write"]["requests"] == 5
+    assert report["write"]["errors"] == 0
+    assert report["monitored_items"] == 5
+    assert report["notifications_expected"] == 2 * 5 * 5
+    assert 0 < report["notification"]["requests"] <= report["notifications_expected"]
+    for phase in ("browse", "read", "write", "notification"):
+        assert report[phase]["p50_ms"] <= report[phase]["p99_ms"] <= report[phase]["max_ms"]
+
+
+def test_simulation(modeler, mgr, model, tmp_path):
+    import time
+    folder = mgr.server_mgr.nodes.objects.add_folder(1, "Simulated")
+    doubles = [folder.add_variable(1, f"double{idx}", 0.0) for idx in range(3)]
+    count = folder.add_variable(1, "count", 0, ua.VariantType.Int32)
+    text = folder.add_variable(1, "text", "text")
+    nodeids = [node.nodeid for node in doubles + [count, text]]
+    mgr.start_simulation(Ramp(0, 100, period=1), rate=50, nodeids=nodeids)
+    assert modeler.actionSimulate.isChecked()
+    time.sleep(0.3)
+    values = [node.read_value() for node in doubles]
+    assert all(0 < value < 100 for value in values)
+    assert len(set(values)) == 3  # each variable has its own phase
+    assert text.read_value() == "text"
+    # values written by the user while simulated are kept instead of the original ones
+    mgr.write_attribute_value(doubles[1].nodeid, ua.AttributeIds.Value, ua.DataValue(ua.Variant(42.0, ua.VariantType.Double)))
+    report = mgr.stop_simulation()
+    assert not modeler.actionSimulate.isChecked()
+    assert report["variables"] == 4
+    assert report["ticks"] > 1
+    assert report["write_errors"] == 0
+    assert report["actual_rate"] > 0
+    assert [node.read_value() for node in doubles + [count]] == [0.0, 42.0, 0.0, 0]
+
+    path = tmp_path / "values.csv"
+    path.write_text("a;b\n1.5;7\n")
+    mgr.start_simulation(Replay(str(path)), rate=50, nodeids=[doubles[0].nodeid, count.nodeid])
+    time.sleep(0.1)
+    assert doubles[0].read_value() == 1.5
+    assert count.read_value() == 7
+    mgr.save_xml(str(tmp_path / "simulation"))
+    assert mgr.simulation is None
+    assert doubles[0].read_value() == 0.0
+
+
+def test_export_loader(mgr, model, tmp_path):
+    import asyncio
+    from asyncua import Server
+    mgr.import_xml(roundtrip.generate_nodeset(str(tmp_path / "generated.xml"), nodes=300, structs=1))
+    uri = "urn:uamodeler:roundtrip"
+    model_idx = mgr.server_mgr.get_namespace_array().index(uri)
+    var = mgr.server_mgr.nodes.objects.get_child([f"{model_idx}:Folder1", f"{model_idx}:Var101"])
+    struct = mgr.server_mgr.get_node(ua.NodeId(1001, model_idx))
+    fields = [node.nodeid for node in struct.get_children()]
+    undo_count = len(mgr.undo_stack)
+    path = str(tmp_path / "generated_loader.py")
+    times = mgr.export_loader(path)
+    # design nodes of structures are back with their nodeids, undo and journal still apply
+    assert [node.nodeid for node in struct.get_children()] == fields
+    assert all(nodeid in mgr.new_nodes for nodeid in fields)
+    assert len(mgr.undo_stack) == undo_count
+    assert times["loader_nodes"] == times["xml_nodes"] == len(mgr.new_nodes) - len(fields)
+    assert times["loader_seconds"] > 0 and times["xml_seconds"] > 0
+
+    async def load():
+        server = Server()
+        await server.init()
+        nodeids = await import_loader(path).load(server)
+        idx = await server.get_namespace_index(uri)
+        assert idx != model_idx  # the server has its own namespace, indexes are remapped
+        folder = await server.nodes.objects.get_child(f"{idx}:Folder1")
+        assert len(await folder.get_children()) == 99
+        loaded = await folder.get_child(f"{idx}:Var101")
+        assert loaded.nodeid == ua.NodeId(var.nodeid.Identifier, idx)
+        assert await loaded.read_value() == var.read_value()
+        assert await loaded.read_data_type() == var.read_data_type()
+        return nodeids
+
+    assert len(asyncio.run(load())) == len(mgr.new_nodes) - len(fields)
@@ -0,0 +1,152 @@
+"""
+Binary model file, an alternative to NodeSet2 XML which can be loaded without parsing.
+Nodes and references are stored as OPC UA binary encoded AddNodesItem and
+AddReferencesItem, ready to be sent to the server in bulk. An index of item
+offsets at the end of the file allows reading any range of items from the
+memory mapped file without decoding the ones before.
+
+Layout: header, metadata (namespace table, reference nodesets with their
+fingerprint, current node), node items, reference items, node offsets, reference offsets
+"""
+
+import os
+import sys
+import mmap
+import array
+import struct
+import hashlib
+import logging
+
+from asyncua import ua
+from asyncua.ua import ua_binary
+from asyncua.common.utils import Buffer
+
+logger = logging.getLogger(__name__)
+
+BINARY_MODEL_EXTENSION = ".uamb"
+MAGIC = b"UAMB\x01\x00\x00\x00"
+# magic, metadata offset, node count, references count, node index offset, reference index offset
+_header = struct.Struct("<8sQQQQQ")
+
+
+def file_fingerprint(path):
+    """
+    sha256 of file content, to detect reference nodesets modified since model was saved
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _encode_metadata(namespaces, nodesets, current_node):
+    data = [ua_binary.Primitives.Int32.pack(len(namespaces))]
+    data.extend(ua_binary.Primitives.String.pack(uri) for uri in namespaces)
+    data.append(ua_binary.Primitives.Int32.pack(len(nodesets)))
+    for name, fingerprint in nodesets:
+        data.append(ua_binary.Primitives.String.pack(name))
+        data.append(ua_binary.Primitives.ByteString.pack(fingerprint))
+    data.append(ua_binary.nodeid_to_binary(current_node if current_node is not None else ua.NodeId()))
+    return b"".join(data)
+
+
+def _write_items(f, items, offsets):
+    for item in items:
+        offsets.append(f.tell())
+        f.write(ua_binary.struct_to_binary(item))
+
+
+def write_binary_model(path, namespaces, nodesets, current_node, nodes, references):
+    """
+    write model to path. nodesets is a list of (name, fingerprint),
+    nodes and references lists of AddNodesItem and AddReferencesItem
+    """
+    tmp_path = path + ".tmp"
+    node_offsets = array.array("Q")
+    ref_offsets = array.array("Q")
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _header.size)
+        metadata_offset = f.tell()
+        f.write(_encode_metadata(namespaces, nodesets, current_node))
+        _write_items(f, nodes, node_offsets)
+        node_offsets.append(f.tell())  # indexes end with the end of last item
+        _write_items(f, references, ref_offsets)
+        ref_offsets.append(f.tell())
+        if sys.byteorder == "big":
+            # offsets are little endian like the header and the items
+            node_offsets.byteswap()
+            ref_offsets.byteswap()
+        node_index_offset = f.tell()
+        f.write(node_offsets.tobytes())
+        ref_index_offset = f.tell()
+        f.write(ref_offsets.tobytes())
+        f.seek(0)
+        f.write(_header.pack(MAGIC, metadata_offset, len(nodes), len(references), node_index_offset, ref_index_offset))
+    os.replace(tmp_path, path)
+    logger.info("Wrote %s nodes and %s references to %s", len(nodes), len(references), path)
+
+
+class BinaryModel(object):
+    """
+    read only view of a memory mapped binary model file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header()
+        except:
+            self.close()
+            raise
+
+    def _read_header(self):
+        if len(self._mmap) < _header.size:
+            raise ValueError(f"{self.path} is not a binary model file")
+        magic, metadata_offset, self.node_count, self.reference_count, node_index, ref_index = _header.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a binary model file")
+        self._node_offsets = self._read_index(node_index, self.node_count)
+        self._ref_offsets = self._read_index(ref_index, self.reference_count)
+        buf = Buffer(self._mmap, metadata_offset, self._node_offsets[0] - metadata_offset)
+        self.namespaces = [ua_binary.Primitives.String.unpack(buf) for _ in range(ua_binary.Primitives.Int32.unpack(buf))]
+        self.nodesets = []
+        for _ in range(ua_binary.Primitives.Int32.unpack(buf)):
+            name = ua_binary.Primitives.String.unpack(buf)
+            self.nodesets.append((name, ua_binary.Primitives.ByteString.unpack(buf)))
+        current_node = ua_binary.nodeid_from_binary(buf)
+        self.current_node = None if current_node.is_null() else current_node
+
+    def _read_index(self, offset, count):
+        offsets = array.array("Q")
+        offsets.frombytes(self._mmap[offset:offset + (count + 1) * offsets.itemsize])
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        return offsets
+
+    def _items(self, objtype, offsets, start, stop):
+        start_offset = offsets[start]
+        buf = Buffer(self._mmap, start_offset, offsets[stop] - start_offset)
+        return [ua_binary.struct_from_binary(objtype, buf) for _ in range(stop - start)]
+
+    def node_items(self, start=0, stop=None):
+        """
+        decode AddNodesItem from start to stop
+        """
+        stop = self.node_count if stop is None else min(stop, self.node_count)
+        return self._items(ua.AddNodesItem, self._node_offsets, start, stop)
+
+    def reference_items(self, start=0, stop=None):
+        stop = self.reference_count if stop is None else min(stop, self.reference_count)
+        return self._items(ua.AddReferencesItem, self._ref_offsets, start, stop)
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,134 @@
+"""
+Transparent compression of nodeset files, picked by file extension.
+Writing compresses in a separate thread so compression overlaps with
+serialization of the xml tree
+"""
+
+import io
+import os
+import gzip
+import queue
+import logging
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError as ex:
+    logger.info("Could not import zstandard, .zst files are not supported: %s", ex)
+    zstandard = None
+
+COMPRESSIONS = (".gz", ".zst")
+
+
+def split_compression(path):
+    """
+    return path without compression extension and the extension, or "" if not compressed
+    """
+    for ext in COMPRESSIONS:
+        if path.lower().endswith(ext):
+            return path[:-len(ext)], ext
+    return path, ""
+
+
+def is_compressed(path):
+    return bool(split_compression(path)[1])
+
+
+def is_xml(path):
+    return split_compression(path)[0].lower().endswith(".xml")
+
+
+def _check_zstd():
+    if zstandard is None:
+        raise RuntimeError("Python module zstandard is required for .zst files")
+
+
+def open_decompressed(path):
+    """
+    return a binary file object reading the decompressed content of path
+    """
+    ext = split_compression(path)[1]
+    if ext == ".gz":
+        return gzip.open(path, "rb")
+    if ext == ".zst":
+        _check_zstd()
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def _open_compressor(fileobj, ext):
+    if ext == ".gz":
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=6)
+    _check_zstd()
+    return zstandard.ZstdCompressor(level=3).stream_writer(fileobj, closefd=False)
+
+
+class _CompressingWriter(io.RawIOBase):
+    """
+    write end of a pipe to a thread compressing data and writing it to fileobj
+    """
+
+    def __init__(self, fileobj, ext, queue_size=8):
+        io.RawIOBase.__init__(self)
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = Thread(target=self._run, args=(fileobj, ext), daemon=True)
+        self._thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def _run(self, fileobj, ext):
+        try:
+            with _open_compressor(fileobj, ext) as out:
+                while True:
+                    data = self._queue.get()
+                    if data is None:
+                        return
+                    out.write(data)
+        except Exception as ex:
+            self._error = ex
+            while self._queue.get() is not None:
+                pass  # unblock writer until it closes us
+
+    def close(self):
+        if self.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        io.RawIOBase.close(self)
+        if self._error is not None:
+            raise self._error
+
+
+def write_compressed(path, write_func, buffer_size=1024 * 1024):
+    """
+    call write_func with a binary file object and store what it writes
+    compressed at path, compression is picked from the extension of path.
+    File is written to a temporary file first and replaced at the end
+    """
+    ext = split_compression(path)[1]
+    if not ext:
+        raise ValueError(f"{path} has no compression extension")
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as fileobj:
+            writer = _CompressingWriter(fileobj, ext)
+            buffered = io.BufferedWriter(writer, buffer_size)
+            try:
+                write_func(buffered)
+            finally:
+                buffered.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
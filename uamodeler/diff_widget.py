@@ -0,0 +1,62 @@
+import logging
+
+from PyQt5.QtCore import pyqtSignal, QObject
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+
+from uawidgets.utils import trycatchslot
+
+
+logger = logging.getLogger(__name__)
+
+
+class DiffWidget(QObject):
+    """
+    Show added, removed and changed nodes of a ModelDiff in a tree view
+    """
+
+    error = pyqtSignal(Exception)
+
+    def __init__(self, view, max_rows=5000):
+        QObject.__init__(self, view)
+        self.view = view
+        self.max_rows = max_rows
+        self.model = QStandardItemModel()
+        self.view.setModel(self.model)
+        self.model.setHorizontalHeaderLabels(['Node', 'Old', 'New'])
+
+    @trycatchslot
+    def show_diff(self, diff):
+        self.model.removeRows(0, self.model.rowCount())
+        self._add_group("Added", [[QStandardItem(nodeid)] for nodeid in diff.added])
+        self._add_group("Removed", [[QStandardItem(nodeid)] for nodeid in diff.removed])
+        self._add_group("Changed", [self._changed_row(nodeid, change) for nodeid, change in sorted(diff.changed.items())])
+        self.view.expandToDepth(0)
+        self.view.resizeColumnToContents(0)
+
+    def _add_group(self, name, rows):
+        item = QStandardItem(f"{name} ({len(rows)})")
+        for row in rows[:self.max_rows]:
+            item.appendRow(row)
+        if len(rows) > self.max_rows:
+            item.appendRow([QStandardItem(f"... {len(rows) - self.max_rows} more")])
+        self.model.appendRow([item])
+
+    def _changed_row(self, nodeid, change):
+        item = QStandardItem(nodeid)
+        if "nodeclass" in change:
+            item.appendRow([QStandardItem("NodeClass")] + [QStandardItem(val) for val in change["nodeclass"]])
+        for name, (old, new) in change.get("attributes", {}).items():
+            item.appendRow([QStandardItem(name), QStandardItem(old or ""), QStandardItem(new or "")])
+        refs = change.get("references", {})
+        for reftype, target, forward in refs.get("removed", []):
+            item.appendRow([QStandardItem("Reference"), QStandardItem(self._ref_text(reftype, target, forward)), QStandardItem("")])
+        for reftype, target, forward in refs.get("added", []):
+            item.appendRow([QStandardItem("Reference"), QStandardItem(""), QStandardItem(self._ref_text(reftype, target, forward))])
+        return [item]
+
+    @staticmethod
+    def _ref_text(reftype, target, forward):
+        return f"{reftype} {'->' if forward else '<-'} {target}"
+
+    def clear(self):
+        self.model.removeRows(0, self.model.rowCount())
@@ -0,0 +1,246 @@
+"""
+Instantiation of object types from cached plans.
+asyncua instantiate() browses the type, its supertypes and all their instance
+declarations for every new object. Here the declarations of a type are read
+once, level by level with batched Browse and Read calls, into a plan which is
+kept until a node it was built from changes. Running a plan creates any number
+of instances with one AddNodes call per level of the plan.
+Instances are the same as the ones created by asyncua instantiate()
+"""
+
+import copy
+import logging
+from dataclasses import fields
+
+from asyncua import ua
+
+from uamodeler.node_tracker import node_key
+
+logger = logging.getLogger(__name__)
+
+_ATTRIBUTES_CLASSES = {
+    ua.NodeClass.Object: ua.ObjectAttributes,
+    ua.NodeClass.ObjectType: ua.ObjectAttributes,
+    ua.NodeClass.Variable: ua.VariableAttributes,
+    ua.NodeClass.VariableType: ua.VariableAttributes,
+    ua.NodeClass.Method: ua.MethodAttributes,
+    ua.NodeClass.DataType: ua.DataTypeAttributes,
+}
+_INSTANCE_CLASSES = {
+    ua.NodeClass.ObjectType: ua.NodeClass.Object,
+    ua.NodeClass.VariableType: ua.NodeClass.Variable,
+}
+# attributes asyncua does not copy from declarations
+_NOT_COPIED = ("BodyLength", "TypeId", "SpecifiedAttributes", "Encoding", "IsAbstract", "EventNotifier")
+_ABSTRACT_CLASSES = (ua.NodeClass.ObjectType, ua.NodeClass.DataType, ua.NodeClass.ReferenceType)
+_OPTIONAL_RULES = (ua.NodeId(ua.ObjectIds.ModellingRule_Optional), ua.NodeId(ua.ObjectIds.ModellingRule_OptionalPlaceholder))
+
+
+def _attribute_names(nodeclass):
+    return [f.name for f in fields(_ATTRIBUTES_CLASSES[nodeclass]) if not f.name.startswith("_") and f.name not in _NOT_COPIED]
+
+
+class Declaration(object):
+    """
+    a node to create for each instance, with the attributes copied from its declaration
+    """
+    __slots__ = ("nodeid", "nodeclass", "browse_name", "reftype", "typedef", "attrs", "children")
+
+    def __init__(self, nodeid, nodeclass, browse_name, reftype=None, typedef=None):
+        self.nodeid = nodeid
+        self.nodeclass = nodeclass
+        self.browse_name = browse_name
+        self.reftype = reftype
+        self.typedef = typedef
+        self.attrs = None
+        self.children = []
+
+
+class InstantiationPlan(object):
+
+    def __init__(self, root, sources):
+        self.root = root
+        self.sources = sources  # keys of nodes the plan was built from
+
+    def size(self):
+        """
+        number of nodes created per instance
+        """
+        count = 0
+        level = [self.root]
+        while level:
+            count += len(level)
+            level = [child for decl in level for child in decl.children]
+        return count
+
+
+def _supertypes(server_mgr, type_nodeid):
+    """
+    type and its supertypes, without the top one, as asyncua get_node_supertypes()
+    """
+    chain = [type_nodeid]
+    while True:
+        refs = server_mgr.browse([chain[-1]], ua.ObjectIds.HasSubtype, ua.BrowseDirection.Inverse)[0]
+        if not refs:
+            break
+        chain.append(refs[0].NodeId)
+    return chain[:-1] if len(chain) > 1 else chain
+
+
+def _read_attributes(server_mgr, decls):
+    """
+    fill attributes of declarations with one batched read per node class
+    """
+    by_class = {}
+    for decl in decls:
+        by_class.setdefault(decl.nodeclass, []).append(decl)
+    for nodeclass, same_class in by_class.items():
+        if nodeclass not in _ATTRIBUTES_CLASSES:
+            raise RuntimeError(f"Instantiate: Node class not supported: {nodeclass}")
+        names = _attribute_names(nodeclass)
+        attr_ids = [getattr(ua.AttributeIds, name) for name in names]
+        for decl, values in zip(same_class, server_mgr.read_node_attributes([decl.nodeid for decl in same_class], attr_ids)):
+            attrs = _ATTRIBUTES_CLASSES[nodeclass]()
+            for name, attr_id in zip(names, attr_ids):
+                if attr_id not in values:
+                    logger.warning("Instantiate: attribute %s of %s cannot be read", name, decl.nodeid)
+                elif name == "Value":
+                    attrs.Value = values[attr_id].Value
+                else:
+                    setattr(attrs, name, values[attr_id].Value.Value)
+            decl.attrs = attrs
+
+
+def build_plan(server_mgr, type_nodeid, instantiate_optional=True):
+    """
+    read the declarations of type_nodeid, level by level
+    """
+    values = server_mgr.read_node_attributes([type_nodeid], [ua.AttributeIds.NodeClass, ua.AttributeIds.BrowseName, ua.AttributeIds.IsAbstract])[0]
+    nodeclass = ua.NodeClass(values[ua.AttributeIds.NodeClass].Value.Value)
+    if nodeclass in _ABSTRACT_CLASSES and values[ua.AttributeIds.IsAbstract].Value.Value:
+        raise ua.UaError(f"InstantiationError NodeId: {type_nodeid} is abstract and cant be instantiated!")
+    root = Declaration(type_nodeid, nodeclass, values[ua.AttributeIds.BrowseName].Value.Value, typedef=type_nodeid)
+    supertypes = _supertypes(server_mgr, type_nodeid)
+    sources = set(node_key(nodeid) for nodeid in supertypes)
+    level = [(root, supertypes)]
+    while level:
+        decls = [decl for decl, _ in level]
+        _read_attributes(server_mgr, decls)
+        browsed = [nodeid for _, nodeids in level for nodeid in nodeids]
+        refs_iter = iter(server_mgr.browse(browsed))
+        candidates = []
+        for decl, nodeids in level:
+            names = set()
+            for _ in nodeids:
+                for ref in next(refs_iter):
+                    sources.add(node_key(ref.NodeId))
+                    # declarations of a type override the ones of its supertypes
+                    name = (ref.BrowseName.NamespaceIndex, ref.BrowseName.Name)
+                    if name not in names:
+                        names.add(name)
+                        candidates.append((decl, ref))
+        rules = server_mgr.browse([ref.NodeId for _, ref in candidates], ua.ObjectIds.HasModellingRule)
+        level = []
+        for (parent, ref), rule_refs in zip(candidates, rules):
+            if not rule_refs:
+                # spec says to ignore nodes without modelling rules
+                continue
+            if not instantiate_optional and rule_refs[0].NodeId in _OPTIONAL_RULES:
+                continue
+            child = Declaration(ref.NodeId, ref.NodeClass, ref.BrowseName, ref.ReferenceTypeId, ref.TypeDefinition)
+            parent.children.append(child)
+            level.append((child, [ref.NodeId]))
+    return InstantiationPlan(root, sources)
+
+
+def _item(decl, parent, nodeid, browse_name, reftype, typedef, dname=None):
+    item = ua.AddNodesItem()
+    item.RequestedNewNodeId = nodeid
+    item.BrowseName = browse_name
+    item.ParentNodeId = parent
+    item.ReferenceTypeId = reftype
+    item.TypeDefinition = typedef
+    item.NodeClass = _INSTANCE_CLASSES.get(decl.nodeclass, decl.nodeclass)
+    item.NodeAttributes = copy.copy(decl.attrs)
+    if dname is not None:
+        item.NodeAttributes.DisplayName = dname
+    return item
+
+
+def run_plan(server_mgr, plan, parent, reftype, instances):
+    """
+    create instances, a list of (nodeid, browse name, display name), under parent
+    return nodeids of created nodes, level by level
+    """
+    root = plan.root
+    items = [_item(root, parent, nodeid, bname or root.browse_name, reftype, root.typedef, dname) for nodeid, bname, dname in instances]
+    results = server_mgr.add_nodes(items)
+    for result in results:
+        result.StatusCode.check()
+    created = [result.AddedNodeId for result in results]
+    level = [(root, nodeid) for nodeid in created]
+    while level:
+        items = []
+        decls = []
+        for decl, nodeid in level:
+            for child in decl.children:
+                if nodeid.NodeIdType is ua.NodeIdType.String:
+                    # children of nodes with a string nodeid get a string nodeid too, as in asyncua
+                    child_nodeid = ua.NodeId(f"{nodeid.Identifier}.{child.browse_name.Name}", nodeid.NamespaceIndex)
+                else:
+                    child_nodeid = ua.NodeId(NamespaceIndex=nodeid.NamespaceIndex)
+                items.append(_item(child, nodeid, child_nodeid, child.browse_name, child.reftype, child.typedef))
+                decls.append(child)
+        level = []
+        for decl, item, result in zip(decls, items, server_mgr.add_nodes(items)):
+            if not result.StatusCode.is_good():
+                logger.warning("Instantiate: could not create %s under %s: %s", decl.browse_name, item.ParentNodeId, result.StatusCode)
+                continue
+            created.append(result.AddedNodeId)
+            level.append((decl, result.AddedNodeId))
+    return created
+
+
+class PlanCache(object):
+    """
+    instantiation plans by type, a plan is dropped when a node it was built from changes.
+    mark() is a ChangeLog observer
+    """
+
+    def __init__(self, server_mgr):
+        self.server_mgr = server_mgr
+        self._plans = {}  # (type key, instantiate_optional) -> plan
+        self._users = {}  # source key -> plan keys
+
+    def clear(self):
+        self._plans = {}
+        self._users = {}
+
+    def mark(self, nodes, change=None):
+        if nodes is None:
+            self.clear()
+            return
+        for node in nodes:
+            for key in self._users.pop(node_key(node), ()):
+                self._plans.pop(key, None)
+
+    def get(self, type_nodeid, instantiate_optional=True):
+        key = (node_key(type_nodeid), instantiate_optional)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = build_plan(self.server_mgr, type_nodeid, instantiate_optional)
+            self._plans[key] = plan
+            for source in plan.sources:
+                self._users.setdefault(source, set()).add(key)
+        return plan
+
+    def instantiate(self, parent, type_nodeid, instances, instantiate_optional=True):
+        """
+        create instances of type under parent node, see run_plan()
+        """
+        plan = self.get(type_nodeid, instantiate_optional)
+        if parent.read_type_definition() == ua.NodeId(ua.ObjectIds.FolderType):
+            reftype = ua.NodeId(ua.ObjectIds.Organizes)
+        else:
+            reftype = ua.NodeId(ua.ObjectIds.HasComponent)
+        return run_plan(self.server_mgr, plan, parent.nodeid, reftype, instances)
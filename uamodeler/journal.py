@@ -0,0 +1,145 @@
+"""
+Append only journal of model operations, written next to the model file.
+Every record is framed with its length and a crc32 so a torn write at the
+end of the file, after a crash, is detected and ignored when replaying.
+Arguments are encoded with the OPC UA binary encoding
+"""
+
+import os
+import time
+import struct
+import logging
+import zlib
+
+from asyncua import ua
+from asyncua.ua import ua_binary
+from asyncua.common.utils import Buffer
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"UAMJ\x01"
+_frame = struct.Struct("<II")
+
+_NONE = b"0"
+_NODE = b"N"
+_VARIANT_TYPE = b"T"
+_LIST = b"L"
+_VALUE = b"V"
+
+
+def _encode_arg(arg):
+    if arg is None:
+        return _NONE
+    if hasattr(arg, "nodeid") and hasattr(arg, "tloop"):
+        return _NODE + ua_binary.nodeid_to_binary(arg.nodeid)
+    if isinstance(arg, ua.VariantType):
+        return _VARIANT_TYPE + ua_binary.Primitives.Int32.pack(arg.value)
+    if isinstance(arg, (list, tuple)):
+        return _LIST + ua_binary.Primitives.Int32.pack(len(arg)) + b"".join(_encode_arg(a) for a in arg)
+    return _VALUE + ua_binary.variant_to_binary(ua.Variant(arg))
+
+
+def _decode_arg(buf, get_node):
+    tag = buf.read(1)
+    if tag == _NONE:
+        return None
+    if tag == _NODE:
+        return get_node(ua_binary.nodeid_from_binary(buf))
+    if tag == _VARIANT_TYPE:
+        return ua.VariantType(ua_binary.Primitives.Int32.unpack(buf))
+    if tag == _LIST:
+        return [_decode_arg(buf, get_node) for _ in range(ua_binary.Primitives.Int32.unpack(buf))]
+    if tag == _VALUE:
+        return ua_binary.variant_from_binary(buf).Value
+    raise ValueError(f"Unknown journal argument tag {tag}")
+
+
+def encode_record(op, args):
+    return ua_binary.Primitives.String.pack(op) + _encode_arg(list(args))
+
+
+def decode_record(data, get_node):
+    buf = Buffer(data)
+    op = ua_binary.Primitives.String.unpack(buf)
+    return op, _decode_arg(buf, get_node)
+
+
+class ModelJournal(object):
+    """
+    Records are flushed to the OS at every append, so they survive a crash of
+    the modeler, and fsynced to disk in batches to survive a system crash
+    """
+
+    def __init__(self, path, sync_every=100, sync_interval=1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def open(self):
+        self._file = open(self.path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self.sync()
+
+    def append(self, op, *args):
+        record = encode_record(op, args)
+        self._file.write(_frame.pack(len(record), zlib.crc32(record)))
+        self._file.write(record)
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.sync_every or time.monotonic() - self._last_sync > self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def reset(self):
+        """
+        drop all records, called when model has been saved
+        """
+        self.close()
+        self._file = open(self.path, "wb")
+        self._file.write(MAGIC)
+        self.sync()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @staticmethod
+    def has_records(path):
+        return os.path.exists(path) and os.path.getsize(path) > len(MAGIC)
+
+    @staticmethod
+    def read(path, get_node):
+        """
+        yield (op, args) of every complete record of journal at path
+        """
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a model journal")
+            while True:
+                header = f.read(_frame.size)
+                if len(header) < _frame.size:
+                    break
+                size, crc = _frame.unpack(header)
+                record = f.read(size)
+                if len(record) < size or zlib.crc32(record) != crc:
+                    logger.warning("Ignoring torn record at end of journal %s", path)
+                    break
+                yield decode_record(record, get_node)
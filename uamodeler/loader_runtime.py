@@ -0,0 +1,93 @@
+"""
+Runtime of generated address space loaders, see server_loader.
+The source of this module is copied into each generated loader, it must
+only depend on asyncua and the standard library
+"""
+
+import zlib
+import base64
+import logging
+import dataclasses
+
+from asyncua import ua
+from asyncua.ua import ua_binary
+from asyncua.common.utils import Buffer
+
+_logger = logging.getLogger(__name__)
+
+
+def decode_items(data, node_count, reference_count):
+    """
+    AddNodesItem and AddReferencesItem of the compressed binary data of a loader
+    """
+    buf = Buffer(zlib.decompress(base64.b85decode(data)))
+    nodes = [ua_binary.struct_from_binary(ua.AddNodesItem, buf) for _ in range(node_count)]
+    references = [ua_binary.struct_from_binary(ua.AddReferencesItem, buf) for _ in range(reference_count)]
+    return nodes, references
+
+
+def remap_namespaces(value, indexes):
+    """
+    copy of value with namespace indexes changed, indexes maps saved indexes to the ones of the server.
+    Structures are walked since attributes such as DataTypeDefinition reference other nodes
+    """
+    if isinstance(value, ua.NodeId):
+        return dataclasses.replace(value, NamespaceIndex=indexes.get(value.NamespaceIndex, value.NamespaceIndex))
+    if isinstance(value, ua.QualifiedName):
+        return ua.QualifiedName(value.Name, indexes.get(value.NamespaceIndex, value.NamespaceIndex))
+    if isinstance(value, list):
+        return [remap_namespaces(val, indexes) for val in value]
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.replace(value, **{f.name: remap_namespaces(getattr(value, f.name), indexes) for f in dataclasses.fields(value) if f.init})
+    return value
+
+
+async def _add_nodes(session, items, batch_size, nodeids):
+    failed = []
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        for item, result in zip(chunk, await session.add_nodes(chunk)):
+            if result.StatusCode.is_good():
+                nodeids.append(result.AddedNodeId)
+            else:
+                failed.append(item)
+    return failed
+
+
+async def load_address_space(server, namespaces, data, node_count, reference_count, batch_size=1000):
+    """
+    add nodes and references of a loader to an asyncua Server with batched AddNodes and
+    AddReferences calls, registering the namespaces of the model. Return added nodeids
+    """
+    nodes, references = decode_items(data, node_count, reference_count)
+    indexes = {0: 0}
+    for idx, uri in enumerate(namespaces[1:], 1):
+        indexes[idx] = await server.register_namespace(uri)
+    if any(idx != new for idx, new in indexes.items()):
+        nodes = remap_namespaces(nodes, indexes)
+        references = remap_namespaces(references, indexes)
+    session = server.iserver.isession
+    nodeids = []
+    # nodes without hierarchical parent, such as encodings, are refused by AddNodes,
+    # they are added unchecked and linked by their references
+    orphans = [item for item in nodes if item.ParentNodeId.is_null()]
+    if orphans:
+        nodes = [item for item in nodes if not item.ParentNodeId.is_null()]
+        failed = list(server.iserver.node_mgt_service.try_add_nodes(orphans, check=False))
+        if failed:
+            _logger.warning("Could not create %s nodes: %s", len(failed), [item.RequestedNewNodeId for item in failed])
+        nodeids.extend(item.RequestedNewNodeId for item in orphans if item not in failed)
+    # nodes whose parent or type is created later in the same batch are retried
+    failed = await _add_nodes(session, nodes, batch_size, nodeids)
+    while failed:
+        still_failed = await _add_nodes(session, failed, batch_size, nodeids)
+        if len(still_failed) == len(failed):
+            _logger.warning("Could not create %s nodes: %s", len(failed), [item.RequestedNewNodeId for item in failed])
+            break
+        failed = still_failed
+    bad = 0
+    for start in range(0, len(references), batch_size):
+        bad += sum(1 for result in await session.add_references(references[start:start + batch_size]) if not result.is_good())
+    if bad:
+        _logger.info("%s references could not be added, they most probably already exist", bad)
+    return nodeids
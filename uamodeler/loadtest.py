@@ -0,0 +1,317 @@
+"""
+Load test of a model served by the modeler server.
+Client workers, each one with its own session, browse all nodes of the model
+and read the values of its variables in batches, then subscribe to monitored
+items while a writer session changes their values at a given rate. Latency of
+each request and of each data change notification is recorded and reported
+as percentiles with the throughput of each phase. Backends are compared by
+serving the same model with each one of them in a fresh worker process
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+from asyncua import ua, Client
+
+from uamodeler.remote_import import RemoteWalker, RequestLimits
+from uamodeler.ports import free_port
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("python", "open62541")
+_OPEN62541_PORT = 48400  # open62541 backend does not support other endpoints yet
+_SIMULATED_TYPES = (
+    ua.VariantType.Boolean, ua.VariantType.SByte, ua.VariantType.Byte, ua.VariantType.Int16, ua.VariantType.UInt16,
+    ua.VariantType.Int32, ua.VariantType.UInt32, ua.VariantType.Int64, ua.VariantType.UInt64,
+    ua.VariantType.Float, ua.VariantType.Double,
+)
+
+
+class LoadTestConfig(object):
+
+    def __init__(self, workers=4, batch_size=500, monitored_items=100, duration=5.0, update_rate=10.0,
+                 publishing_interval=100, timeout=30):
+        self.workers = workers  # client sessions, each one browses and reads the whole model
+        self.batch_size = batch_size  # nodes per Browse and Read request
+        self.monitored_items = monitored_items  # per worker
+        self.duration = duration  # seconds of value changes
+        self.update_rate = update_rate  # Write requests per second
+        self.publishing_interval = publishing_interval  # ms
+        self.timeout = timeout
+
+
+def percentile(samples, fraction):
+    """
+    nearest rank percentile of sorted samples
+    """
+    if not samples:
+        return None
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+class PhaseStats(object):
+    """
+    latencies of the requests or notifications of a phase
+    """
+
+    def __init__(self):
+        self.samples = []  # seconds
+        self.operations = 0  # nodes browsed, attributes read or written, notifications received
+        self.seconds = 0
+        self.errors = 0
+
+    def add(self, latency, operations=1):
+        self.samples.append(latency)
+        self.operations += operations
+
+    def summary(self):
+        samples = sorted(self.samples)
+        result = {"requests": len(samples), "operations": self.operations, "errors": self.errors, "seconds": round(self.seconds, 3)}
+        for name, fraction in (("p50_ms", 0.5), ("p99_ms", 0.99), ("max_ms", 1)):
+            value = percentile(samples, fraction)
+            result[name] = round(value * 1000, 3) if value is not None else None
+        result["operations_per_second"] = round(self.operations / self.seconds, 1) if self.seconds else None
+        return result
+
+
+def _timestamp(dt):
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class _LatencyHandler(object):
+    """
+    record delay between source timestamp of changes and reception of their notification
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.since = None  # initial values and older changes are not counted
+
+    def datachange_notification(self, node, val, data):
+        source = data.monitored_item.Value.SourceTimestamp
+        if self.since is None or source is None:
+            return
+        source = _timestamp(source)
+        if source >= self.since:
+            self.stats.add(time.time() - source)
+
+
+async def _timed(stats, operations, coro):
+    start = time.perf_counter()
+    result = await coro
+    stats.add(time.perf_counter() - start, operations)
+    return result
+
+
+async def _browse_all(client, nodeids, config, stats):
+    walker = RemoteWalker([client], RequestLimits(1, config.batch_size, config.batch_size))
+    for i in range(0, len(nodeids), config.batch_size):
+        chunk = nodeids[i:i + config.batch_size]
+        await _timed(stats, len(chunk), walker.browse(chunk))
+
+
+async def _read_all(client, variables, config, stats):
+    walker = RemoteWalker([client], RequestLimits(1, config.batch_size, config.batch_size))
+    for i in range(0, len(variables), config.batch_size):
+        chunk = [(nodeid, ua.AttributeIds.Value) for nodeid in variables[i:i + config.batch_size]]
+        await _timed(stats, len(chunk), walker.read(chunk))
+
+
+async def _simulated_variables(client, variables, count, batch_size):
+    """
+    (nodeid, VariantType) of the first count scalar variables of a type whose values can be simulated
+    """
+    walker = RemoteWalker([client], RequestLimits(1, batch_size, batch_size))
+    result = []
+    for i in range(0, len(variables), batch_size):
+        chunk = variables[i:i + batch_size]
+        for nodeid, dv in zip(chunk, await walker.read([(nodeid, ua.AttributeIds.Value) for nodeid in chunk])):
+            if dv.StatusCode.is_good() and dv.Value is not None and not dv.Value.is_array and dv.Value.VariantType in _SIMULATED_TYPES:
+                result.append((nodeid, dv.Value.VariantType))
+                if len(result) >= count:
+                    return result
+    return result
+
+
+def _simulated_value(vtype, tick):
+    if vtype == ua.VariantType.Boolean:
+        return tick % 2 == 0
+    if vtype in (ua.VariantType.Float, ua.VariantType.Double):
+        return float(tick)
+    return tick % 100
+
+
+async def _write_values(client, server_mgr, items, config, stats):
+    """
+    write new values of items, all in one Write request, update_rate times per second.
+    Values are written by server_mgr if given, as device values are, otherwise by client
+    which needs variables to be writable
+    """
+    period = 1 / config.update_rate
+    ticks = max(1, int(config.duration * config.update_rate))
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    for tick in range(ticks):
+        delay = start + tick * period - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        now = datetime.now(timezone.utc)
+        values = [(nodeid, ua.AttributeIds.Value, ua.DataValue(ua.Variant(_simulated_value(vtype, tick + 1), vtype), SourceTimestamp=now))
+                  for nodeid, vtype in items]
+        if server_mgr is not None:
+            # server_mgr blocks, notifications must still be received meanwhile
+            results = await _timed(stats, len(values), loop.run_in_executor(None, server_mgr.write_attributes, values))
+        else:
+            params = ua.WriteParameters()
+            for nodeid, attr, dv in values:
+                wv = ua.WriteValue()
+                wv.NodeId = nodeid
+                wv.AttributeId = attr
+                wv.Value = dv
+                params.NodesToWrite.append(wv)
+            results = await _timed(stats, len(values), client.uaclient.write(params))
+        stats.errors += sum(1 for result in results if not result.is_good())
+    return ticks
+
+
+async def _run_phase(stats, coros):
+    start = time.perf_counter()
+    try:
+        return await asyncio.gather(*coros)
+    finally:
+        stats.seconds = time.perf_counter() - start
+
+
+async def run_load_test(url, nodeids, variables, config=None, server_mgr=None):
+    """
+    browse nodeids and read values of variables with config.workers sessions, then subscribe
+    each session to changes of config.monitored_items variables, written by server_mgr if given.
+    Return a dict of phase summaries
+    """
+    config = config or LoadTestConfig()
+    nodeids = list(nodeids)
+    variables = list(variables)
+    phases = {name: PhaseStats() for name in ("browse", "read", "write", "notification")}
+    clients = [Client(url, timeout=config.timeout) for _ in range(config.workers + 1)]
+    writer = clients[-1]
+    workers = clients[:-1]
+    connected = []
+    try:
+        for client in clients:
+            await client.connect()
+            connected.append(client)
+        await _run_phase(phases["browse"], [_browse_all(client, nodeids, config, phases["browse"]) for client in workers])
+        await _run_phase(phases["read"], [_read_all(client, variables, config, phases["read"]) for client in workers])
+
+        items = await _simulated_variables(writer, variables, config.monitored_items, config.batch_size)
+        handlers = [_LatencyHandler(phases["notification"]) for _ in workers]
+        subscriptions = []
+        for client, handler in zip(workers, handlers):
+            sub = await client.create_subscription(config.publishing_interval, handler)
+            await sub.subscribe_data_change([client.get_node(nodeid) for nodeid, _ in items])
+            subscriptions.append(sub)
+        since = time.time()
+        for handler in handlers:
+            handler.since = since
+        ticks = await _run_phase(phases["write"], [_write_values(writer, server_mgr, items, config, phases["write"])])
+        # let last changes be published
+        await asyncio.sleep(3 * config.publishing_interval / 1000)
+        phases["notification"].seconds = time.time() - since
+        for sub in subscriptions:
+            await sub.delete()
+    finally:
+        await asyncio.gather(*(client.disconnect() for client in connected), return_exceptions=True)
+    report = {name: stats.summary() for name, stats in phases.items()}
+    report["monitored_items"] = len(items)
+    report["notifications_expected"] = ticks[0] * len(items) * len(workers)
+    return report
+
+
+def model_variables(server_mgr, nodeids):
+    classes = server_mgr.read_attributes(nodeids, ua.AttributeIds.NodeClass)
+    return [nodeid for nodeid, dv in zip(nodeids, classes) if dv.Value is not None and dv.Value.Value == ua.NodeClass.Variable]
+
+
+def _run_backend(path, backend, config):
+    """
+    open model at path with a backend in a worker process and load test it
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import QSettings
+    from PyQt5.QtWidgets import QApplication
+    from uamodeler.uamodeler import UaModeler
+    from uamodeler import server_manager
+    app = QApplication.instance() or QApplication([])
+    result = {"path": path, "backend": backend}
+    if backend == "open62541" and not server_manager.OPEN62541:
+        result["error"] = "open62541 python wrappers not available"
+        return result
+    modeler = UaModeler()
+    mgr = modeler.model_mgr._model_mgr
+    # stopping the server saves the chosen backend, keep the one of the user
+    settings = QSettings()
+    previous = settings.value("use_open62541_server", 0)
+    modeler.ui.actionUseOpenUa.setChecked(backend == "open62541")
+    port = _OPEN62541_PORT if backend == "open62541" else free_port()
+    mgr.endpoint = f"opc.tcp://127.0.0.1:{port}/freeopcua/uamodeler/"
+    try:
+        start = time.perf_counter()
+        mgr.open(path)
+        result["open_seconds"] = round(time.perf_counter() - start, 3)
+        nodeids = list(mgr.new_nodes)
+        variables = model_variables(mgr.server_mgr, nodeids)
+        result.update({"nodes": len(nodeids), "variables": len(variables)})
+        result.update(asyncio.run(run_load_test(mgr.endpoint, nodeids, variables, config, mgr.server_mgr)))
+    except Exception as ex:
+        logger.exception("Load test of %s with %s backend failed", path, backend)
+        result["error"] = f"{type(ex).__name__}: {ex}"
+    finally:
+        mgr.close_model(force=True)
+        settings.setValue("use_open62541_server", previous)
+        app.quit()
+    return result
+
+
+def run_backends(path, backends=BACKENDS, config=None):
+    """
+    load test model at path with each backend, one after the other in a fresh process
+    """
+    results = []
+    for backend in backends:
+        # spawn, forking a process running the server thread is not safe
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results.append(pool.submit(_run_backend, path, backend, config).result())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a model with the modeler server backends and measure browse, read and subscription performance")
+    parser.add_argument("path", help="model file, as opened by the modeler")
+    parser.add_argument("--backend", action="append", choices=BACKENDS, help="backend to test, default all of them")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of client sessions")
+    parser.add_argument("--batch-size", type=int, default=500, help="nodes per Browse and Read request")
+    parser.add_argument("-m", "--monitored-items", type=int, default=100, help="monitored variables per session")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds of value changes")
+    parser.add_argument("--update-rate", type=float, default=10.0, help="value changes per second")
+    parser.add_argument("--publishing-interval", type=int, default=100, help="publishing interval of subscriptions in ms")
+    args = parser.parse_args(argv)
+    config = LoadTestConfig(args.workers, args.batch_size, args.monitored_items, args.duration, args.update_rate, args.publishing_interval)
+    results = run_backends(os.path.abspath(args.path), args.backend or BACKENDS, config)
+    json.dump(results, sys.stdout, indent=1)
+    sys.stdout.write("\n")
+    return 0 if all("error" not in result for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QTreeWidget, QTreeWidgetItem, QDialogButtonBox
+
+
+class MergeConflictsDialog(QDialog):
+    """
+    List conflicts of a merge, checked ones are resolved by taking their side
+    """
+
+    def __init__(self, parent, conflicts):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Merge Conflicts")
+        self.conflicts = conflicts
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{len(conflicts)} changes conflict with the current model. Check the ones to take from their model:"))
+        self.view = QTreeWidget(self)
+        self.view.setHeaderLabels(["Node", "Conflict", "Base", "Ours", "Theirs"])
+        for conflict in conflicts:
+            kind = conflict["attribute"] or conflict["kind"]
+            values = [conflict[side] or "" for side in ("base", "ours", "theirs")]
+            item = QTreeWidgetItem([conflict["node"], kind] + values)
+            item.setCheckState(0, Qt.Unchecked)
+            self.view.addTopLevelItem(item)
+        self.view.resizeColumnToContents(0)
+        layout.addWidget(self.view)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def taken_conflicts(self):
+        """
+        conflicts whose item is checked
+        """
+        return [conflict for idx, conflict in enumerate(self.conflicts)
+                if self.view.topLevelItem(idx).checkState(0) == Qt.Checked]
@@ -0,0 +1,317 @@
+"""
+Structural diff of NodeSet2 files or of a model and a file.
+Each side is reduced to a table of compact node digests keyed by NodeId and
+partitioned by namespace. Namespace indexes are replaced by namespace uris
+and aliases are resolved, so files written with another namespace table,
+other aliases or another element order compare equal. Every digest holds a
+hash of the node content, only nodes whose hash differs are compared
+attribute by attribute. Namespaces are compared in worker processes
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import logging
+import multiprocessing
+import xml.etree.ElementTree as Et
+from concurrent.futures import ProcessPoolExecutor
+
+from asyncua import ua
+
+from uamodeler.compression import open_decompressed
+
+logger = logging.getLogger(__name__)
+
+_ns_re = re.compile(r"^ns=(\d+);")
+_bname_re = re.compile(r"^(\d+):")
+_NODEID_ATTRS = ("ParentNodeId", "DataType", "MethodDeclarationId")
+_TEXT_ELEMENTS = ("DisplayName", "Description", "InverseName")
+MAX_VALUE_LENGTH = 80  # longer values are only kept as a hash
+MIN_PARALLEL_NODES = 20000  # starting worker processes costs more for smaller models
+MIN_PARALLEL_SIZE = 4 * 1024 * 1024
+
+
+def _local_tag(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+class NodeDigest(object):
+    __slots__ = ("nodeclass", "attrs", "refs", "hash")
+
+    def __init__(self, nodeclass, attrs, refs):
+        self.nodeclass = nodeclass
+        self.attrs = attrs  # attribute or element name -> value, or hash of long values
+        self.refs = refs  # frozenset of (reftype, target, is_forward)
+        digest = hashlib.blake2b(nodeclass.encode(), digest_size=16)
+        for item in sorted(attrs.items()):
+            digest.update("\0".join(item).encode())
+        for ref in sorted(refs):
+            digest.update("\0".join((ref[0], ref[1], str(ref[2]))).encode())
+        self.hash = digest.digest()
+
+
+class _Namespaces(object):
+    """
+    namespace table and aliases of a file, to write nodeids independently of them
+    """
+
+    def __init__(self):
+        self.uris = []
+        self.aliases = {}
+
+    def nodeid(self, text):
+        text = (text or "").strip()
+        text = self.aliases.get(text, text)
+        match = _ns_re.match(text)
+        if match is None:
+            return text
+        return f"nsu={self._uri(int(match.group(1)))};{text[match.end():]}"
+
+    def browse_name(self, text):
+        match = _bname_re.match(text or "")
+        if match is None:
+            return text or ""
+        return f"{self._uri(int(match.group(1)))}:{text[match.end():]}"
+
+    def _uri(self, idx):
+        return self.uris[idx - 1] if 0 < idx <= len(self.uris) else str(idx)
+
+    def namespace(self, nodeid):
+        """
+        namespace uri of a nodeid written by nodeid(), "" for namespace 0
+        """
+        if nodeid.startswith("nsu="):
+            return nodeid[4:nodeid.index(";")]
+        return ""
+
+
+def _short(value):
+    if len(value) <= MAX_VALUE_LENGTH:
+        return value
+    return "sha256:" + hashlib.sha256(value.encode()).hexdigest()
+
+
+def _digest(el, namespaces):
+    attrs = {}
+    for name, value in el.attrib.items():
+        if name == "NodeId":
+            continue
+        if name in _NODEID_ATTRS:
+            value = namespaces.nodeid(value)
+        elif name == "BrowseName":
+            value = namespaces.browse_name(value)
+        attrs[name] = value
+    refs = []
+    for child in el:
+        tag = _local_tag(child.tag)
+        if tag == "References":
+            for ref_el in child:
+                forward = ref_el.attrib.get("IsForward", "true").lower() != "false"
+                refs.append((namespaces.nodeid(ref_el.attrib["ReferenceType"]), namespaces.nodeid(ref_el.text), forward))
+        elif tag in _TEXT_ELEMENTS:
+            attrs[tag] = _short("".join(child.itertext()).strip())
+        else:
+            attrs[tag] = _short(Et.canonicalize(Et.tostring(child, encoding="unicode"), strip_text=True))
+    return NodeDigest(_local_tag(el.tag), attrs, frozenset(refs))
+
+
+def _add_element(index, el, namespaces):
+    tag = _local_tag(el.tag)
+    if tag == "NamespaceUris":
+        namespaces.uris = [uri_el.text for uri_el in el]
+    elif tag == "Aliases":
+        namespaces.aliases = {alias_el.attrib["Alias"]: alias_el.text.strip() for alias_el in el}
+    elif tag.startswith("UA"):
+        nodeid = namespaces.nodeid(el.attrib["NodeId"])
+        index.setdefault(namespaces.namespace(nodeid), {})[nodeid] = _digest(el, namespaces)
+
+
+def index_etree(root):
+    """
+    return {namespace uri: {nodeid: NodeDigest}} of nodes of a NodeSet2 etree
+    """
+    index = {}
+    namespaces = _Namespaces()
+    for el in root:
+        _add_element(index, el, namespaces)
+    return index
+
+
+def index_file(path):
+    """
+    same as index_etree for a possibly compressed file, parsed incrementally
+    """
+    index = {}
+    namespaces = _Namespaces()
+    depth = 0
+    root = None
+    with open_decompressed(path) as f:
+        for event, el in Et.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if depth == 0:
+                    root = el
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                _add_element(index, el, namespaces)
+                root.clear()
+    return index
+
+
+def extract_nodes(path, nodeids):
+    """
+    return a NodeSet2 etree with the namespaces, aliases and the nodes of file
+    whose nodeid, as written in indexes, is in nodeids
+    """
+    result = Et.Element("UANodeSet")
+    namespaces = _Namespaces()
+    depth = 0
+    root = None
+    with open_decompressed(path) as f:
+        for event, el in Et.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if depth == 0:
+                    root = el
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            tag = _local_tag(el.tag)
+            if tag in ("NamespaceUris", "Aliases"):
+                _add_element({}, el, namespaces)
+                result.append(el)
+            elif tag.startswith("UA") and namespaces.nodeid(el.attrib["NodeId"]) in nodeids:
+                result.append(el)
+            root.clear()
+    return result
+
+
+def to_nodeid(nodeid, namespace_array):
+    """
+    return NodeId of a nodeid written in indexes, using namespace array of server
+    """
+    if nodeid.startswith("nsu="):
+        uri, identifier = nodeid[4:].split(";", 1)
+        return ua.NodeId.from_string(f"ns={namespace_array.index(uri)};{identifier}")
+    return ua.NodeId.from_string(nodeid)
+
+
+def diff_namespace(old, new):
+    """
+    compare nodes of one namespace, return (added, removed, changed)
+    """
+    added = [nodeid for nodeid in new if nodeid not in old]
+    removed = [nodeid for nodeid in old if nodeid not in new]
+    changed = {}
+    for nodeid, new_node in new.items():
+        old_node = old.get(nodeid)
+        if old_node is None or old_node.hash == new_node.hash:
+            continue
+        change = {}
+        if old_node.nodeclass != new_node.nodeclass:
+            change["nodeclass"] = [old_node.nodeclass, new_node.nodeclass]
+        attrs = {}
+        for name in sorted(set(old_node.attrs) | set(new_node.attrs)):
+            old_value = old_node.attrs.get(name)
+            new_value = new_node.attrs.get(name)
+            if old_value != new_value:
+                attrs[name] = [old_value, new_value]
+        if attrs:
+            change["attributes"] = attrs
+        if old_node.refs != new_node.refs:
+            change["references"] = {
+                "added": sorted([list(ref) for ref in new_node.refs - old_node.refs]),
+                "removed": sorted([list(ref) for ref in old_node.refs - new_node.refs]),
+            }
+        changed[nodeid] = change
+    return sorted(added), sorted(removed), changed
+
+
+class ModelDiff(object):
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = {}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def update(self, added, removed, changed):
+        self.added.extend(added)
+        self.removed.extend(removed)
+        self.changed.update(changed)
+
+    def to_dict(self):
+        return {"added": self.added, "removed": self.removed, "changed": self.changed}
+
+
+def _pool(workers):
+    # spawn, forking a process running the server thread is not safe
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def diff_indexes(old, new, workers=1, pool=None):
+    """
+    compare two indexes, namespace by namespace, in worker processes if workers > 1
+    and indexes are large enough
+    """
+    diff = ModelDiff()
+    namespaces = sorted(set(old) | set(new))
+    pairs = [(old.get(ns, {}), new.get(ns, {})) for ns in namespaces]
+    size = sum(len(nodes) for pair in pairs for nodes in pair)
+    if pool is None and (workers or 1) > 1 and len(namespaces) > 1 and size >= MIN_PARALLEL_NODES:
+        with _pool(min(workers, len(namespaces))) as pool:
+            return diff_indexes(old, new, workers, pool)
+    if pool is None:
+        results = [diff_namespace(*pair) for pair in pairs]
+    else:
+        results = pool.map(diff_namespace, *zip(*pairs)) if pairs else []
+    for result in results:
+        diff.update(*result)
+    return diff
+
+
+def index_files(paths, workers=1):
+    """
+    index files, each one in its own worker process if workers > 1 and files are large enough
+    """
+    size = sum(os.path.getsize(path) for path in paths)
+    if (workers or 1) < 2 or len(paths) < 2 or size < MIN_PARALLEL_SIZE:
+        return [index_file(path) for path in paths]
+    with _pool(min(workers, len(paths))) as pool:
+        return list(pool.map(index_file, paths))
+
+
+def diff_files(old_path, new_path, workers=2):
+    """
+    compare two NodeSet2 files, both files are indexed in parallel if workers > 1
+    """
+    if (workers or 1) < 2:
+        return diff_indexes(index_file(old_path), index_file(new_path), 1)
+    with _pool(workers) as pool:
+        old = pool.submit(index_file, old_path)
+        new = pool.submit(index_file, new_path)
+        return diff_indexes(old.result(), new.result(), workers, pool)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Structural diff of two OPC UA NodeSet2 files, printed as JSON")
+    parser.add_argument("old", help="NodeSet2 file, may be compressed")
+    parser.add_argument("new", help="NodeSet2 file, may be compressed")
+    parser.add_argument("-j", "--workers", type=int, default=2, help="number of worker processes")
+    parser.add_argument("--indent", type=int, default=None, help="indentation of JSON output")
+    args = parser.parse_args(argv)
+    diff = diff_files(args.old, args.new, args.workers)
+    json.dump(diff.to_dict(), sys.stdout, indent=args.indent)
+    sys.stdout.write("\n")
+    return 1 if diff else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
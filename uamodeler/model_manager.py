@@ -1,19 +1,38 @@
+import copy
 import logging
 import os
+import tempfile
 import xml.etree.ElementTree as Et
-from collections import OrderedDict
+from datetime import datetime, timezone
 
 
-from PyQt5.QtCore import pyqtSignal, QObject, QSettings
+from PyQt5.QtCore import pyqtSignal, QObject, QSettings, Qt
 
 from asyncua import ua
-from asyncua.sync import copy_node, new_node, instantiate, data_type_to_variant_type
+from asyncua.sync import copy_node, new_node, data_type_to_variant_type
 from asyncua.common.structures import Struct, StructGenerator
 from asyncua.sync import DataTypeDictionaryBuilder
 
 from uawidgets.utils import trycatchslot
 
 from uamodeler.server_manager import ServerManager
+from uamodeler.search_index import NodeSearchIndex, IndexBuilder, index_nodes
+from uamodeler.node_tracker import NodeKeySet, ChangeLog, Change
+from uamodeler.xml_splice import splice_nodeset
+from uamodeler.journal import ModelJournal
+from uamodeler.compression import split_compression, is_compressed, is_xml
+from uamodeler.undo import UndoStack, AddNodesCommand, DeleteNodesCommand, WriteAttributeCommand, WriteAttributesCommand, ReferencesCommand
+from uamodeler.undo import descendants, take_snapshot, restore_snapshot, node_items, reference_items
+from uamodeler.split_export import namespace_file_name, add_models_element, dependency_order, write_nodesets
+from uamodeler.binary_model import BINARY_MODEL_EXTENSION, BinaryModel, write_binary_model, file_fingerprint
+from uamodeler.model_diff import index_etree, index_file, index_files, diff_indexes, extract_nodes, to_nodeid
+from uamodeler.model_merge import three_way, resolution_plan
+from uamodeler.validation import ModelValidator
+from uamodeler.tag_import import TagImporter, read_tags
+from uamodeler.instantiation import PlanCache
+from uamodeler.remote_import import DEFAULT_ROOTS, RequestLimits
+from uamodeler.simulation import Simulation
+from uamodeler.server_loader import write_loader, measure_startup
 
 logger = logging.getLogger(__name__)
 
@@ -34,62 +53,325 @@ class ModelManager(QObject):
     error = pyqtSignal(Exception)
     titleChanged = pyqtSignal(str)
     modelChanged = pyqtSignal()
+    searchIndexReady = pyqtSignal()
+    undoStateChanged = pyqtSignal()
+    simulationStateChanged = pyqtSignal(bool)
+    namespacesChanged = pyqtSignal(object)  # NamespaceChange, may be emitted from the server thread
 
     def __init__(self, modeler):
         QObject.__init__(self, modeler)
         self.modeler = modeler
         self.server_mgr = ServerManager(self.modeler.ui.actionUseOpenUa)
-        self.new_nodes = []  # the added nodes we will save
+        self.new_nodes = NodeKeySet()  # the added nodes we will save
+        self.changes = ChangeLog()  # what changed in model since last save
+        self.validator = ModelValidator(self.server_mgr)
+        self.changes.observers.append(self.validator.mark)
+        self.instance_plans = PlanCache(self.server_mgr)
+        self.changes.observers.append(self.instance_plans.mark)
+        self.simulation = None
+        self._saved_file = None  # path and mtime of last saved xml, to know if we can update it
+        self._compression = ""  # compression extension of model xml file
+        self.binary_model = False  # model is saved in binary format instead of xml
+        self.split_namespaces = False  # model is saved as one xml file per namespace
+        self._split_files = []  # files written by last split save
+        self._nodeset_paths = {}  # name of imported reference nodesets -> path
         self.current_path = None
+        self.endpoint = "opc.tcp://0.0.0.0:48400/freeopcua/uamodeler/"
         self.settings = QSettings()
-        self.modified = False
+        self.search_index = NodeSearchIndex()
+        self._index_builders = []
+        self._journal = None
+        self._replaying = False
+        self._parent_override = None  # parent used instead of current tree node when replaying
+        self._replay_created = []
+        self._remap = {}  # nodeids in journal -> nodeids generated when replaying
+        self.undo_stack = UndoStack(int(self.settings.value("undo_depth", 100)),
+                                    int(self.settings.value("undo_max_nodes", 100000)))
+        self._shown_attrs = (None, {})  # attributes of node shown in attribute view, to undo writes
+        self.modeler.ui.treeView.activated.connect(self._remember_attributes)
+        self.modeler.ui.treeView.clicked.connect(self._remember_attributes)
         self.modeler.attrs_ui.attr_written.connect(self._attr_written)
+        self.modeler.refs_ui.reference_changed.connect(self._reference_changed)
+        self.server_mgr.namespaces.observers.append(self.namespacesChanged.emit)
+        self.namespacesChanged.connect(self.modeler.idx_ui.apply_change)
+        self.modeler.idx_ui.uri_edited.connect(self._namespace_uri_edited)
+        self.modeler.idx_ui.removal_requested.connect(self._namespace_removal_requested)
+        self.modeler.idx_ui.reorder_requested.connect(self._namespace_reorder_requested)
+        self.modeler.nodesets_ui.nodeset_added.connect(self._nodeset_added)
+
+    @property
+    def modified(self):
+        return bool(self.changes)
+
+    @modified.setter
+    def modified(self, val):
+        """
+        setting modified without saying which node changed forces a full export at next save
+        """
+        if val:
+            self.changes.mark_structural()
+        else:
+            self.changes.clear()
+
+    def _get_parent(self):
+        if self._parent_override is not None:
+            return self._parent_override
+        return self.modeler.tree_ui.get_current_node()
 
     def delete_node(self, node, interactive=True):
         logger.warning("Deleting: %s", node)
         if node:
-            deleted_nodes = node.delete(delete_references=True, recursive=True)
-            for dn in deleted_nodes:
-                # make sure we remove ALL instances of node
-                self.new_nodes[:] = (node for node in self.new_nodes if node != dn)
+            self._journal_op("delete_node", node)
+            snapshot = self.remove_nodes([node.nodeid])
+            self._push_command(DeleteNodesCommand(f"Delete {snapshot.states[0].browse_name.Name}", snapshot))
             if interactive:
                 self.modeler.tree_ui.remove_current_item()
 
+    def remove_nodes(self, nodeids):
+        """
+        delete nodes and their children with one batched DeleteNodes call
+        return a snapshot of the deleted nodes to recreate them
+        """
+        nodeids = descendants(self.server_mgr, nodeids)
+        snapshot = take_snapshot(self.server_mgr, nodeids)
+        for state in snapshot.states:
+            state.added = state.nodeid in self.new_nodes
+        self.server_mgr.delete_nodes(nodeids)
+        self.new_nodes.difference_update(nodeids)
+        for nodeid in nodeids:
+            self.search_index.remove(nodeid)
+        self.changes.mark(nodeids, Change.DELETED)
+        self.changes.mark(snapshot.neighbours(), Change.REFERENCES)
+        return snapshot
+
+    def restore_nodes(self, snapshot):
+        """
+        recreate nodes deleted by remove_nodes
+        """
+        restore_snapshot(self.server_mgr, snapshot)
+        nodeids = snapshot.nodeids()
+        self.new_nodes.update(state.nodeid for state in snapshot.states if state.added)
+        self.changes.mark(nodeids, Change.CREATED)
+        self.changes.mark(snapshot.neighbours(), Change.REFERENCES)
+        index_nodes(self.server_mgr, self.search_index, nodeids)
+
+    def write_attribute_value(self, nodeid, attr, dv):
+        result = self.server_mgr.write_attributes([(nodeid, attr, ua.DataValue(dv.Value))])[0]
+        result.check()
+        self._update_written_node(self.server_mgr.get_node(nodeid), attr, dv)
+        if self._shown_attrs[0] == nodeid:
+            self._shown_attrs[1][attr] = dv
+
+    def write_attribute_values(self, items):
+        """
+        write (nodeid, attribute, DataValue) items with one batched Write call
+        """
+        results = self.server_mgr.write_attributes([(nodeid, attr, ua.DataValue(dv.Value)) for nodeid, attr, dv in items])
+        written = [item for item, result in zip(items, results) if result.is_good()]
+        self.changes.mark([nodeid for nodeid, _, _ in written], Change.ATTRIBUTES)
+        for nodeid, attr, dv in written:
+            self._update_search_index(nodeid, attr, dv)
+            self._update_simulation(nodeid, attr, dv)
+            if self._shown_attrs[0] == nodeid:
+                self._shown_attrs[1][attr] = dv
+        for result in results:
+            result.check()
+
+    def write_attribute_to_nodes(self, nodes, attr, dv):
+        """
+        write one attribute value to many nodes, previous values are read
+        with one batched Read call for undo and all nodes are written with one Write call
+        """
+        nodeids = [node.nodeid for node in nodes]
+        olds = self.server_mgr.read_attributes(nodeids, attr)
+        self._journal_op("write_attribute_to_nodes", nodes, attr, dv)
+        self._push_command(WriteAttributesCommand(f"Write {attr.name} of {len(nodeids)} nodes", attr, list(zip(nodeids, olds)), dv))
+        try:
+            self.write_attribute_values([(nodeid, attr, dv) for nodeid in nodeids])
+        finally:
+            if attr in (ua.AttributeIds.BrowseName, ua.AttributeIds.DisplayName) and not self._replaying:
+                self._update_tree_items(nodeids, attr, dv.Value.Value)
+
+    def _update_tree_items(self, nodeids, attr, value):
+        """
+        update names of the loaded tree items of nodes, the tree is repainted once
+        """
+        keys = NodeKeySet(nodeids)
+        column, text = (1, value.to_string()) if attr == ua.AttributeIds.BrowseName else (0, value.Text)
+        tree = self.modeler.tree_ui
+        tree.view.setUpdatesEnabled(False)
+        try:
+            items = [tree.model.item(0, 0)]
+            while items:
+                item = items.pop()
+                if item is None:
+                    continue
+                node = item.data(Qt.UserRole)
+                if node is not None and node.nodeid in keys:
+                    sibling = item.parent().child(item.row(), column) if item.parent() else tree.model.item(item.row(), column)
+                    sibling.setText(text)
+                items.extend(item.child(row, 0) for row in range(item.rowCount()))
+        finally:
+            tree.view.setUpdatesEnabled(True)
+
+    def change_references(self, add=(), delete=(), text="Change references", undoable=True):
+        """
+        add and delete (source, reference type, target, forward) references, see apply_references
+        """
+        add, delete = list(add), list(delete)
+        self._journal_op("change_references", [list(ref) for ref in add], [list(ref) for ref in delete], text, undoable)
+        self.apply_references(add, delete)
+        if undoable:
+            self._push_command(ReferencesCommand(text, add, delete))
+
+    def apply_references(self, add, delete):
+        """
+        delete and add references with one batched DeleteReferences and one AddReferences call.
+        References are one way, as the ones added by asyncua set_modelling_rule()
+        """
+        if delete:
+            items = []
+            for source, reftype, target, forward in delete:
+                item = ua.DeleteReferencesItem()
+                item.SourceNodeId = source
+                item.ReferenceTypeId = reftype
+                item.TargetNodeId = target
+                item.IsForward = forward
+                item.DeleteBidirectional = False
+                items.append(item)
+            for ref, result in zip(delete, self.server_mgr.delete_references(items)):
+                if not result.is_good():
+                    logger.warning("Could not delete reference %s: %s", ref, result)
+        if add:
+            items = []
+            for source, reftype, target, forward in add:
+                item = ua.AddReferencesItem()
+                item.SourceNodeId = source
+                item.ReferenceTypeId = reftype
+                item.TargetNodeId = target
+                item.IsForward = forward
+                item.TargetNodeClass = ua.NodeClass.Unspecified
+                items.append(item)
+            for ref, result in zip(add, self.server_mgr.add_references(items)):
+                if not result.is_good():
+                    logger.warning("Could not add reference %s: %s", ref, result)
+        self.changes.mark(NodeKeySet(ref[0] for ref in add + delete), Change.REFERENCES)
+
+    def set_modelling_rule(self, nodes, rule, undoable=True):
+        """
+        give nodes the modelling rule node rule, or no modelling rule if rule is None
+        """
+        nodeids = [node.nodeid for node in nodes]
+        reftype = ua.NodeId(ua.ObjectIds.HasModellingRule)
+        add = []
+        delete = []
+        for nodeid, refs in zip(nodeids, self.server_mgr.browse(nodeids, ua.ObjectIds.HasModellingRule)):
+            delete.extend((nodeid, reftype, ref.NodeId, True) for ref in refs if ref.NodeId != rule)
+            if rule is not None and not any(ref.NodeId == rule for ref in refs):
+                add.append((nodeid, reftype, rule, True))
+        if add or delete:
+            self.change_references(add, delete, "Set modelling rule", undoable)
+
+    def undo(self):
+        if not self.undo_stack.can_undo():
+            return
+        self._journal_op("undo")
+        command = self.undo_stack.undo(self)
+        logger.info("Undo %s", command.text)
+        self._after_undo_redo()
+
+    def redo(self):
+        if not self.undo_stack.can_redo():
+            return
+        self._journal_op("redo")
+        command = self.undo_stack.redo(self)
+        logger.info("Redo %s", command.text)
+        self._after_undo_redo()
+
+    def _push_command(self, command):
+        self.undo_stack.push(command)
+        self.undoStateChanged.emit()
+
+    def _after_undo_redo(self):
+        self.undoStateChanged.emit()
+        if self._replaying:
+            return
+        self.modeler.tree_ui.reload()
+        self.modeler.refs_ui.clear()
+        self.modeler.attrs_ui.clear()
+        self._shown_attrs = (None, {})
+
+    @trycatchslot
+    def _remember_attributes(self, idx):
+        """
+        keep attributes of node shown in attribute view, so writes done there can be undone
+        """
+        node = self.modeler.attrs_ui.current_node  # the view shows it before this slot is called
+        if node is None:
+            return
+        attrs = [attr for attr in ua.AttributeIds]
+        values = self.server_mgr.read_node_attributes([node.nodeid], attrs)[0]
+        # values may be shared with the server and modified in place when edited
+        self._shown_attrs = (node.nodeid, copy.deepcopy(values))
+
     def paste_node(self, node):
-        parent = self.modeler.get_current_node()
+        parent = self._get_parent()
         try:
             added_nodes = copy_node(parent, node)
         except Exception as ex:
             self.modeler.show_error(ex)
             raise
-        self.new_nodes.extend(added_nodes)
-        self.modeler.tree_ui.reload_current()
-        self.modeler.show_refs()
-        self.modified = True
+        self._journal_created("paste_node", parent, added_nodes, node)
+        self._push_command(AddNodesCommand("Paste", [n.nodeid for n in added_nodes]))
+        self.new_nodes.update(added_nodes)
+        self.changes.mark(added_nodes, Change.CREATED)
+        self.changes.mark([parent], Change.REFERENCES)
+        index_nodes(self.server_mgr, self.search_index, [n.nodeid for n in added_nodes])
+        if not self._replaying:
+            self.modeler.tree_ui.reload_current()
+            self.modeler.show_refs()
 
     def close_model(self, force=False):
         if not force and self.modified:
             raise RuntimeError("Model is modified, use force to close it")
         self.modeler.actions.disable_all_actions()
+        self._stop_indexing()
+        self.stop_simulation()
+        if self._journal is not None:
+            self._journal.discard()
+            self._journal = None
+        self.undo_stack.clear()
+        self._shown_attrs = (None, {})
+        self.undoStateChanged.emit()
         self.server_mgr.stop_server()
         self.current_path = None
+        self._saved_file = None
+        self._compression = ""
+        self.binary_model = False
+        self.split_namespaces = False
+        self._split_files = []
+        self._nodeset_paths = {}
         self.modified = False
+        self.validator.reset()
+        self.instance_plans.clear()
         self.titleChanged.emit("")
         self.modeler.clear_all_widgets()
 
     def new_model(self):
         if self.modified:
             raise RuntimeError("Model is modified, cannot create new model")
-        del (self.new_nodes[:])  # empty list while keeping reference
+        self.new_nodes.clear()  # empty set while keeping reference
+        self.validator.reset()
+        self.instance_plans.clear()
 
-        endpoint = "opc.tcp://0.0.0.0:48400/freeopcua/uamodeler/"
-        logger.info("Starting server on %s", endpoint)
-        self.server_mgr.start_server(endpoint)
+        logger.info("Starting server on %s", self.endpoint)
+        self.server_mgr.start_server(self.endpoint)
         self.server_mgr.add_default_namespace()
 
         self.modeler.tree_ui.set_root_node(self.server_mgr.nodes.root)
-        self.modeler.idx_ui.set_node(self.server_mgr.get_node(ua.ObjectIds.Server_NamespaceArray))
+        self.modeler.idx_ui.set_table(self.server_mgr.namespaces)
         self.modeler.nodesets_ui.set_server_mgr(self.server_mgr)
+        self._start_indexing()
         self.modified = False
         self.modeler.actions.enable_model_actions()
         self.current_path = None
@@ -97,14 +379,137 @@ class ModelManager(QObject):
         return True
 
     def import_xml(self, path):
-        new_nodes = self.server_mgr.import_xml(path)
-        self.new_nodes.extend([self.server_mgr.get_node(node) for node in new_nodes])
-        self.modified = True
+        streaming = os.path.getsize(path) >= int(self.settings.value("streaming_import_min_size", 50 * 1024 * 1024))
+        self.modeler.nodesets_ui.import_dependencies(path)
+        new_nodes = self.server_mgr.import_xml(path, streaming, int(self.settings.value("import_batch_size", 1000)))
+        self._journal_op("import_xml", path)
+        self.new_nodes.update(new_nodes)
+        self._start_indexing(new_nodes)
+        self.changes.mark_structural()
         # we maybe should only reload the imported nodes
         self.modeler.tree_ui.reload()
-        self.modeler.idx_ui.reload()
         return path
 
+    def import_from_server(self, url, roots=None):
+        """
+        import the nodes below roots, Objects and Types folders by default, of the server at url
+        """
+        roots = [ua.NodeId.from_string(root) if isinstance(root, str) else root for root in roots or DEFAULT_ROOTS]
+        limits = RequestLimits(int(self.settings.value("remote_import_sessions", 4)),
+                               int(self.settings.value("remote_import_browse_batch", 500)),
+                               int(self.settings.value("remote_import_read_batch", 2000)),
+                               int(self.settings.value("remote_import_max_references", 1000)))
+        logger.info("Importing %s from %s", ", ".join(root.to_string() for root in roots), url)
+        new_nodes = self.server_mgr.import_from_server(url, roots, limits=limits)
+        self._journal_op("import_from_server", url, [root.to_string() for root in roots])
+        self.new_nodes.update(new_nodes)
+        self._start_indexing(new_nodes)
+        self.changes.mark_structural()
+        self.modeler.tree_ui.reload()
+        return new_nodes
+
+    def add_namespace(self, uri):
+        """
+        append namespace uri, return its index
+        """
+        idx = len(self.server_mgr.get_namespace_array())
+        self.set_namespace_uri(idx, uri)
+        return idx
+
+    def set_namespace_uri(self, idx, uri):
+        """
+        change the uri of namespace idx, nodes keep their index. idx equal to the number
+        of namespaces adds a namespace
+        """
+        uris = self.server_mgr.get_namespace_array()
+        if not 0 < idx <= len(uris):
+            raise ValueError(f"Cannot set uri of namespace {idx}")
+        if uri in uris and uris.index(uri) != idx:
+            raise ValueError(f"Namespace {uri} already exists")
+        if idx == len(uris):
+            uris.append(uri)
+        elif uris[idx] == uri:
+            return
+        else:
+            uris[idx] = uri
+        self._write_namespace_array(uris)
+
+    def _write_namespace_array(self, uris):
+        self._journal_op("write_namespace_array", uris)
+        self.server_mgr.write_namespace_array(uris)
+        self.changes.mark_structural()
+
+    def remove_namespace(self, uri):
+        """
+        remove namespace uri and its nodes, see change_namespaces
+        """
+        uris = self.server_mgr.get_namespace_array()
+        if uri not in uris[1:]:
+            raise ValueError(f"There is no namespace {uri} to remove")
+        return self.change_namespaces([val for val in uris if val != uri])
+
+    def change_namespaces(self, uris):
+        """
+        replace namespace array with uris to remove or reorder namespaces. Nodes of removed
+        namespaces are deleted with their children and the nodes using them as type definition
+        or data type. Nodes of namespaces whose index changes are recreated with new nodeids.
+        Return the number of deleted nodes and of renumbered nodes
+        """
+        old_uris = self.server_mgr.get_namespace_array()
+        if not uris or uris[0] != old_uris[0]:
+            raise ValueError("Namespace 0 cannot be removed or moved")
+        if len(set(uris)) != len(uris):
+            raise ValueError("A namespace cannot appear twice")
+        self.stop_simulation()
+        indexes = {idx: uris.index(uri) for idx, uri in enumerate(old_uris) if uri in uris}
+        by_namespace = self.server_mgr.namespace_index()
+        removed = [nodeid for idx in range(1, len(old_uris)) if idx not in indexes for nodeid in by_namespace.get(idx, [])]
+        kept = [nodeid for idx, nodeids in by_namespace.items() if idx != 0 and idx in indexes for nodeid in nodeids]
+        deleted = self._namespace_dependents(removed, kept)
+        moved = [nodeid for nodeid in kept if indexes[nodeid.NamespaceIndex] != nodeid.NamespaceIndex and nodeid not in deleted]
+        logger.info("Deleting %s nodes and renumbering %s nodes", len(deleted), len(moved))
+        if deleted:
+            self.server_mgr.delete_namespace_nodes(deleted)
+            self.new_nodes.difference_update(deleted)
+        for nodeid in list(deleted) + moved:
+            self.search_index.remove(nodeid)
+        if moved:
+            new_nodes = self.server_mgr.renumber_namespaces(uris, moved)
+            self.new_nodes.renumber_namespaces(indexes)
+            index_nodes(self.server_mgr, self.search_index, new_nodes)
+            self.server_mgr.load_type_definitions()
+        else:
+            self.server_mgr.write_namespace_array(uris)
+        self._journal_op("change_namespaces", uris)
+        self.undo_stack.clear()  # commands refer to deleted and old nodeids
+        self.undoStateChanged.emit()
+        self.changes.mark_structural()
+        self.modeler.renumber_tree_namespaces(indexes, deleted)
+        return len(deleted), len(moved)
+
+    def _namespace_dependents(self, nodeids, candidates):
+        """
+        nodeids and their children outside of namespace 0, with the candidates using
+        one of them as type definition or data type and their children too
+        """
+        deleted = NodeKeySet()
+        level = [nodeid for nodeid in nodeids if nodeid.NamespaceIndex != 0]
+        while level:
+            deleted.update(level)
+            next_level = []
+            for refs in self.server_mgr.browse(level):
+                for ref in refs:
+                    if ref.NodeId.NamespaceIndex != 0 and ref.NodeId not in deleted:
+                        next_level.append(ref.NodeId)
+            level = list(NodeKeySet(next_level))
+            if not level:
+                candidates = [nodeid for nodeid in candidates if nodeid not in deleted]
+                typedefs = self.server_mgr.browse(candidates, ua.ObjectIds.HasTypeDefinition)
+                dtypes = self.server_mgr.read_attributes(candidates, ua.AttributeIds.DataType)
+                level = [nodeid for nodeid, refs, dv in zip(candidates, typedefs, dtypes)
+                         if any(ref.NodeId in deleted for ref in refs) or (dv.StatusCode.is_good() and dv.Value.Value in deleted)]
+        return deleted
+
     def open_xml(self, path):
         self.new_model()
         try:
@@ -113,15 +518,164 @@ class ModelManager(QObject):
             self.close_model(force=True)
             raise
 
+    def _start_indexing(self, nodeids=None):
+        """
+        index the whole address space, or only given nodes, in a background thread
+        """
+        builder = IndexBuilder(self.server_mgr, self.search_index, nodeids, callback=self.searchIndexReady.emit)
+        self._index_builders = [b for b in self._index_builders if b.is_alive()]
+        self._index_builders.append(builder)
+        builder.start()
+
+    def _stop_indexing(self):
+        for builder in self._index_builders:
+            builder.stop()
+        for builder in self._index_builders:
+            builder.join()
+        self._index_builders = []
+        self.search_index.clear()
+
     def _open_xml(self, path):
         path = self.import_xml(path)
         self.server_mgr.load_enums()
         self.server_mgr.load_type_definitions()
         self._show_structs()
+        self._compression = split_compression(path)[1]
+        self._model_opened(path)
+
+    def _model_opened(self, path):
         self.modified = False
         self.current_path = path
+        self._recover_journal(path)
+        self._journal = ModelJournal(self._journal_path())
+        self._journal.open()
         self.titleChanged.emit(self.current_path)
 
+    def _journal_path(self):
+        return os.path.splitext(split_compression(self.current_path)[0])[0] + ".journal"
+
+    def _journal_op(self, op, *args):
+        if self._journal is not None and not self._replaying:
+            self._journal.append(op, *args)
+
+    def _journal_created(self, op, parent, new_nodes, *args):
+        """
+        journal an operation creating nodes with the nodeids it created.
+        generated nodeids may differ when replaying, they are then remapped
+        """
+        nodeids = [node.nodeid for node in new_nodes]
+        if self._replaying:
+            self._replay_created = nodeids
+        else:
+            self._journal_op(op, parent, nodeids, *args)
+
+    def _reset_journal(self):
+        """
+        model has been saved, start with an empty journal
+        """
+        path = self._journal_path()
+        if self._journal is not None and self._journal.path != path:
+            self._journal.discard()
+            self._journal = None
+        if self._journal is None:
+            self._journal = ModelJournal(path)
+        self._journal.reset()
+
+    def _recover_journal(self, xml_path):
+        """
+        replay operations done after last save of model, if the modeler crashed
+        """
+        path = self._journal_path()
+        if not ModelJournal.has_records(path):
+            return
+        if os.path.getmtime(path) < os.path.getmtime(xml_path):
+            logger.warning("Journal %s is older than model %s, ignoring it", path, xml_path)
+            return
+        logger.warning("Recovering unsaved changes from journal %s", path)
+        count = 0
+        self._remap = {}
+        self._replaying = True
+        try:
+            for op, args in ModelJournal.read(path, self._get_replayed_node):
+                try:
+                    self._replay(op, args)
+                except Exception as ex:
+                    # the model may have been saved or edited by another way since the op was journaled
+                    logger.warning("Could not replay %s, skipping it: %s", op, ex)
+                    continue
+                count += 1
+        finally:
+            self._replaying = False
+            self._parent_override = None
+            self._remap = {}
+        logger.warning("%s operations recovered from journal", count)
+        self.modeler.tree_ui.reload()
+
+    def _get_replayed_node(self, nodeid):
+        return self.server_mgr.get_node(self._remap.get(nodeid, nodeid))
+
+    def _replay(self, op, args):
+        if op.startswith("add_") or op == "paste_node":
+            parent, nodeids = args[:2]
+            self._parent_override = parent
+            self._replay_created = []
+            try:
+                getattr(self, op)(*args[2:])
+            finally:
+                self._parent_override = None
+            if len(nodeids) != len(self._replay_created):
+                logger.warning("%s created %s nodes when replayed instead of %s", op, len(self._replay_created), len(nodeids))
+            for old, new in zip(nodeids, self._replay_created):
+                if old != new:
+                    self._remap[old] = new
+        elif op == "delete_node":
+            if not self.server_mgr.read_node_attributes([args[0].nodeid], [ua.AttributeIds.NodeClass])[0]:
+                logger.warning("Node %s deleted in journal does not exist, skipping", args[0].nodeid)
+                return
+            self.delete_node(args[0], interactive=False)
+        elif op == "write_attribute":
+            node, attr, dv = args
+            attr = ua.AttributeIds(attr)
+            if isinstance(dv.Value.Value, ua.NodeId):
+                dv.Value.Value = self._remap.get(dv.Value.Value, dv.Value.Value)
+            old = self.server_mgr.read_attributes([node.nodeid], attr)[0]
+            node.write_attribute(attr, dv)
+            self._push_command(WriteAttributeCommand(f"Write {attr.name}", node.nodeid, attr, old, dv))
+            self._update_written_node(node, attr, dv)
+        elif op == "undo":
+            self.undo()
+        elif op == "redo":
+            self.redo()
+        elif op == "set_references":
+            self._set_references(*args)
+        elif op == "write_attribute_to_nodes":
+            nodes, attr, dv = args
+            self.write_attribute_to_nodes(nodes, ua.AttributeIds(attr), dv)
+        elif op == "change_references":
+            add, delete, text, undoable = args
+            self.change_references([self._remap_reference(ref) for ref in add], [self._remap_reference(ref) for ref in delete], text, undoable)
+        elif op == "change_namespaces":
+            self.change_namespaces(args[0])
+        elif op == "write_namespace_array":
+            self._write_namespace_array(args[0])
+        elif op == "merge":
+            self.merge(*args)
+        elif op == "resolve_conflicts":
+            their_path, conflicts = args
+            self.resolve_conflicts(their_path, [{"node": node, "kind": kind, "attribute": attr or None} for node, kind, attr in conflicts])
+        elif op == "import_xml":
+            self.import_xml(args[0])
+        elif op == "import_from_server":
+            self.import_from_server(*args)
+        elif op == "import_nodeset":
+            self.modeler.nodesets_ui.import_nodeset(args[0])
+        else:
+            raise ValueError(f"Unknown operation {op} in journal")
+
+    def _remap_reference(self, ref):
+        source, reftype, target, forward = ref
+        return (self._remap.get(source, source), reftype, self._remap.get(target, target), forward)
+
     def _show_structs(self):
         base_struct = self.server_mgr.get_node(ua.ObjectIds.Structure)
         opc_binary = self.server_mgr.get_node(ua.ObjectIds.OPCBinarySchema_TypeSystem)
@@ -180,8 +734,10 @@ class ModelManager(QObject):
         return None
 
     def open(self, path):
-        if path.endswith(".xml"):
+        if is_xml(path):
             self.open_xml(path)
+        elif path.endswith(BINARY_MODEL_EXTENSION):
+            self.open_binary_model(path)
         else:
             self.open_ua_model(path)
 
@@ -199,134 +755,609 @@ class ModelManager(QObject):
         for ref_el in root.findall("Reference"):
             refpath = ref_el.attrib['path']
             self.modeler.nodesets_ui.import_nodeset(refpath)
-        mod_el = root.find("Model")
+        mod_els = root.findall("Model")
         dirname = os.path.dirname(path)
-        xmlpath = os.path.join(dirname, mod_el.attrib['path'])
-        self._open_xml(xmlpath)
-        if "current_node" in mod_el.attrib:
-            current_node_str = mod_el.attrib['current_node']
+        xmlpaths = [os.path.join(dirname, mod_el.attrib['path']) for mod_el in mod_els]
+        if root.get("split") == "true":
+            self._open_xml_split(path, xmlpaths)
+        else:
+            self._open_xml(xmlpaths[0])
+        if mod_els and "current_node" in mod_els[0].attrib:
+            current_node_str = mod_els[0].attrib['current_node']
             nodeid = ua.NodeId.from_string(current_node_str)
             current_node = self.server_mgr.get_node(nodeid)
             self.modeler.tree_ui.expand_to_node(current_node)
 
+    def _open_xml_split(self, path, xmlpaths):
+        """
+        open a model saved as one file per namespace, files are listed in dependency order
+        """
+        for xmlpath in xmlpaths:
+            self.import_xml(xmlpath)
+        self.server_mgr.load_enums()
+        self.server_mgr.load_type_definitions()
+        self._show_structs()
+        self._compression = split_compression(xmlpaths[0])[1]
+        self._split_files = xmlpaths
+        self.split_namespaces = True
+        self._model_opened(path)
+
     def _get_path(self, path):
-        if path is None:
+        if path is not None:
+            self._compression = split_compression(path)[1]
+            self.binary_model = path.endswith(BINARY_MODEL_EXTENSION)
+        else:
             path = self.current_path
         if path is None:
             raise ValueError("No path is defined")
-        self.current_path = os.path.splitext(path)[0]
+        self.current_path = os.path.splitext(split_compression(path)[0])[0]
         self.titleChanged.emit(self.current_path)
         return self.current_path
 
     def save_xml(self, path=None):
+        self.stop_simulation()  # simulated values are not part of model
+        if self.split_namespaces:
+            base_nodes = [nodeid for nodeid in self.new_nodes if nodeid.NamespaceIndex == 0]
+            if base_nodes:
+                # their file would redefine the base OPC UA model
+                raise ValueError(f"Nodes of namespace 0 cannot be saved as one file per namespace: {base_nodes[:10]}")
         self._save_structs()
         path = self._get_path(path)
-        path += ".xml"
-        logger.info("Saving nodes to %s", path)
-        logger.info("Exporting  %s nodes: %s", len(self.new_nodes), self.new_nodes)
-        logger.info("and namespaces: %s ", self.server_mgr.get_namespace_array()[1:])
-        self.new_nodes = list(OrderedDict.fromkeys(self.new_nodes))  # remove any potential duplicate
-        self.server_mgr.export_xml(self.new_nodes, path)
+        if self.split_namespaces:
+            path = self._save_xml_split(path)
+        else:
+            path += ".xml" + self._compression
+            logger.info("Saving nodes to %s", path)
+            if not self._save_xml_incremental(path):
+                logger.info("Exporting  %s nodes", len(self.new_nodes))
+                logger.info("and namespaces: %s ", self.server_mgr.get_namespace_array()[1:])
+                self.server_mgr.export_xml([self.server_mgr.get_node(nodeid) for nodeid in self.new_nodes], path)
+            self._saved_file = (path, os.path.getmtime(path))
         self.modified = False
+        self._reset_journal()
         logger.info("%s saved", path)
         self._show_structs()  #_save_structs has delete our design nodes for structure, we need to recreate them
 
+    def _save_xml_split(self, path):
+        """
+        export nodes of each namespace to its own file, files are written concurrently
+        """
+        by_namespace = {}
+        for nodeid in self.new_nodes:
+            by_namespace.setdefault(nodeid.NamespaceIndex, []).append(nodeid)
+        ns_array = self.server_mgr.get_namespace_array()
+        dates = self._publication_dates()
+        # same date in all files, models required with the save date must not be older
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        trees = []
+        for idx in sorted(by_namespace):
+            nodes = [self.server_mgr.get_node(nodeid) for nodeid in by_namespace[idx]]
+            logger.info("Exporting %s nodes of namespace %s", len(nodes), ns_array[idx])
+            root = add_models_element(self.server_mgr.export_etree(nodes), ns_array[idx], now, dates)
+            trees.append((ns_array[idx], root, namespace_file_name(path, ns_array[idx], ".xml" + self._compression)))
+        workers = self.settings.value("export_workers", None)
+        trees = [(root, xmlpath) for _, root, xmlpath in dependency_order(trees)]
+        self._split_files = write_nodesets(trees, int(workers) if workers else None)
+        self._saved_file = None
+        return path
+
+    def export_selection(self, nodes, path):
+        """
+        export subtrees of nodes and the custom types they need, without the rest of the model
+        """
+        nodeids = self.selection_closure([node.nodeid for node in nodes])
+        logger.info("Exporting %s nodes of selection to %s", len(nodeids), path)
+        self.server_mgr.export_xml([self.server_mgr.get_node(nodeid) for nodeid in nodeids], path)
+        return nodeids
+
+    def export_loader(self, path, measure=True):
+        """
+        write a Python module loading the model into an asyncua server, see server_loader.
+        If measure is True, return startup times of the loader and of the XML export of the model
+        """
+        self.stop_simulation()
+        logger.info("Exporting loader of %s nodes to %s", len(self.new_nodes), path)
+        design_nodes = self._save_structs()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                snapshot = take_snapshot(self.server_mgr, list(self.new_nodes))
+                write_loader(path, self.server_mgr.get_namespace_array(), node_items(snapshot), reference_items(snapshot))
+                if measure:
+                    xml_path = os.path.join(tmpdir, "model.xml")
+                    self.server_mgr.export_xml([self.server_mgr.get_node(nodeid) for nodeid in self.new_nodes], xml_path)
+            finally:
+                # journal and undo commands refer to the design nodes, they are recreated with the same nodeids
+                if design_nodes is not None:
+                    self.restore_nodes(design_nodes)
+            if not measure:
+                return None
+            nodesets = [self._nodeset_paths.get(name, name) for name in self.modeler.nodesets_ui.nodesets]
+            return measure_startup(path, xml_path, nodesets)
+
+    def validate(self):
+        """
+        check model, only nodes changed since last validation are checked again
+        """
+        return self.validator.validate(self.new_nodes)
+
+    def start_simulation(self, generator, rate=None, nodeids=None):
+        """
+        write values of generator to numeric variables of model, or of nodeids, until stop_simulation()
+        """
+        self.stop_simulation()
+        rate = rate or float(self.settings.value("simulation_rate", 10.0))
+        simulation = Simulation(self.server_mgr, rate, int(self.settings.value("simulation_batch_size", self.server_mgr.batch_size)))
+        if not simulation.add(list(self.new_nodes) if nodeids is None else nodeids, generator):
+            raise RuntimeError("No numeric or boolean scalar variable to simulate")
+        self.simulation = simulation
+        simulation.start()
+        self.simulationStateChanged.emit(True)
+
+    def stop_simulation(self):
+        """
+        stop simulation and restore original values, return its report
+        """
+        if self.simulation is None:
+            return None
+        self.simulation.stop()
+        report = self.simulation.report()
+        self.simulation = None
+        logger.info("Simulation of %s variables at %s Hz: %s Hz achieved, mean lag %s ms, %s ticks missed",
+                    report["variables"], report["target_rate"], report["actual_rate"], report["mean_lag_ms"], report["missed_ticks"])
+        self.simulationStateChanged.emit(False)
+        return report
+
+    def diff_with_file(self, path):
+        """
+        compare NodeSet2 file at path, as old revision, with current model
+        """
+        diff = diff_indexes(index_file(path), self._model_index(), self._workers())
+        logger.info("Compared model with %s: %s added, %s removed, %s changed nodes",
+                    path, len(diff.added), len(diff.removed), len(diff.changed))
+        return diff
+
+    def _workers(self):
+        return int(self.settings.value("export_workers", 0) or 0) or os.cpu_count() or 1
+
+    def _model_index(self):
+        """
+        node digests of current model, as model_diff builds them for files
+        """
+        return index_etree(self.server_mgr.export_etree([self.server_mgr.get_node(nodeid) for nodeid in self.new_nodes]))
+
+    def merge(self, base_path, their_path):
+        """
+        three-way merge: apply to current model the changes of model at their_path
+        since base_path. Return the MergePlan, its conflicts are not applied,
+        resolve_conflicts takes their side of some of them.
+        Merging cannot be undone, undo history is cleared
+        """
+        base_index, their_index = index_files([base_path, their_path], self._workers())
+        plan = three_way(base_index, self._model_index(), their_index)
+        self._apply_merge_plan(plan, their_path)
+        self._journal_op("merge", base_path, their_path)
+        return plan
+
+    def resolve_conflicts(self, their_path, conflicts):
+        """
+        take their side of merge conflicts, as listed by MergePlan
+        """
+        plan = resolution_plan(conflicts)
+        self._apply_merge_plan(plan, their_path)
+        self._journal_op("resolve_conflicts", their_path, [[c["node"], c["kind"], c["attribute"] or ""] for c in conflicts])
+        return plan
+
+    def _apply_merge_plan(self, plan, their_path):
+        ns_array = self.server_mgr.get_namespace_array()
+        if plan.delete:
+            nodeids = [to_nodeid(nodeid, ns_array) for nodeid in plan.delete]
+            self.server_mgr.delete_nodes(nodeids)
+            self.new_nodes.difference_update(nodeids)
+            for nodeid in nodeids:
+                self.search_index.remove(nodeid)
+            self.changes.mark(nodeids, Change.DELETED)
+        if plan.add:
+            new_nodes = self.server_mgr.import_etree(extract_nodes(their_path, set(plan.add)))
+            self.new_nodes.update(new_nodes)
+            self.changes.mark(new_nodes, Change.CREATED)
+            index_nodes(self.server_mgr, self.search_index, new_nodes)
+            ns_array = self.server_mgr.get_namespace_array()  # import may have added namespaces
+        if plan.write:
+            wanted = {to_nodeid(nodeid, ns_array): names for nodeid, names in plan.write.items()}
+            values = self.server_mgr.read_xml_attributes(their_path, wanted)
+            items = [(nodeid, getattr(ua.AttributeIds, name), ua.DataValue(variant))
+                     for nodeid, attrs in values.items() for name, variant in attrs.items()]
+            for (nodeid, attr, _), status in zip(items, self.server_mgr.write_attributes(items)):
+                if not status.is_good():
+                    logger.warning("Could not write %s of %s: %s", attr.name, nodeid, status)
+            self.changes.mark(list(values), Change.ATTRIBUTES)
+            index_nodes(self.server_mgr, self.search_index, list(values))
+        if plan.add_refs:
+            self.server_mgr.add_references([self._merge_ref_item(ua.AddReferencesItem(), ref, ns_array) for ref in plan.add_refs])
+        if plan.delete_refs:
+            self.server_mgr.delete_references([self._merge_ref_item(ua.DeleteReferencesItem(), ref, ns_array) for ref in plan.delete_refs])
+        self.changes.mark([to_nodeid(ref[0], ns_array) for ref in plan.add_refs + plan.delete_refs], Change.REFERENCES)
+        for nodeid, attr in plan.skipped:
+            logger.warning("%s of %s changed but cannot be written, it was not merged", attr, nodeid)
+        self.undo_stack.clear()
+        self.undoStateChanged.emit()
+        self.modified = True
+        self.modeler.tree_ui.reload()
+
+    @staticmethod
+    def _merge_ref_item(item, ref, ns_array):
+        source, reftype, target, forward = ref
+        item.SourceNodeId = to_nodeid(source, ns_array)
+        item.ReferenceTypeId = to_nodeid(reftype, ns_array)
+        item.TargetNodeId = to_nodeid(target, ns_array)
+        item.IsForward = forward
+        return item
+
+    def selection_closure(self, nodeids):
+        """
+        return nodes of the subtrees of nodeids and, recursively, the types outside
+        of namespace 0 they depend on with their own subtree. Subtypes are not followed
+        """
+        skip = (ua.NodeId(ua.ObjectIds.HasSubtype),)
+        selected = NodeKeySet()
+        level = nodeids
+        while level:
+            added = [nodeid for nodeid in descendants(self.server_mgr, level, skip) if nodeid not in selected]
+            selected.update(added)
+            level = [nodeid for nodeid in self._referenced_types(added) if nodeid.NamespaceIndex != 0 and nodeid not in selected]
+        return list(selected)
+
+    def _referenced_types(self, nodeids):
+        """
+        type definitions, supertypes, data types, encodings and reference types used by nodes
+        """
+        types = NodeKeySet()
+        followed = (ua.NodeId(ua.ObjectIds.HasTypeDefinition), ua.NodeId(ua.ObjectIds.HasEncoding))
+        for refs in self.server_mgr.browse(nodeids, ua.ObjectIds.References):
+            for ref in refs:
+                types.add(ref.ReferenceTypeId)
+                if ref.ReferenceTypeId in followed:
+                    types.add(ref.NodeId)
+        for refs in self.server_mgr.browse(nodeids, ua.ObjectIds.HasSubtype, ua.BrowseDirection.Inverse):
+            types.update(ref.NodeId for ref in refs)
+        for dv in self.server_mgr.read_attributes(nodeids, ua.AttributeIds.DataType):
+            if dv.StatusCode.is_good() and dv.Value.Value is not None:
+                types.add(dv.Value.Value)
+        return list(types)
+
+    def _publication_dates(self):
+        """
+        publication date of models known by server, formatted as in NodeSet2 files
+        """
+        dates = {}
+        for model_node in self.server_mgr.nodes.namespaces.get_children():
+            date = model_node.get_child("NamespacePublicationDate").read_value()
+            if date:
+                dates[model_node.get_child("NamespaceUri").read_value()] = date.strftime("%Y-%m-%dT%H:%M:%SZ")
+        return dates
+
+    def _save_xml_incremental(self, path):
+        """
+        re-export only changed nodes and splice them into the file we saved last time
+        """
+        if self.changes.structural or is_compressed(path) or not os.path.exists(path):
+            return False
+        if self._saved_file != (path, os.path.getmtime(path)):
+            return False  # not our last save, or modified by someone else
+        changed = [nodeid for nodeid in self.changes.nodeids(Change.CREATED | Change.ATTRIBUTES | Change.REFERENCES)
+                   if nodeid in self.new_nodes]
+        deleted = self.changes.nodeids(Change.DELETED)
+        logger.info("Exporting %s changed nodes and removing %s nodes", len(changed), len(deleted))
+        partial = self.server_mgr.export_etree([self.server_mgr.get_node(nodeid) for nodeid in changed])
+        return splice_nodeset(path, partial, deleted, self.server_mgr.get_namespace_array())
+
     def save_ua_model(self, path=None):
+        self.stop_simulation()
         path = self._get_path(path)
+        if self.binary_model:
+            return self._save_binary_model(path)
         model_path = path + ".uamodel"
         logger.info("Saving model to %s", model_path)
         etree = Et.ElementTree(Et.Element('UAModel'))
-        node_el = Et.SubElement(etree.getroot(), "Model")
-        node_el.attrib["path"] = os.path.basename(path) + ".xml"
+        if self.split_namespaces:
+            etree.getroot().attrib["split"] = "true"
+            xmlpaths = [os.path.basename(xmlpath) for xmlpath in self._split_files]
+        else:
+            xmlpaths = [os.path.basename(path) + ".xml" + self._compression]
+        for xmlpath in xmlpaths:
+            Et.SubElement(etree.getroot(), "Model").attrib["path"] = xmlpath
+        node_el = etree.getroot().find("Model")
         c_node = self.modeler.tree_ui.get_current_node()
-        if c_node:
+        if c_node and node_el is not None:
             node_el.attrib["current_node"] = c_node.nodeid.to_string()
         for refpath in self.modeler.nodesets_ui.nodesets:
             node_el = Et.SubElement(etree.getroot(), "Reference")
-            node_el.attrib["path"] = refpath
+            node_el.attrib["path"] = self._nodeset_paths.get(refpath, refpath)
         etree.write(model_path, encoding='utf-8', xml_declaration=True)
         return model_path
 
-    def _after_add(self, new_nodes):
-        if isinstance(new_nodes, (list, tuple)):
-            for node in new_nodes:
-                if node not in self.new_nodes:
-                    self.new_nodes.append(node)
-        else:
-            if new_nodes not in self.new_nodes:
-                self.new_nodes.append(new_nodes)
-        self.modeler.tree_ui.reload_current()
-        self.modeler.show_refs()
-        self.modified = True
+    def open_binary_model(self, path):
+        self.new_model()
+        try:
+            self._open_binary_model(path)
+        except:
+            self.close_model(force=True)
+            raise
+
+    def _open_binary_model(self, path):
+        with BinaryModel(path) as model:
+            for nodeset, fingerprint in model.nodesets:
+                if not os.path.exists(nodeset):
+                    # older models only stored the file name
+                    nodeset = os.path.join(os.path.dirname(os.path.abspath(path)), os.path.basename(nodeset))
+                self.modeler.nodesets_ui.import_nodeset(nodeset)
+                if fingerprint != self._nodeset_fingerprint(os.path.basename(nodeset)):
+                    logger.warning("Reference nodeset %s changed since model was saved", nodeset)
+            uris = self.server_mgr.get_namespace_array()
+            if model.namespaces[:len(uris)] != uris:
+                raise ValueError(f"Namespaces of reference nodesets do not match the ones of {path}, open the XML export of the model instead")
+            self.server_mgr.write_namespace_array(model.namespaces)
+            nodeids = self._load_binary_nodes(model)
+            current_node = model.current_node
+        self.new_nodes.update(nodeids)
+        self._start_indexing(nodeids)
+        self.server_mgr.load_enums()
+        self.server_mgr.load_type_definitions()
+        self._show_structs()
+        self.binary_model = True
+        self._model_opened(path)
+        self.modeler.tree_ui.reload()
+        if current_node is not None:
+            self.modeler.tree_ui.expand_to_node(self.server_mgr.get_node(current_node))
+
+    def _load_binary_nodes(self, model):
+        """
+        create nodes of model in batches, nodes failing because they were saved
+        before a node they depend on are retried at the end
+        """
+        nodeids = []
+        failed = []
+        batch_size = self.server_mgr.batch_size
+        for start in range(0, model.node_count, batch_size):
+            failed.extend(self._add_node_items(model.node_items(start, start + batch_size), nodeids))
+        while failed:
+            still_failed = self._add_node_items(failed, nodeids)
+            if len(still_failed) == len(failed):
+                logger.warning("Could not create %s nodes of model: %s", len(failed), [item.RequestedNewNodeId for item in failed])
+                break
+            failed = still_failed
+        count = 0
+        for start in range(0, model.reference_count, batch_size):
+            results = self.server_mgr.add_references(model.reference_items(start, start + batch_size))
+            count += sum(1 for result in results if not result.is_good())
+        if count:
+            logger.info("%s references were not added, they most probably already exist", count)
+        logger.info("Loaded %s nodes and %s references", len(nodeids), model.reference_count)
+        return nodeids
+
+    def _add_node_items(self, items, nodeids):
+        failed = []
+        for item, result in zip(items, self.server_mgr.add_nodes(items)):
+            if result.StatusCode.is_good():
+                nodeids.append(result.AddedNodeId)
+            else:
+                failed.append(item)
+        return failed
+
+    def _save_binary_model(self, path):
+        """
+        save nodes and references of model with the reference nodesets and namespaces they need
+        """
+        model_path = path + BINARY_MODEL_EXTENSION
+        logger.info("Saving binary model to %s", model_path)
+        self._save_structs()
+        snapshot = take_snapshot(self.server_mgr, list(self.new_nodes))
+        self._show_structs()
+        nodesets = [(os.path.abspath(self._nodeset_paths.get(name, name)), self._nodeset_fingerprint(name)) for name in self.modeler.nodesets_ui.nodesets]
+        c_node = self.modeler.tree_ui.get_current_node()
+        write_binary_model(model_path, self.server_mgr.get_namespace_array(), nodesets, c_node.nodeid if c_node else None,
+                           node_items(snapshot), reference_items(snapshot))
+        self._saved_file = None
+        self.modified = False
+        self._reset_journal()
+        return model_path
+
+    def _nodeset_fingerprint(self, name):
+        path = self._nodeset_paths.get(name, name)
+        if not os.path.exists(path):
+            return b""
+        return file_fingerprint(path)
+
+    def _after_add(self, new_nodes, op, parent, args):
+        if not isinstance(new_nodes, (list, tuple)):
+            new_nodes = [new_nodes]
+        self._journal_created(op, parent, new_nodes, *args)
+        self._push_command(AddNodesCommand(op.replace("_", " ").capitalize(), [node.nodeid for node in new_nodes]))
+        self.new_nodes.update(new_nodes)
+        self.changes.mark(new_nodes, Change.CREATED)
+        self.changes.mark([parent], Change.REFERENCES)
+        index_nodes(self.server_mgr, self.search_index, [node.nodeid for node in new_nodes])
+        if not self._replaying:
+            self.modeler.tree_ui.reload_current()
+            self.modeler.show_refs()
 
     def add_method(self, *args):
         logger.info("Creating method type with args: %s", args)
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         new_nodes = []
         new_node = parent.add_method(*args)
         new_nodes.append(new_node)
         new_nodes.extend(new_node.get_children())
-        self._after_add(new_nodes)
+        self._after_add(new_nodes, "add_method", parent, args)
         return new_nodes
 
     def add_object_type(self, *args):
         logger.info("Creating object type with args: %s", args)
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         new_node = parent.add_object_type(*args)
-        self._after_add(new_node)
+        self._after_add(new_node, "add_object_type", parent, args)
         return new_node
 
     def add_folder(self, *args):
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         logger.info("Creating folder with args: %s", args)
         new_node = parent.add_folder(*args)
-        self._after_add(new_node)
+        self._after_add(new_node, "add_folder", parent, args)
         return new_node
 
     def add_object(self, *args):
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         logger.info("Creating object with args: %s", args)
         nodeid, bname, otype = args
-        new_nodes = instantiate(parent, otype, bname=bname, nodeid=nodeid, dname=ua.LocalizedText(bname.Name))
-        self._after_add(new_nodes)
+        nodeids = self.instance_plans.instantiate(parent, otype.nodeid, [(nodeid, bname, ua.LocalizedText(bname.Name))])
+        new_nodes = [self.server_mgr.get_node(nodeid) for nodeid in nodeids]
+        self._after_add(new_nodes, "add_object", parent, args)
+        return new_nodes
+
+    def add_objects(self, *args):
+        """
+        create count instances of otype, named bname followed by their number, from 1 to count.
+        A string or numeric nodeid is numbered the same way, a null one lets the server choose
+        """
+        parent = self._get_parent()
+        logger.info("Creating objects with args: %s", args)
+        nodeid, bname, otype, count = args
+        instances = []
+        for number in range(1, count + 1):
+            name = f"{bname.Name}{number}"
+            instances.append((self._numbered_nodeid(nodeid, number), ua.QualifiedName(name, bname.NamespaceIndex), ua.LocalizedText(name)))
+        nodeids = self.instance_plans.instantiate(parent, otype.nodeid, instances)
+        new_nodes = [self.server_mgr.get_node(nodeid) for nodeid in nodeids]
+        self._after_add(new_nodes, "add_objects", parent, args)
         return new_nodes
 
+    @staticmethod
+    def _numbered_nodeid(nodeid, number):
+        if nodeid.has_null_identifier():
+            return nodeid
+        if nodeid.NodeIdType == ua.NodeIdType.String:
+            return ua.NodeId(f"{nodeid.Identifier}{number}", nodeid.NamespaceIndex)
+        if isinstance(nodeid.Identifier, int):
+            return ua.NodeId(nodeid.Identifier + number - 1, nodeid.NamespaceIndex)
+        raise ValueError(f"Cannot number nodeid {nodeid}, use a string, numeric or null nodeid")
+
     def add_data_type(self, *args):
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         logger.info("Creating data type with args: %s", args)
         new_node = parent.add_data_type(*args)
-        self._after_add(new_node)
+        self._after_add(new_node, "add_data_type", parent, args)
         return new_node
 
     def add_variable(self, *args):
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         logger.info("Creating variable with args: %s", args)
         new_node = parent.add_variable(*args)
-        self._after_add(new_node)
+        self._after_add(new_node, "add_variable", parent, args)
         return new_node
 
     def add_property(self, *args):
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         logger.info("Creating property with args: %s", args)
         new_node = parent.add_property(*args)
-        self._after_add(new_node)
+        self._after_add(new_node, "add_property", parent, args)
         return new_node
 
     def add_variable_type(self, *args):
-        parent = self.modeler.tree_ui.get_current_node()
+        parent = self._get_parent()
         logger.info("Creating variable type with args: %s", args)
         nodeid, bname, datatype = args
         new_node = parent.add_variable_type(nodeid, bname, datatype.nodeid)
-        self._after_add(new_node)
+        self._after_add(new_node, "add_variable_type", parent, args)
         return new_node
 
+    def add_tags(self, path, idx):
+        """
+        create folders and variables of the CSV or XLSX tag list at path under current node,
+        with batched AddNodes calls. Tags which cannot be created are logged and skipped
+        """
+        parent = self._get_parent()
+        logger.info("Importing tags of %s", path)
+        importer = TagImporter(self.server_mgr, parent.nodeid, idx, int(self.settings.value("import_batch_size", 1000)))
+        nodeids = importer.run(read_tags(path))
+        for line, message in importer.errors:
+            logger.warning("Tag at line %s of %s not imported: %s", line, path, message)
+        logger.info("Created %s nodes from %s", len(nodeids), path)
+        new_nodes = [self.server_mgr.get_node(nodeid) for nodeid in nodeids]
+        self._after_add(new_nodes, "add_tags", parent, (path, idx))
+        return new_nodes
+
     @trycatchslot
     def _attr_written(self, attr, dv):
-        self.modified = True
+        # the tree current node moves with the keyboard while the attribute view keeps showing the written node
+        node = self.modeler.attrs_ui.current_node
+        self._journal_op("write_attribute", node, attr, dv)
+        shown_nodeid, shown_attrs = self._shown_attrs
+        if shown_nodeid == node.nodeid and attr in shown_attrs:
+            self._push_command(WriteAttributeCommand(f"Write {attr.name}", node.nodeid, attr, shown_attrs[attr], dv))
+            shown_attrs[attr] = dv
+        else:
+            logger.info("Previous value of %s of %s unknown, write cannot be undone", attr.name, node)
+        self._update_written_node(node, attr, dv)
+        if attr in (ua.AttributeIds.BrowseName, ua.AttributeIds.DisplayName):
+            self._update_tree_items([node.nodeid], attr, dv.Value.Value)
+
+    def _update_written_node(self, node, attr, dv):
+        self.changes.mark([node], Change.ATTRIBUTES)
+        self._update_search_index(node.nodeid, attr, dv)
+        self._update_simulation(node.nodeid, attr, dv)
+
+    def _update_simulation(self, nodeid, attr, dv):
+        if attr == ua.AttributeIds.Value and self.simulation is not None:
+            self.simulation.edited(nodeid, dv)
+
+    def _update_search_index(self, nodeid, attr, dv):
         if attr == ua.AttributeIds.BrowseName:
-            self.modeler.tree_ui.update_browse_name_current_item(dv.Value.Value)
+            self.search_index.update(nodeid, browse_name=dv.Value.Value.Name)
         elif attr == ua.AttributeIds.DisplayName:
-            self.modeler.tree_ui.update_display_name_current_item(dv.Value.Value)
+            self.search_index.update(nodeid, display_name=dv.Value.Value.Text or "")
+        elif attr == ua.AttributeIds.Description:
+            self.search_index.update(nodeid, description=dv.Value.Value.Text or "")
+
+    @trycatchslot
+    def _reference_changed(self, node):
+        if self._journal is not None:
+            refs = self.server_mgr.browse([node.nodeid], ua.ObjectIds.References, ua.BrowseDirection.Both)[0]
+            self._journal_op("set_references", node, refs)
+        self.changes.mark([node], Change.REFERENCES)
+
+    def _set_references(self, node, refs):
+        """
+        add and remove references of node so it has exactly refs
+        """
+        current = self.server_mgr.browse([node.nodeid], ua.ObjectIds.References, ua.BrowseDirection.Both)[0]
+        wanted = {(ref.ReferenceTypeId, self._remap.get(ref.NodeId, ref.NodeId), ref.IsForward) for ref in refs}
+        existing = {(ref.ReferenceTypeId, ref.NodeId, ref.IsForward) for ref in current}
+        for reftype, target, forward in existing - wanted:
+            node.delete_reference(target, reftype, forward, bidirectional=False)
+        for reftype, target, forward in wanted - existing:
+            node.add_reference(target, reftype, forward, bidirectional=False)
+        self.changes.mark([node], Change.REFERENCES)
+
+    @trycatchslot
+    def _namespace_uri_edited(self, idx, uri):
+        try:
+            self.set_namespace_uri(idx, uri)
+        except Exception:
+            self.modeler.idx_ui.reload()  # drop the rejected edit
+            raise
+
+    @trycatchslot
+    def _namespace_removal_requested(self, uri):
+        self.remove_namespace(uri)
+
+    @trycatchslot
+    def _namespace_reorder_requested(self, uris):
+        self.change_namespaces(uris)
+
+    @trycatchslot
+    def _nodeset_added(self, path):
+        self._nodeset_paths[os.path.basename(path)] = path
+        self._journal_op("import_nodeset", path)
 
     def _create_type_dict_node(self, idx, urn, name):
         node_id = None
@@ -338,13 +1369,13 @@ class ModelManager(QObject):
         except ua.UaError:
             logger.warning("Dictionary node does not exist, creating it: %s", name)
         builder = DataTypeDictionaryBuilder(self.server_mgr.get_server(), idx, urn, name, dict_node_id=node_id)
-        if builder.dict_id not in self.new_nodes:
-            self.new_nodes.append(self.server_mgr.get_node(builder.dict_id))
+        self.new_nodes.add(builder.dict_id)
         return builder
 
     def _save_structs(self):
         """
-        Save struct and delete our design nodes. They will need to be recreated
+        Save struct and delete our design nodes. They will need to be recreated,
+        return a snapshot of the deleted nodes or None
         """
         struct_node = self.server_mgr.get_node(ua.ObjectIds.Structure)
         dict_name = "TypeDictionary"
@@ -353,14 +1384,16 @@ class ModelManager(QObject):
             urn = self.server_mgr.get_namespace_array()[1]
         except IndexError:
             logger.warning("No custom namespace defined, aborting saving structs")
-            return
+            return None
         to_delete = []
         have_structs = False
         to_add = []
-        for node in self.new_nodes:
+        nodeids = list(self.new_nodes)
+        parents = self.server_mgr.browse(nodeids, direction=ua.BrowseDirection.Inverse)
+        for nodeid, parent_refs in zip(nodeids, parents):
             # FIXME: we do not support inheritance
-            parent = node.get_parent()
-            if parent == struct_node:
+            if parent_refs and parent_refs[0].NodeId == struct_node.nodeid:
+                node = self.server_mgr.get_node(nodeid)
                 if not have_structs:
                     dict_builder = self._create_type_dict_node(idx, urn, dict_name)
                     dict_node = self.server_mgr.get_node(dict_builder.dict_id)
@@ -389,12 +1422,15 @@ class ModelManager(QObject):
                     struct.add_field(bname.Name, dtype_name.Name, is_array=array)
                     to_delete.append(child)
 
-                to_add.extend([self.server_mgr.get_node(nodeid) for nodeid in struct.node_ids])
+                to_add.extend(struct.node_ids)
 
         if have_structs:
             dict_builder.set_dict_byte_string()
-            self.new_nodes.extend(to_add)
+            self.new_nodes.update(to_add)
+            self.changes.mark(to_add + [dict_builder.dict_id], Change.ATTRIBUTES | Change.REFERENCES)
 
-        for node in to_delete:
-            self.delete_node(node, False)
+        if not to_delete:
+            return None
+        # only converted for serialization, not an edit to journal or undo
+        return self.remove_nodes([node.nodeid for node in to_delete])
 
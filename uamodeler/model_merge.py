@@ -0,0 +1,136 @@
+"""
+Three-way merge of models, working on the node digests of model_diff.
+The changes made in their model since the base model are applied to our model,
+the current one, unless we changed the same attribute or node differently;
+those are conflicts left to the user. Decisions are taken on digests only,
+the nodes to add and the attribute values to write are then read from their
+file in one pass
+"""
+
+import logging
+
+from uamodeler.streaming_importer import WRITABLE_ATTRIBUTES
+
+logger = logging.getLogger(__name__)
+
+# attributes which follow from references or are not node attributes
+_IMPLIED_ATTRIBUTES = ("ParentNodeId", "SymbolicName", "ReleaseStatus")
+
+
+class MergePlan(object):
+    """
+    changes to apply to our model, nodeids as written in indexes
+    """
+
+    def __init__(self):
+        self.add = []  # nodes to import from their model
+        self.delete = []  # nodes to delete from our model
+        self.write = {}  # nodeid -> names of attributes to take from their model
+        self.add_refs = []  # (source, reftype, target, is_forward)
+        self.delete_refs = []
+        self.conflicts = []
+        self.skipped = []  # (nodeid, attribute) changes which cannot be written to a node
+
+    def __bool__(self):
+        return bool(self.add or self.delete or self.write or self.add_refs or self.delete_refs)
+
+    def add_conflict(self, nodeid, kind, attribute=None, base=None, ours=None, theirs=None):
+        self.conflicts.append({"node": nodeid, "kind": kind, "attribute": attribute, "base": base, "ours": ours, "theirs": theirs})
+
+    def to_dict(self):
+        return {
+            "add": self.add,
+            "delete": self.delete,
+            "write": self.write,
+            "add_refs": [list(ref) for ref in self.add_refs],
+            "delete_refs": [list(ref) for ref in self.delete_refs],
+            "conflicts": self.conflicts,
+            "skipped": [list(item) for item in self.skipped],
+        }
+
+
+def _flatten(index):
+    return {nodeid: digest for nodes in index.values() for nodeid, digest in nodes.items()}
+
+
+def _same(a, b):
+    if a is None or b is None:
+        return a is b
+    return a.hash == b.hash
+
+
+def _merge_node(plan, nodeid, base, ours, theirs):
+    if base.nodeclass != theirs.nodeclass or base.nodeclass != ours.nodeclass:
+        plan.add_conflict(nodeid, "nodeclass", None, base.nodeclass, ours.nodeclass, theirs.nodeclass)
+        return
+    for name in sorted(set(base.attrs) | set(theirs.attrs)):
+        base_value = base.attrs.get(name)
+        our_value = ours.attrs.get(name)
+        their_value = theirs.attrs.get(name)
+        if their_value == base_value or their_value == our_value:
+            continue
+        if our_value != base_value:
+            plan.add_conflict(nodeid, "attribute", name, base_value, our_value, their_value)
+        elif name in WRITABLE_ATTRIBUTES:
+            plan.write.setdefault(nodeid, []).append(name)
+        elif name not in _IMPLIED_ATTRIBUTES:
+            plan.skipped.append((nodeid, name))
+    # references are sets, changes of both sides never conflict
+    plan.add_refs.extend((nodeid,) + ref for ref in sorted(theirs.refs - base.refs) if ref not in ours.refs)
+    plan.delete_refs.extend((nodeid,) + ref for ref in sorted(base.refs - theirs.refs) if ref in ours.refs)
+
+
+def three_way(base_index, our_index, their_index):
+    """
+    compare indexes of model_diff and return the MergePlan applying
+    to our model the changes of their model since base
+    """
+    base = _flatten(base_index)
+    ours = _flatten(our_index)
+    theirs = _flatten(their_index)
+    plan = MergePlan()
+    for nodeid in sorted(set(base) | set(theirs)):
+        base_node = base.get(nodeid)
+        our_node = ours.get(nodeid)
+        their_node = theirs.get(nodeid)
+        if _same(base_node, their_node) or _same(our_node, their_node):
+            continue
+        if base_node is None:
+            if our_node is None:
+                plan.add.append(nodeid)
+            else:
+                plan.add_conflict(nodeid, "added")  # added by both, differently
+        elif their_node is None:
+            if _same(our_node, base_node):
+                plan.delete.append(nodeid)
+            else:
+                plan.add_conflict(nodeid, "deleted")  # changed by us, deleted by them
+        elif our_node is None:
+            plan.add_conflict(nodeid, "changed")  # deleted by us, changed by them
+        else:
+            _merge_node(plan, nodeid, base_node, our_node, their_node)
+    logger.info("Merge plan: %s nodes to add, %s to delete, %s to update, %s conflicts",
+                len(plan.add), len(plan.delete), len(plan.write), len(plan.conflicts))
+    return plan
+
+
+def resolution_plan(conflicts):
+    """
+    return MergePlan taking their side of conflicts
+    """
+    plan = MergePlan()
+    for conflict in conflicts:
+        nodeid = conflict["node"]
+        kind = conflict["kind"]
+        if kind == "deleted":
+            plan.delete.append(nodeid)
+        elif kind == "changed":
+            plan.add.append(nodeid)
+        elif kind in ("added", "nodeclass"):
+            plan.delete.append(nodeid)  # replaced by their node
+            plan.add.append(nodeid)
+        elif conflict["attribute"] in WRITABLE_ATTRIBUTES:
+            plan.write.setdefault(nodeid, []).append(conflict["attribute"])
+        else:
+            plan.skipped.append((nodeid, conflict["attribute"]))
+    return plan
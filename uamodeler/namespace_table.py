@@ -0,0 +1,89 @@
+"""
+Cached namespace array of the modeled server.
+The array is read for almost every user action (nodeid of new nodes, browse names
+shown in the tree, exports...) and changed rarely. ServerManager keeps it in a
+NamespaceTable, updated by the server when the array is written, whoever writes it,
+so reading it needs no round trip. Each change increments the version of the table
+and is passed to the observers as a NamespaceChange, from which widgets update only
+the rows of the indexes which changed
+"""
+
+
+class NamespaceChange(object):
+    """
+    change of the namespace array from old to new uris
+    """
+
+    __slots__ = ("version", "old", "new")
+
+    def __init__(self, version, old, new):
+        self.version = version
+        self.old = old
+        self.new = new
+
+    def __repr__(self):
+        return f"NamespaceChange(version={self.version}, added={list(self.added)}, removed={list(self.removed)}, renamed={self.renamed})"
+
+    @property
+    def added(self):
+        return range(len(self.old), len(self.new))
+
+    @property
+    def removed(self):
+        return range(len(self.new), len(self.old))
+
+    @property
+    def renamed(self):
+        """
+        indexes present before and after the change whose uri changed
+        """
+        return [idx for idx, (old, new) in enumerate(zip(self.old, self.new)) if old != new]
+
+    def changed_indexes(self):
+        """
+        all indexes whose uri is not the same after the change
+        """
+        return set(self.renamed) | set(self.added) | set(self.removed)
+
+
+class NamespaceTable(object):
+    """
+    Versioned copy of the namespace array
+    """
+
+    def __init__(self):
+        self.uris = []
+        self.version = 0
+        self.observers = []  # called with a NamespaceChange
+
+    def __len__(self):
+        return len(self.uris)
+
+    def __getitem__(self, idx):
+        return self.uris[idx]
+
+    def __repr__(self):
+        return f"NamespaceTable(version={self.version}, {self.uris})"
+
+    def index(self, uri):
+        return self.uris.index(uri)
+
+    def update(self, uris):
+        """
+        set the namespace array, return the change or None if uris did not change
+        """
+        uris = list(uris)
+        if uris == self.uris:
+            return None
+        self.version += 1
+        change = NamespaceChange(self.version, self.uris, uris)
+        self.uris = uris
+        for observer in self.observers:
+            observer(change)
+        return change
+
+    def clear(self):
+        """
+        forget the array when the server stops, observers are not called
+        """
+        self.uris = []
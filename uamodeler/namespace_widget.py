@@ -15,6 +15,9 @@ logger = logging.getLogger(__name__)
 class NamespaceWidget(QObject):
 
     error = pyqtSignal(Exception)
+    uri_edited = pyqtSignal(int, str)  # namespace array is changed by model manager
+    removal_requested = pyqtSignal(str)  # removing a namespace deletes its nodes, done by model manager
+    reorder_requested = pyqtSignal(list)
 
     def __init__(self, view):
         QObject.__init__(self, view)
@@ -24,73 +27,113 @@ class NamespaceWidget(QObject):
         delegate = MyDelegate(self.view, self)
         delegate.error.connect(self.error.emit)
         self.view.setItemDelegate(delegate)
-        self.node = None
+        self.table = None  # NamespaceTable of server manager
+        self._version = 0  # version of table shown
         self.view.header().setSectionResizeMode(1)
 
         self.addNamespaceAction = QAction("Add Namespace", self.model)
         self.addNamespaceAction.triggered.connect(self.add_namespace)
         self.removeNamespaceAction = QAction("Remove Namespace", self.model)
         self.removeNamespaceAction.triggered.connect(self.remove_namespace)
+        self.moveUpAction = QAction("Move Up", self.model)
+        self.moveUpAction.triggered.connect(lambda: self.move_namespace(-1))
+        self.moveDownAction = QAction("Move Down", self.model)
+        self.moveDownAction.triggered.connect(lambda: self.move_namespace(1))
 
         self.view.setContextMenuPolicy(Qt.CustomContextMenu)
         self.view.customContextMenuRequested.connect(self.showContextMenu)
         self._contextMenu = QMenu()
         self._contextMenu.addAction(self.addNamespaceAction)
         self._contextMenu.addAction(self.removeNamespaceAction)
+        self._contextMenu.addAction(self.moveUpAction)
+        self._contextMenu.addAction(self.moveDownAction)
 
     @trycatchslot
     def add_namespace(self):
-        uries = self.node.read_value()
-        newidx = len(uries)
+        newidx = len(self.table)
         it = self.model.item(0, 0)
         uri_it = QStandardItem("")
         it.appendRow([QStandardItem(), QStandardItem(str(newidx)), uri_it])
         idx = self.model.indexFromItem(uri_it)
         self.view.edit(idx)
 
+    def _current_uri(self):
+        idx = self.view.currentIndex()
+        if not idx.isValid() or not idx.parent().isValid() or idx.row() < 1:
+            logger.warning("No valid item selected")
+            return None
+        return self.model.itemFromIndex(idx.sibling(idx.row(), 2)).text()
+
     @trycatchslot
     def remove_namespace(self):
-        idx = self.view.currentIndex()
-        if not idx.isValid() or idx == self.model.item(0, 0):
-            logger.warning("No valid item selected to remove")
-        idx = idx.sibling(idx.row(), 2)
-        item = self.model.itemFromIndex(idx)
-        uri = item.text()
-        uries = self.node.read_value()
-        uries.remove(uri)
-        logger.info("Writting namespace array: %s", uries)
-        self.node.write_value(uries)
-        self.reload()
-
-    def set_node(self, node):
+        uri = self._current_uri()
+        if uri is None:
+            return
+        self.removal_requested.emit(uri)
+
+    @trycatchslot
+    def move_namespace(self, offset):
+        uri = self._current_uri()
+        if uri is None:
+            return
+        uries = list(self.table.uris)
+        idx = uries.index(uri)
+        if not 1 <= idx + offset < len(uries):
+            return
+        uries[idx], uries[idx + offset] = uries[idx + offset], uries[idx]
+        self.reorder_requested.emit(uries)
+
+    def set_table(self, table):
         self.model.clear()
-        self.node = node
+        self.table = table
         self.show_array()
 
     def reload(self):
-        self.set_node(self.node)
+        self.set_table(self.table)
 
     def show_array(self):
         self.model.setHorizontalHeaderLabels(['Browse Name', 'Index', 'Value'])
 
-        name_item = QStandardItem(self.node.read_browse_name().Name)
-        self.model.appendRow([name_item, QStandardItem(""), QStandardItem()])
+        self.model.appendRow([QStandardItem("NamespaceArray"), QStandardItem(""), QStandardItem()])
         it = self.model.item(0, 0)
-        val = self.node.read_value()
-        for idx, url in enumerate(val):
+        for idx, url in enumerate(self.table.uris):
             it.appendRow([QStandardItem(), QStandardItem(str(idx)), QStandardItem(url)])
+        self._version = self.table.version
         self.view.expandAll()
 
+    def apply_change(self, change):
+        """
+        update the rows of the namespaces which changed
+        """
+        it = self.model.item(0, 0)
+        if it is None or change.version <= self._version:
+            return  # not shown or already shown by set_table
+        if change.version != self._version + 1:
+            self.reload()  # a change was missed, the table has the current array
+            return
+        self._version = change.version
+        for idx in change.renamed:
+            it.child(idx, 2).setText(change.new[idx])
+        if change.removed:
+            it.removeRows(change.removed.start, len(change.removed))
+        for idx in change.added:
+            if it.child(idx, 2) is None:
+                it.appendRow([QStandardItem(), QStandardItem(str(idx)), QStandardItem(change.new[idx])])
+            else:
+                it.child(idx, 2).setText(change.new[idx])  # row added by add_namespace
+
     def clear(self):
         self.model.clear()
 
     def showContextMenu(self, position):
-        self.removeNamespaceAction.setEnabled(False)
         idx = self.view.currentIndex()
         if not idx.isValid():
             return
-        if idx.parent().isValid() and idx.row() >= 1:
-            self.removeNamespaceAction.setEnabled(True)
+        row = idx.row() if idx.parent().isValid() else 0
+        count = self.model.item(0, 0).rowCount() if self.model.item(0, 0) else 0
+        self.removeNamespaceAction.setEnabled(row >= 1)
+        self.moveUpAction.setEnabled(row >= 2)
+        self.moveDownAction.setEnabled(1 <= row < count - 1)
         self._contextMenu.exec_(self.view.viewport().mapToGlobal(position))
 
 
@@ -120,16 +163,11 @@ class MyDelegate(QStyledItemDelegate):
         Here we call the default implementation and save our values
         """
         QStyledItemDelegate.setModelData(self, editor, model, idx)
-        root = model.item(0, 0)
-        uries = []
-        count = 0
-        while True:
-            child = root.child(count, 2)
-            count += 1
-            if not child:
-                break
-            uries.append(child.text())
-        logger.info("Writting namespace array: %s", uries)
-        self.widget.node.write_value(uries)
+        uri = model.itemFromIndex(idx).text()
+        if not uri and idx.row() >= len(self.widget.table):
+            model.item(0, 0).removeRow(idx.row())  # adding namespace was abandoned
+            return
+        logger.info("Setting uri of namespace %s: %s", idx.row(), uri)
+        self.widget.uri_edited.emit(idx.row(), uri)
 
 
@@ -0,0 +1,136 @@
+from enum import IntFlag
+
+from asyncua import ua
+
+
+def node_key(node):
+    """
+    return a compact hashable key for a Node, a NodeId or a key.
+    The key is the tuple (namespace index, identifier), the identifier python type
+    already distinguishes numeric, string, guid and bytestring nodeids
+    """
+    if isinstance(node, tuple):
+        return node
+    nodeid = getattr(node, "nodeid", node)
+    return (nodeid.NamespaceIndex, nodeid.Identifier)
+
+
+def key_to_nodeid(key):
+    return ua.NodeId(key[1], key[0])
+
+
+class NodeKeySet(object):
+    """
+    Ordered set of nodes stored as compact keys instead of live Node objects.
+    Accepts Node, NodeId or keys everywhere, iterating yields NodeIds,
+    Node objects must be created when needed with server_mgr.get_node
+    """
+
+    def __init__(self, nodes=()):
+        self._keys = dict.fromkeys(node_key(node) for node in nodes)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __bool__(self):
+        return bool(self._keys)
+
+    def __contains__(self, node):
+        if node is None:
+            return False
+        return node_key(node) in self._keys
+
+    def __iter__(self):
+        return (key_to_nodeid(key) for key in list(self._keys))
+
+    def __repr__(self):
+        return f"NodeKeySet({len(self._keys)} nodes)"
+
+    def keys(self):
+        return list(self._keys)
+
+    def add(self, node):
+        self._keys[node_key(node)] = None
+
+    def update(self, nodes):
+        for node in nodes:
+            self._keys[node_key(node)] = None
+
+    def discard(self, node):
+        self._keys.pop(node_key(node), None)
+
+    def difference_update(self, nodes):
+        for node in nodes:
+            self._keys.pop(node_key(node), None)
+
+    def clear(self):
+        self._keys.clear()
+
+    def renumber_namespaces(self, indexes):
+        """
+        change namespace indexes of nodes, indexes maps old indexes to new ones. Order is kept
+        """
+        self._keys = dict.fromkeys((indexes.get(idx, idx), identifier) for idx, identifier in self._keys)
+
+
+class Change(IntFlag):
+    CREATED = 1
+    DELETED = 2
+    ATTRIBUTES = 4
+    REFERENCES = 8
+
+
+class ChangeLog(object):
+    """
+    Per node log of what changed since last save.
+    structural is set when something not tracked per node changed
+    (namespaces, imported nodesets...) and a full export is required
+    """
+
+    def __init__(self):
+        self._changes = {}
+        self.structural = False
+        self.observers = []  # called with (nodes, change), nodes is None for structural changes
+
+    def __len__(self):
+        return len(self._changes)
+
+    def __bool__(self):
+        return self.structural or bool(self._changes)
+
+    def __contains__(self, node):
+        return node_key(node) in self._changes
+
+    def mark(self, nodes, change):
+        nodes = list(nodes)
+        for observer in self.observers:
+            observer(nodes, change)
+        for node in nodes:
+            key = node_key(node)
+            previous = self._changes.get(key, 0)
+            if change & Change.DELETED:
+                if previous & Change.CREATED:
+                    # created and deleted since last save, nothing to save
+                    del self._changes[key]
+                else:
+                    self._changes[key] = Change.DELETED
+            elif previous & Change.DELETED:
+                # recreated, saved node must be replaced
+                self._changes[key] = Change.ATTRIBUTES | Change.REFERENCES
+            else:
+                self._changes[key] = previous | change
+
+    def mark_structural(self):
+        self.structural = True
+        for observer in self.observers:
+            observer(None, None)
+
+    def get(self, node):
+        return self._changes.get(node_key(node), 0)
+
+    def nodeids(self, change):
+        return [key_to_nodeid(key) for key, val in self._changes.items() if val & change]
+
+    def clear(self):
+        self._changes.clear()
+        self.structural = False
@@ -0,0 +1,198 @@
+"""
+Local registry of reference nodesets.
+Directories are scanned for NodeSet2 files and the models each file defines,
+with their version, publication date and required models, are kept in an
+index cached on disk. Files are only read again when their mtime or size
+changed, so resolving the dependencies of a model does not read nodeset headers
+"""
+
+import os
+import json
+import logging
+import xml.etree.ElementTree as Et
+
+from uamodeler.compression import is_xml, open_decompressed
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def _local_tag(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _model_ref(el):
+    return {
+        "uri": el.attrib.get("ModelUri"),
+        "version": el.attrib.get("Version"),
+        "publication_date": el.attrib.get("PublicationDate"),
+    }
+
+
+def read_nodeset_header(path):
+    """
+    return models defined in NodeSet2 file, parsing it only until its first node
+    """
+    models = []
+    depth = 0
+    with open_decompressed(path) as f:
+        for event, el in Et.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 2 and _local_tag(el.tag).startswith("UA"):
+                    break  # Models element comes before nodes
+                continue
+            depth -= 1
+            if depth == 1 and _local_tag(el.tag) == "Models":
+                for model_el in el:
+                    model = _model_ref(model_el)
+                    model["required"] = [_model_ref(req_el) for req_el in model_el if _local_tag(req_el.tag) == "RequiredModel"]
+                    models.append(model)
+                break
+    return models
+
+
+def _requirements(models):
+    """
+    models required by a file, except the ones it defines itself
+    """
+    provided = {model["uri"] for model in models}
+    return [req for model in models for req in model["required"] if req["uri"] not in provided]
+
+
+class NodesetRegistry(object):
+
+    def __init__(self, directories, index_path=None):
+        self.directories = list(directories)
+        self.index_path = index_path
+        self._files = {}  # path -> {"mtime", "size", "models"}
+        self._providers = {}  # model uri -> [(publication date, path)]
+        self._scanned = False
+        self._load_index()
+
+    def _load_index(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError) as ex:
+            logger.warning("Ignoring broken nodeset index %s: %s", self.index_path, ex)
+            return
+        if index.get("version") == INDEX_VERSION:
+            self._files = index["files"]
+
+    def _save_index(self):
+        if not self.index_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "files": self._files}, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
+        except OSError as ex:
+            logger.warning("Could not write nodeset index %s: %s", self.index_path, ex)
+
+    def add_directory(self, directory):
+        if directory not in self.directories:
+            self.directories.append(directory)
+            self._scanned = False
+
+    def _walk(self):
+        for directory in self.directories:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    if is_xml(filename):
+                        yield os.path.abspath(os.path.join(dirpath, filename))
+
+    def scan(self):
+        """
+        update index with new and modified files of directories
+        return number of files read
+        """
+        files = {}
+        count = 0
+        for path in self._walk():
+            stat = os.stat(path)
+            entry = self._files.get(path)
+            if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                try:
+                    models = read_nodeset_header(path)
+                except (OSError, Et.ParseError) as ex:
+                    logger.warning("Could not read nodeset %s: %s", path, ex)
+                    models = []
+                entry = {"mtime": stat.st_mtime, "size": stat.st_size, "models": models}
+                count += 1
+            files[path] = entry
+        changed = count or len(files) != len(self._files)
+        self._files = files
+        self._providers = {}
+        for path, entry in files.items():
+            for model in entry["models"]:
+                self._providers.setdefault(model["uri"], []).append((model["publication_date"] or "", path))
+        self._scanned = True
+        if changed:
+            self._save_index()
+        logger.info("Nodeset registry: %s files, %s read", len(files), count)
+        return count
+
+    def _ensure_scanned(self):
+        if not self._scanned:
+            self.scan()
+
+    def required_models(self, path):
+        """
+        models required by nodeset at path, from index if file is in registry
+        """
+        self._ensure_scanned()
+        entry = self._files.get(os.path.abspath(path))
+        return _requirements(entry["models"] if entry is not None else read_nodeset_header(path))
+
+    def find(self, uri, publication_date=None):
+        """
+        return path of most recent nodeset defining model uri, None if not found
+        """
+        self._ensure_scanned()
+        candidates = self._providers.get(uri)
+        if not candidates:
+            return None
+        date, path = max(candidates)
+        if publication_date and date < publication_date:
+            logger.warning("Model %s required with publication date %s, only %s found in %s", uri, publication_date, date, path)
+        return path
+
+    def dependencies(self, required, loaded_uris=()):
+        """
+        return paths of nodesets to import, dependencies first, so that
+        required models and all the models they require are loaded.
+        models in loaded_uris are not looked for
+        """
+        self._ensure_scanned()
+        done = set(loaded_uris)
+        visiting = set()
+        order = []
+
+        def visit(req):
+            uri = req["uri"]
+            if uri in done:
+                return
+            if uri in visiting:
+                logger.warning("Circular dependency of nodeset %s", uri)
+                return
+            path = self.find(uri, req.get("publication_date"))
+            if path is None:
+                logger.warning("No nodeset defining required model %s found in registry", uri)
+                done.add(uri)
+                return
+            visiting.add(uri)
+            models = self._files[path]["models"]
+            for dep in _requirements(models):
+                visit(dep)
+            visiting.discard(uri)
+            done.update(model["uri"] for model in models)
+            order.append(path)
+
+        for req in required:
+            visit(req)
+        return order
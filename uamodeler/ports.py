@@ -0,0 +1,14 @@
+"""
+Free local tcp ports for the endpoints of servers started by the harnesses
+"""
+
+import socket
+
+
+def free_port():
+    """
+    port of 127.0.0.1 not in use, picked by the system
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
@@ -1,12 +1,14 @@
 import os
 
-from PyQt5.QtCore import pyqtSignal, Qt, QObject
+from PyQt5.QtCore import pyqtSignal, Qt, QObject, QSettings, QStandardPaths
 from PyQt5.QtGui import QStandardItemModel, QStandardItem
 from PyQt5.QtWidgets import QMenu, QAction, QFileDialog
 
 
 from uawidgets.utils import trycatchslot
 
+from uamodeler.nodeset_registry import NodesetRegistry
+
 
 class RefNodeSetsWidget(QObject):
 
@@ -22,21 +24,30 @@ class RefNodeSetsWidget(QObject):
         self.nodesets = []
         self.server_mgr = None
         self.view.header().setSectionResizeMode(1)
+        self.settings = QSettings()
+        directories = self.settings.value("nodeset_dirs", [])
+        if isinstance(directories, str):
+            directories = [directories]
+        index_path = os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "nodeset_index.json")
+        self.registry = NodesetRegistry(directories, index_path)
 
         addNodeSetAction = QAction("Add Reference Node Set", self.model)
         addNodeSetAction.triggered.connect(self.add_nodeset)
         self.removeNodeSetAction = QAction("Remove Reference Node Set", self.model)
         self.removeNodeSetAction.triggered.connect(self.remove_nodeset)
+        addDirectoryAction = QAction("Add Node Set Directory", self.model)
+        addDirectoryAction.triggered.connect(self.add_registry_directory)
 
         self.view.setContextMenuPolicy(Qt.CustomContextMenu)
         self.view.customContextMenuRequested.connect(self.showContextMenu)
         self._contextMenu = QMenu()
         self._contextMenu.addAction(addNodeSetAction)
         self._contextMenu.addAction(self.removeNodeSetAction)
+        self._contextMenu.addAction(addDirectoryAction)
 
     @trycatchslot
     def add_nodeset(self):
-        path, ok = QFileDialog.getOpenFileName(self.view, caption="Import OPC UA XML Node Set", filter="XML Files (*.xml *.XML)", directory=".")
+        path, ok = QFileDialog.getOpenFileName(self.view, caption="Import OPC UA XML Node Set", filter="XML Files (*.xml *.XML *.xml.gz *.xml.zst)", directory=".")
         if not ok:
             return None
         self.import_nodeset(path)
@@ -47,6 +58,7 @@ class RefNodeSetsWidget(QObject):
         if name in self.nodesets:
             return
         try:
+            self.import_dependencies(path)
             self.server_mgr.import_xml(path)
         except Exception as ex:
             self.error.emit(ex)
@@ -58,6 +70,22 @@ class RefNodeSetsWidget(QObject):
         self.view.expandAll()
         self.nodeset_added.emit(path)
 
+    def import_dependencies(self, path):
+        """
+        import nodesets found in registry defining the models required by nodeset at path
+        """
+        loaded = self.server_mgr.get_namespace_array()
+        for dep_path in self.registry.dependencies(self.registry.required_models(path), loaded):
+            self.import_nodeset(dep_path)
+
+    @trycatchslot
+    def add_registry_directory(self):
+        path = QFileDialog.getExistingDirectory(self.view, caption="Add Node Set Directory", directory=".")
+        if not path:
+            return
+        self.registry.add_directory(path)
+        self.settings.setValue("nodeset_dirs", self.registry.directories)
+
     @trycatchslot
     def remove_nodeset(self):
         idx = self.view.currentIndex()
@@ -0,0 +1,280 @@
+"""
+Import of the address space of a running OPC UA server.
+Subtrees are walked level by level: the nodes of a level are split in batches
+which several client sessions browse concurrently, following continuation
+points with BrowseNext, then the attributes of the found nodes are read the
+same way. Nodes of namespace 0 are walked but not imported, every server has
+them. Nodeids of the remote server are translated to local namespace indexes
+"""
+
+import asyncio
+import logging
+import dataclasses
+from collections import deque
+from functools import partial
+
+from asyncua import ua, Client
+
+from uamodeler.node_tracker import NodeKeySet
+from uamodeler.undo import NodeState, SNAPSHOT_ATTRIBUTES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOTS = (ua.NodeId(ua.ObjectIds.ObjectsFolder), ua.NodeId(ua.ObjectIds.TypesFolder))
+_FOLLOWED = (ua.NodeId(ua.ObjectIds.HasEncoding),)  # not hierarchical but needed to find encodings of data types
+_LIMIT_NODES = (
+    ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerBrowse,
+    ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead,
+    ua.ObjectIds.Server_ServerCapabilities_MaxBrowseContinuationPoints,
+)
+
+
+class RequestLimits(object):
+    """
+    limits of the requests sent to the remote server, lowered to the
+    operation limits the server announces
+    """
+
+    def __init__(self, sessions=4, nodes_per_browse=500, nodes_per_read=2000, references_per_node=1000, timeout=30):
+        self.sessions = sessions
+        self.nodes_per_browse = nodes_per_browse
+        self.nodes_per_read = nodes_per_read  # attributes read per Read request
+        self.references_per_node = references_per_node  # 0 lets the server decide
+        self.timeout = timeout
+
+    def restrict(self, max_browse, max_read, max_continuation_points):
+        if max_browse:
+            self.nodes_per_browse = min(self.nodes_per_browse, max_browse)
+        if max_read:
+            self.nodes_per_read = min(self.nodes_per_read, max_read)
+        if max_continuation_points and self.references_per_node:
+            # every node of a Browse may need a continuation point
+            self.nodes_per_browse = min(self.nodes_per_browse, max_continuation_points)
+
+
+def _local_nodeid(nodeid):
+    """
+    NodeId of an ExpandedNodeId, None if it is on another server
+    """
+    if getattr(nodeid, "ServerIndex", 0):
+        return None
+    return ua.NodeId(nodeid.Identifier, nodeid.NamespaceIndex, nodeid.NodeIdType)
+
+
+class RemoteWalker(object):
+    """
+    browse and read a remote server with concurrent sessions
+    """
+
+    def __init__(self, clients, limits):
+        self.clients = clients
+        self.limits = limits
+
+    async def _map(self, func, items, size):
+        """
+        run func(client, chunk) on chunks of items, each session takes the next
+        chunk when it is done with its previous one. Results are in order of items
+        """
+        chunks = deque(enumerate(items[i:i + size] for i in range(0, len(items), size)))
+        results = [None] * len(chunks)
+
+        async def work(client):
+            while chunks:
+                idx, chunk = chunks.popleft()
+                results[idx] = await func(client, chunk)
+
+        await asyncio.gather(*(work(client) for client in self.clients))
+        return [result for chunk_results in results for result in chunk_results]
+
+    async def _browse_chunk(self, reftype, direction, client, nodeids):
+        params = ua.BrowseParameters()
+        params.RequestedMaxReferencesPerNode = self.limits.references_per_node
+        for nodeid in nodeids:
+            desc = ua.BrowseDescription()
+            desc.NodeId = nodeid
+            desc.BrowseDirection = direction
+            desc.ReferenceTypeId = ua.NodeId(reftype)
+            desc.IncludeSubtypes = True
+            desc.NodeClassMask = 0
+            desc.ResultMask = ua.BrowseResultMask.All
+            params.NodesToBrowse.append(desc)
+        results = await client.uaclient.browse(params)
+        refs = []
+        pending = {}
+        for idx, (nodeid, res) in enumerate(zip(nodeids, results)):
+            if not res.StatusCode.is_good():
+                logger.warning("Could not browse %s: %s", nodeid, res.StatusCode)
+            refs.append(list(res.References))
+            if res.ContinuationPoint:
+                pending[idx] = res.ContinuationPoint
+        while pending:
+            params = ua.BrowseNextParameters()
+            params.ContinuationPoints = list(pending.values())
+            indexes = list(pending)
+            pending = {}
+            for idx, res in zip(indexes, await client.uaclient.browse_next(params)):
+                refs[idx].extend(res.References)
+                if res.ContinuationPoint:
+                    pending[idx] = res.ContinuationPoint
+        return refs
+
+    async def browse(self, nodeids, reftype=ua.ObjectIds.References, direction=ua.BrowseDirection.Both):
+        return await self._map(partial(self._browse_chunk, reftype, direction), nodeids, self.limits.nodes_per_browse)
+
+    async def _read_chunk(self, client, pairs):
+        params = ua.ReadParameters()
+        for nodeid, attr in pairs:
+            rv = ua.ReadValueId()
+            rv.NodeId = nodeid
+            rv.AttributeId = attr
+            params.NodesToRead.append(rv)
+        return await client.uaclient.read(params)
+
+    async def read(self, pairs):
+        return await self._map(self._read_chunk, pairs, self.limits.nodes_per_read)
+
+    async def read_limits(self):
+        dvs = await self.read([(ua.NodeId(nodeid), ua.AttributeIds.Value) for nodeid in _LIMIT_NODES])
+        values = [dv.Value.Value if dv.StatusCode.is_good() and dv.Value is not None else 0 for dv in dvs]
+        self.limits.restrict(*values)
+        logger.info("Browsing %s nodes and reading %s attributes per request", self.limits.nodes_per_browse, self.limits.nodes_per_read)
+
+    async def hierarchical_types(self):
+        """
+        keys of the hierarchical reference types of server, including its own ones
+        """
+        types = NodeKeySet([ua.NodeId(ua.ObjectIds.HierarchicalReferences)])
+        level = [ua.NodeId(ua.ObjectIds.HierarchicalReferences)]
+        while level:
+            next_level = []
+            for refs in await self.browse(level, ua.ObjectIds.HasSubtype, ua.BrowseDirection.Forward):
+                for ref in refs:
+                    if ref.NodeId not in types:
+                        types.add(ref.NodeId)
+                        next_level.append(_local_nodeid(ref.NodeId))
+            level = next_level
+        return types
+
+    async def walk(self, roots):
+        """
+        return NodeState of the nodes outside of namespace 0 below roots, parents first
+        """
+        followed = await self.hierarchical_types()
+        followed.update(_FOLLOWED)
+        visited = NodeKeySet(roots)
+        states = []
+        level = [(nodeid, None, None) for nodeid in roots]  # (nodeid, parent, reftype)
+        while level:
+            nodes_refs = await self.browse([nodeid for nodeid, _, _ in level])
+            next_level = []
+            for (nodeid, parent, reftype), refs in zip(level, nodes_refs):
+                if nodeid.NamespaceIndex != 0:
+                    state = NodeState(nodeid)
+                    state.parent = parent
+                    state.reftype = reftype
+                    states.append(state)
+                for ref in refs:
+                    target = _local_nodeid(ref.NodeId)
+                    if target is None:
+                        continue
+                    if nodeid.NamespaceIndex != 0:
+                        state.refs.append((ref.ReferenceTypeId, target, ref.IsForward))
+                    if ref.IsForward and ref.ReferenceTypeId in followed and target not in visited:
+                        visited.add(target)
+                        hierarchical = ref.ReferenceTypeId not in _FOLLOWED
+                        next_level.append((target, nodeid if hierarchical else None, ref.ReferenceTypeId if hierarchical else None))
+            level = next_level
+        return await self._read_states(states)
+
+    async def _read_states(self, states):
+        """
+        read attributes of states, return the states of nodes whose NodeClass and BrowseName could be read
+        """
+        attrs = [ua.AttributeIds.NodeClass, ua.AttributeIds.BrowseName] + SNAPSHOT_ATTRIBUTES
+        dvs = iter(await self.read([(state.nodeid, attr) for state in states for attr in attrs]))
+        read = []
+        for state in states:
+            for attr in attrs:
+                dv = next(dvs)
+                if dv.StatusCode.is_good() and dv.Value is not None:
+                    state.attrs[attr] = dv.Value
+            if ua.AttributeIds.NodeClass not in state.attrs or ua.AttributeIds.BrowseName not in state.attrs:
+                logger.warning("Could not read NodeClass or BrowseName of %s, skipping it", state.nodeid)
+                continue
+            read.append(state)
+            state.nodeclass = ua.NodeClass(state.attrs.pop(ua.AttributeIds.NodeClass).Value)
+            state.browse_name = state.attrs.pop(ua.AttributeIds.BrowseName).Value
+            for reftype, target, forward in state.refs:
+                if forward and reftype == ua.NodeId(ua.ObjectIds.HasTypeDefinition):
+                    state.typedef = target
+        return read
+
+
+async def read_address_space(url, roots=DEFAULT_ROOTS, limits=None):
+    """
+    return namespace array of server at url and NodeState of the nodes below roots, with remote nodeids
+    """
+    limits = limits or RequestLimits()
+    clients = [Client(url, timeout=limits.timeout) for _ in range(max(1, limits.sessions))]
+    connected = []
+    try:
+        for client in clients:
+            await client.connect()
+            connected.append(client)
+        walker = RemoteWalker(clients, limits)
+        await walker.read_limits()
+        namespaces = await clients[0].get_namespace_array()
+        states = await walker.walk(list(roots))
+    finally:
+        await asyncio.gather(*(client.disconnect() for client in connected), return_exceptions=True)
+    logger.info("Read %s nodes from %s", len(states), url)
+    return namespaces, states
+
+
+class NamespaceMap(object):
+    """
+    translate nodeids and values of a remote server to local namespace indexes.
+    Uris missing locally are appended to uris when first used
+    """
+
+    def __init__(self, remote_uris, local_uris):
+        self.remote_uris = remote_uris
+        self.uris = list(local_uris)
+        self._indexes = {0: 0}
+
+    def index(self, idx):
+        if idx not in self._indexes:
+            uri = self.remote_uris[idx]
+            if uri not in self.uris:
+                self.uris.append(uri)
+            self._indexes[idx] = self.uris.index(uri)
+        return self._indexes[idx]
+
+    def nodeid(self, nodeid):
+        if nodeid is None:
+            return None
+        return ua.NodeId(nodeid.Identifier, self.index(nodeid.NamespaceIndex), nodeid.NodeIdType)
+
+    def value(self, value):
+        if isinstance(value, ua.NodeId):
+            return self.nodeid(value)
+        if isinstance(value, ua.QualifiedName):
+            return ua.QualifiedName(value.Name, self.index(value.NamespaceIndex))
+        if isinstance(value, ua.Variant):
+            return ua.Variant(self.value(value.Value), value.VariantType, value.Dimensions, value.is_array)
+        if isinstance(value, list):
+            return [self.value(val) for val in value]
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            # structures such as DataTypeDefinition and ExtensionObject reference types by nodeid
+            return dataclasses.replace(value, **{f.name: self.value(getattr(value, f.name)) for f in dataclasses.fields(value) if f.init})
+        return value
+
+    def state(self, state):
+        state.nodeid = self.nodeid(state.nodeid)
+        state.browse_name = self.value(state.browse_name)
+        state.parent = self.nodeid(state.parent)
+        state.reftype = self.nodeid(state.reftype)
+        state.typedef = self.nodeid(state.typedef)
+        state.attrs = {attr: self.value(variant) for attr, variant in state.attrs.items()}
+        state.refs = [(self.nodeid(reftype), self.nodeid(target), forward) for reftype, target, forward in state.refs]
+        return state
@@ -0,0 +1,257 @@
+"""
+Round-trip harness: open a nodeset, save it and open it again with ModelManager,
+then compare the address space before and after. The model nodes are read
+into a canonical digest, one hash per attribute and one for the references,
+with nodeids written with namespace uris so that namespace indexes may change.
+Wall time and peak memory of each phase are recorded. Files are run in
+parallel, each one in a fresh worker process with its own server
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import dataclasses
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from asyncua import ua
+
+from uamodeler.ports import free_port
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError as ex:
+    logger.info("Could not import resource module, peak RSS will not be recorded: %s", ex)
+    resource = None
+
+_ATTRIBUTES = [attr for attr in ua.AttributeIds if attr != ua.AttributeIds.NodeId]
+_VALUE_TYPES = (("Double", "1.5"), ("Int32", "42"), ("String", "text"), ("Boolean", "true"))
+
+
+def _uri(idx, ns_array):
+    return ns_array[idx] if idx < len(ns_array) else str(idx)
+
+
+def _canonical(value, ns_array):
+    """
+    text of an attribute value independent of namespace indexes
+    """
+    if isinstance(value, ua.NodeId):
+        if value.NamespaceIndex:
+            return f"nsu={_uri(value.NamespaceIndex, ns_array)};{value.to_string().split(';', 1)[1]}"
+        return value.to_string()
+    if isinstance(value, ua.QualifiedName):
+        return f"{_uri(value.NamespaceIndex, ns_array)}:{value.Name}"
+    if isinstance(value, ua.Variant):
+        return f"{value.VariantType.name}({_canonical(value.Value, ns_array)})"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_canonical(val, ns_array) for val in value) + "]"
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        fields = (f"{field.name}={_canonical(getattr(value, field.name), ns_array)}" for field in dataclasses.fields(value))
+        return f"{type(value).__name__}(" + ", ".join(fields) + ")"
+    return repr(value)
+
+
+def _hash(text):
+    return hashlib.blake2b(text.encode(), digest_size=8).digest()
+
+
+def address_space_digest(server_mgr, nodeids):
+    """
+    return {canonical nodeid: {attribute name: hash}} of nodes, references
+    of a node are hashed together under "References"
+    """
+    nodeids = list(nodeids)
+    ns_array = server_mgr.get_namespace_array()
+    digest = {}
+    nodes_attrs = server_mgr.read_node_attributes(nodeids, _ATTRIBUTES)
+    nodes_refs = server_mgr.browse(nodeids, ua.ObjectIds.References, ua.BrowseDirection.Both)
+    for nodeid, attrs, refs in zip(nodeids, nodes_attrs, nodes_refs):
+        node = {attr.name: _hash(_canonical(dv.Value, ns_array)) for attr, dv in attrs.items()}
+        refs = sorted(f"{_canonical(ref.ReferenceTypeId, ns_array)} {ref.IsForward} {_canonical(ref.NodeId, ns_array)}" for ref in refs)
+        node["References"] = _hash("\n".join(refs))
+        digest[_canonical(nodeid, ns_array)] = node
+    return digest
+
+
+def compare_digests(before, after, ignore=()):
+    """
+    return missing nodes, added nodes and {node: changed attribute names}
+    """
+    missing = sorted(set(before) - set(after))
+    added = sorted(set(after) - set(before))
+    changed = {}
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key], after[key]
+        names = sorted(name for name in set(old) | set(new) if name not in ignore and old.get(name) != new.get(name))
+        if names:
+            changed[key] = names
+    return missing, added, changed
+
+
+class _Phases(object):
+    """
+    record wall time and peak memory of the phases of a round trip
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, name, func, *args):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            result = {"seconds": round(time.perf_counter() - start, 3)}
+            if self.trace_memory:
+                result["peak_traced_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+                tracemalloc.stop()
+            if resource is not None:
+                result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.results[name] = result
+
+
+def roundtrip(mgr, path, workdir, ignore=(), trace_memory=False):
+    """
+    open_xml, save_xml and open_xml again with ModelManager mgr, return a result dict
+    """
+    phases = _Phases(trace_memory)
+    result = {"path": path, "phases": phases.results}
+    # own directory per run, the same file may be in corpus more than once
+    saved = os.path.join(tempfile.mkdtemp(prefix="roundtrip-", dir=workdir), "model")
+    try:
+        mgr.close_model(force=True)
+        phases.run("open", mgr.open_xml, path)
+        before = address_space_digest(mgr.server_mgr, mgr.new_nodes)
+        phases.run("save", mgr.save_xml, saved)
+        mgr.close_model(force=True)
+        phases.run("reopen", mgr.open_xml, saved + ".xml")
+        after = address_space_digest(mgr.server_mgr, mgr.new_nodes)
+    except Exception as ex:
+        logger.exception("Round trip of %s failed", path)
+        result["error"] = f"{type(ex).__name__}: {ex}"
+        result["ok"] = False
+        return result
+    finally:
+        mgr.close_model(force=True)
+    missing, added, changed = compare_digests(before, after, ignore)
+    result.update({"nodes": len(before), "missing": missing, "added": added, "changed": changed})
+    result["ok"] = not (missing or added or changed)
+    return result
+
+
+def _run_file(path, workdir, ignore, trace_memory):
+    """
+    round trip of one file in a worker process, with its own modeler and server port
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from uamodeler.uamodeler import UaModeler
+    app = QApplication.instance() or QApplication([])
+    modeler = UaModeler()
+    mgr = modeler.model_mgr._model_mgr
+    mgr.endpoint = f"opc.tcp://127.0.0.1:{free_port()}/freeopcua/uamodeler/"
+    result = roundtrip(mgr, path, workdir, ignore, trace_memory)
+    app.quit()
+    return result
+
+
+def run_corpus(paths, workdir, workers=None, ignore=(), trace_memory=False):
+    """
+    round trip of files in parallel worker processes, one process per file
+    """
+    workers = min(len(paths), workers or os.cpu_count() or 1)
+    if workers < 2:
+        return [_run_file(path, workdir, ignore, trace_memory) for path in paths]
+    # spawn, forking a process running the server thread is not safe
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1) as pool:
+        futures = [pool.submit(_run_file, path, workdir, ignore, trace_memory) for path in paths]
+        return [future.result() for future in futures]
+
+
+def _value_xml(typename, array):
+    if array:
+        items = "".join(f"<uax:{typename}>{value}</uax:{typename}>" for value in [dict(_VALUE_TYPES)[typename]] * 3)
+        return f"<Value><uax:ListOf{typename}>{items}</uax:ListOf{typename}></Value>"
+    return f"<Value><uax:{typename}>{dict(_VALUE_TYPES)[typename]}</uax:{typename}></Value>"
+
+
+def generate_nodeset(path, nodes=10000, structs=0, folder_size=100, uri="urn:uamodeler:roundtrip"):
+    """
+    write a NodeSet2 file with folders, scalar and array variables of several types and,
+    if structs > 0, structures designed as the modeler does, with fields as child variables
+    """
+    def write_node(f, tag, nodeid, name, parent, reftype, typedef, attrs="", content=""):
+        f.write(f'  <{tag} NodeId="ns=1;i={nodeid}" BrowseName="1:{name}" ParentNodeId="{parent}"{attrs}>\n'
+                f'    <DisplayName>{name}</DisplayName>\n    <References>\n'
+                f'      <Reference ReferenceType="{reftype}" IsForward="false">{parent}</Reference>\n')
+        if typedef:
+            f.write(f'      <Reference ReferenceType="HasTypeDefinition">{typedef}</Reference>\n')
+        f.write(f"    </References>\n    {content}\n  </{tag}>\n")
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<UANodeSet xmlns="http://opcfoundation.org/UA/2011/03/UANodeSet.xsd" '
+                'xmlns:uax="http://opcfoundation.org/UA/2008/02/Types.xsd">\n'
+                f"  <NamespaceUris>\n    <Uri>{uri}</Uri>\n  </NamespaceUris>\n  <Aliases>\n"
+                '    <Alias Alias="Organizes">i=35</Alias>\n    <Alias Alias="HasComponent">i=47</Alias>\n'
+                '    <Alias Alias="HasSubtype">i=45</Alias>\n    <Alias Alias="HasTypeDefinition">i=40</Alias>\n'
+                "  </Aliases>\n")
+        nodeid = 1000
+        for idx in range(structs):
+            nodeid += 1
+            struct_id = nodeid
+            write_node(f, "UADataType", struct_id, f"Struct{idx}", "i=22", "HasSubtype", None)
+            for field_idx, (typename, _) in enumerate(_VALUE_TYPES):
+                nodeid += 1
+                array = field_idx % 2 == 1
+                attrs = f' DataType="i={getattr(ua.ObjectIds, typename)}"' + (' ValueRank="1" ArrayDimensions="1"' if array else "")
+                write_node(f, "UAVariable", nodeid, f"field{field_idx}", f"ns=1;i={struct_id}", "HasComponent", "i=63", attrs)
+        folder = None
+        for idx in range(nodes):
+            nodeid += 1
+            if idx % folder_size == 0:
+                folder = nodeid
+                write_node(f, "UAObject", folder, f"Folder{idx // folder_size}", "i=85", "Organizes", "i=61")
+                continue
+            typename = _VALUE_TYPES[idx % len(_VALUE_TYPES)][0]
+            array = idx % 3 == 0
+            attrs = f' DataType="i={getattr(ua.ObjectIds, typename)}"' + (' ValueRank="1" ArrayDimensions="3"' if array else "")
+            write_node(f, "UAVariable", nodeid, f"Var{idx}", f"ns=1;i={folder}", "HasComponent", "i=63", attrs, _value_xml(typename, array))
+        f.write("</UANodeSet>\n")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Round trip nodesets through open, save and open and compare the address spaces")
+    parser.add_argument("paths", nargs="*", help="NodeSet2 files, may be compressed")
+    parser.add_argument("--generate", type=int, action="append", default=[], metavar="NODES", help="add a generated nodeset of NODES nodes to corpus")
+    parser.add_argument("--structs", type=int, default=0, help="number of structures in generated nodesets")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--ignore", action="append", default=[], metavar="ATTRIBUTE", help="attribute not compared, e.g. Value")
+    parser.add_argument("--trace-memory", action="store_true", help="record peak python memory of each phase, slows down phases")
+    parser.add_argument("--workdir", default=None, help="directory of saved and generated files")
+    args = parser.parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="uamodeler-roundtrip-")
+    paths = [os.path.abspath(path) for path in args.paths]
+    for idx, count in enumerate(args.generate):
+        paths.append(generate_nodeset(os.path.join(workdir, f"generated{idx}_{count}.xml"), count, args.structs))
+    results = run_corpus(paths, workdir, args.workers, args.ignore, args.trace_memory)
+    json.dump(results, sys.stdout, indent=1)
+    sys.stdout.write("\n")
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
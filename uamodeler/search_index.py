@@ -0,0 +1,269 @@
+import re
+import time
+import logging
+from bisect import bisect_left
+from threading import Thread, RLock
+
+from asyncua import ua
+
+logger = logging.getLogger(__name__)
+
+_token_re = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return _token_re.findall(text.lower())
+
+
+class _Entry:
+    __slots__ = ("nodeid", "parent", "browse_name", "display_name", "description", "tokens")
+
+    def __init__(self, nodeid, parent):
+        self.nodeid = nodeid
+        self.parent = parent
+        self.browse_name = ""
+        self.display_name = ""
+        self.description = ""
+        self.tokens = ()
+
+
+class NodeSearchIndex(object):
+    """
+    In memory inverted index over BrowseName, DisplayName, NodeId and Description
+    Every node remembers the parent it was found under so a path from root
+    can be computed without browsing the server.
+    Each removal increments the generation of the index, background builders add
+    nodes with the generation they started at so nodes deleted since are not added back
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._entries = {}
+        self._postings = {}
+        self._sorted_tokens = []
+        self._tokens_dirty = False
+        self.generation = 0
+        self._removed = {}  # nodeid -> generation it was removed at
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, nodeid):
+        return nodeid in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+            self._sorted_tokens = []
+            self._tokens_dirty = False
+            self._removed.clear()
+
+    def add(self, nodeid, parent=None, browse_name="", display_name="", description="", since=None):
+        """
+        since is the generation at which the data was read, nodes removed after are skipped
+        """
+        with self._lock:
+            if since is None:
+                self._removed.pop(nodeid, None)
+            elif self._removed.get(nodeid, -1) > since:
+                return
+            entry = self._entries.get(nodeid)
+            if entry is None:
+                entry = _Entry(nodeid, parent)
+                self._entries[nodeid] = entry
+            elif parent is not None:
+                entry.parent = parent
+            self._set_texts(entry, browse_name, display_name, description)
+
+    def update(self, nodeid, browse_name=None, display_name=None, description=None):
+        with self._lock:
+            entry = self._entries.get(nodeid)
+            if entry is None:
+                return
+            self._set_texts(entry,
+                            entry.browse_name if browse_name is None else browse_name,
+                            entry.display_name if display_name is None else display_name,
+                            entry.description if description is None else description)
+
+    def remove(self, nodeid):
+        with self._lock:
+            self.generation += 1
+            self._removed[nodeid] = self.generation
+            entry = self._entries.pop(nodeid, None)
+            if entry is not None:
+                self._unindex(entry)
+
+    def _set_texts(self, entry, browse_name, display_name, description):
+        self._unindex(entry)
+        entry.browse_name = browse_name
+        entry.display_name = display_name
+        entry.description = description
+        tokens = set(tokenize(browse_name))
+        tokens.update(tokenize(display_name))
+        tokens.update(tokenize(description))
+        tokens.update(tokenize(str(entry.nodeid.Identifier)))
+        tokens.add(entry.nodeid.to_string().lower())
+        entry.tokens = tuple(tokens)
+        for token in entry.tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                self._postings[token] = {entry.nodeid}
+                self._tokens_dirty = True
+            else:
+                posting.add(entry.nodeid)
+
+    def _unindex(self, entry):
+        for token in entry.tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.discard(entry.nodeid)
+            if not posting:
+                del self._postings[token]
+                self._tokens_dirty = True
+        entry.tokens = ()
+
+    def _prefix_matches(self, term):
+        if self._tokens_dirty:
+            self._sorted_tokens = sorted(self._postings)
+            self._tokens_dirty = False
+        result = set()
+        tokens = self._sorted_tokens
+        i = bisect_left(tokens, term)
+        while i < len(tokens) and tokens[i].startswith(term):
+            posting = self._postings.get(tokens[i])
+            if posting:
+                result.update(posting)
+            i += 1
+        return result
+
+    def search(self, text, limit=100):
+        """
+        return entries whose words start with every word of text,
+        exact and shorter name matches first
+        """
+        terms = tokenize(text)
+        if not terms:
+            return []
+        with self._lock:
+            terms.sort(key=len, reverse=True)  # longest terms are the most selective
+            hits = None
+            for term in terms:
+                matches = self._prefix_matches(term)
+                hits = matches if hits is None else hits & matches
+                if not hits:
+                    return []
+            entries = [self._entries[nodeid] for nodeid in hits]
+        text = text.lower()
+
+        def rank(entry):
+            name = entry.browse_name.lower()
+            return (name != text, not name.startswith(text), len(name), name)
+
+        entries.sort(key=rank)
+        return entries[:limit]
+
+    def path(self, nodeid):
+        """
+        return list of nodeids from root to nodeid
+        """
+        with self._lock:
+            path = []
+            seen = set()
+            while nodeid is not None and nodeid not in seen:
+                seen.add(nodeid)
+                path.insert(0, nodeid)
+                entry = self._entries.get(nodeid)
+                if entry is None:
+                    break
+                nodeid = entry.parent
+            return path
+
+
+def index_nodes(server_mgr, index, nodeids, since=None):
+    """
+    add or refresh given nodes in index using one batched Read per attribute
+    and one batched inverse Browse to find their parents
+    """
+    nodeids = list(nodeids)
+    if not nodeids:
+        return
+    bnames = server_mgr.read_attributes(nodeids, ua.AttributeIds.BrowseName)
+    dnames = server_mgr.read_attributes(nodeids, ua.AttributeIds.DisplayName)
+    descs = server_mgr.read_attributes(nodeids, ua.AttributeIds.Description)
+    parents = server_mgr.browse(nodeids, direction=ua.BrowseDirection.Inverse)
+    for nodeid, bname, dname, desc, refs in zip(nodeids, bnames, dnames, descs, parents):
+        if not bname.StatusCode.is_good():
+            continue  # node is gone
+        index.add(nodeid,
+                  refs[0].NodeId if refs else None,
+                  bname.Value.Value.Name,
+                  _text(dname),
+                  _text(desc),
+                  since)
+
+
+def _text(dv):
+    if dv.Value is None or dv.Value.Value is None:
+        return ""
+    return dv.Value.Value.Text or ""
+
+
+class IndexBuilder(Thread):
+    """
+    Walk the address space from root, level by level, with batched Browse and Read
+    calls and fill the index. Run in background after a model is opened.
+    If nodeids is given only these nodes are indexed, used after imports
+    """
+
+    def __init__(self, server_mgr, index, nodeids=None, callback=None):
+        Thread.__init__(self, daemon=True)
+        self.server_mgr = server_mgr
+        self.index = index
+        self.root = ua.NodeId(ua.ObjectIds.RootFolder)
+        self.nodeids = nodeids
+        self.callback = callback
+        self.generation = index.generation  # nodes removed after creation of builder are not indexed
+        self._stop_requested = False
+
+    def stop(self):
+        self._stop_requested = True
+
+    def run(self):
+        start = time.time()
+        try:
+            if self.nodeids is None:
+                self._build()
+            else:
+                index_nodes(self.server_mgr, self.index, self.nodeids, self.generation)
+        except Exception as ex:
+            if not self._stop_requested:
+                logger.warning("Building search index failed: %s", ex)
+            return
+        logger.info("Search index built with %s nodes in %.2fs", len(self.index), time.time() - start)
+        if self.callback is not None and not self._stop_requested:
+            self.callback()
+
+    def _build(self):
+        root_name = self.server_mgr.read_attributes([self.root], ua.AttributeIds.BrowseName)[0].Value.Value
+        self.index.add(self.root, None, root_name.Name, root_name.Name, since=self.generation)
+        seen = {self.root}
+        level = [self.root]
+        while level and not self._stop_requested:
+            next_level = []
+            for parent, refs in zip(level, self.server_mgr.browse(level)):
+                for ref in refs:
+                    if ref.NodeId in seen:
+                        continue
+                    seen.add(ref.NodeId)
+                    self.index.add(ref.NodeId, parent, ref.BrowseName.Name, ref.DisplayName.Text or "", since=self.generation)
+                    next_level.append(ref.NodeId)
+            descs = self.server_mgr.read_attributes(next_level, ua.AttributeIds.Description)
+            for nodeid, dv in zip(next_level, descs):
+                text = _text(dv)
+                if text:
+                    self.index.update(nodeid, description=text)
+            level = next_level
@@ -0,0 +1,60 @@
+import logging
+
+from PyQt5.QtCore import pyqtSignal, Qt, QObject
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+
+from uawidgets.utils import trycatchslot
+
+
+logger = logging.getLogger(__name__)
+
+
+class SearchWidget(QObject):
+    """
+    Show nodes of the search index matching the text of a line edit
+    and emit the path to the activated node
+    """
+
+    error = pyqtSignal(Exception)
+    path_activated = pyqtSignal(list)
+
+    def __init__(self, line_edit, view, max_results=200):
+        QObject.__init__(self, view)
+        self.line_edit = line_edit
+        self.view = view
+        self.max_results = max_results
+        self.index = None
+        self.model = QStandardItemModel()
+        self.view.setModel(self.model)
+        self.model.setHorizontalHeaderLabels(['DisplayName', 'BrowseName', 'NodeId'])
+        self.line_edit.setPlaceholderText("Search nodes")
+        self.line_edit.textChanged.connect(self.search)
+        self.view.activated.connect(self._activated)
+        self.view.clicked.connect(self._activated)
+
+    def set_index(self, index):
+        self.index = index
+
+    @trycatchslot
+    def search(self, text=None):
+        if text is None:
+            text = self.line_edit.text()
+        self.model.removeRows(0, self.model.rowCount())
+        if self.index is None:
+            return
+        for entry in self.index.search(text, self.max_results):
+            dname_item = QStandardItem(entry.display_name)
+            dname_item.setData(entry.nodeid, Qt.UserRole)
+            self.model.appendRow([dname_item, QStandardItem(entry.browse_name), QStandardItem(entry.nodeid.to_string())])
+
+    @trycatchslot
+    def _activated(self, idx):
+        item = self.model.item(idx.row(), 0)
+        if item is None:
+            return
+        nodeid = item.data(Qt.UserRole)
+        self.path_activated.emit(self.index.path(nodeid))
+
+    def clear(self):
+        self.line_edit.clear()
+        self.model.removeRows(0, self.model.rowCount())
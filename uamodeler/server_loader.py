@@ -0,0 +1,154 @@
+"""
+Python loaders of the address space of a model, for production servers.
+A loader is a standalone module which only needs asyncua: it embeds the nodes
+and references of the model as compressed OPC UA binary encoded AddNodesItem and
+AddReferencesItem, with the code of loader_runtime to add them with batched
+AddNodes and AddReferences calls. Starting a server from it skips XML parsing
+and the resolution of references, node by node, done by import_xml.
+Startup time of both ways can be measured in a fresh process
+"""
+
+import time
+import zlib
+import base64
+import asyncio
+import inspect
+import logging
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from asyncua import ua, Server
+from asyncua.ua import ua_binary
+
+from uamodeler import loader_runtime
+from uamodeler.node_tracker import node_key
+
+logger = logging.getLogger(__name__)
+
+LOADER_EXTENSION = ".py"
+_LINE_LENGTH = 100
+
+_HEADER = '''"""
+Address space loader generated by opcua-modeler, do not edit.
+Nodes of namespaces {namespaces}
+
+Usage, after nodesets the model depends on are imported:
+
+    server = Server()
+    await server.init()
+    await load(server)
+"""
+
+'''
+
+_FOOTER = '''
+
+NAMESPACES = {namespaces!r}
+NODE_COUNT = {node_count}
+REFERENCE_COUNT = {reference_count}
+DATA = (
+{data}
+)
+
+
+async def load(server, batch_size=1000):
+    """
+    add the nodes of the model to server, return their nodeids
+    """
+    return await load_address_space(server, NAMESPACES, DATA, NODE_COUNT, REFERENCE_COUNT, batch_size)
+'''
+
+
+def _ref_key(source, reftype, target, forward):
+    return node_key(source), node_key(reftype), node_key(target), forward
+
+
+def implicit_references(nodes):
+    """
+    keys of the references the server creates itself when adding nodes: to and from
+    the parent and to the type definition. Inverse references of type definitions are
+    included, AddNodes does not create them and type nodes do not need them
+    """
+    keys = set()
+    has_typedef = ua.NodeId(ua.ObjectIds.HasTypeDefinition)
+    for item in nodes:
+        if not item.ParentNodeId.is_null():
+            keys.add(_ref_key(item.ParentNodeId, item.ReferenceTypeId, item.RequestedNewNodeId, True))
+            keys.add(_ref_key(item.RequestedNewNodeId, item.ReferenceTypeId, item.ParentNodeId, False))
+        if not item.TypeDefinition.is_null():
+            keys.add(_ref_key(item.RequestedNewNodeId, has_typedef, item.TypeDefinition, True))
+            keys.add(_ref_key(item.TypeDefinition, has_typedef, item.RequestedNewNodeId, False))
+    return keys
+
+
+def write_loader(path, namespaces, nodes, references):
+    """
+    write a loader module of nodes and references, lists of AddNodesItem and AddReferencesItem.
+    namespaces is the namespace array the nodeids of items refer to
+    """
+    # resolved once here instead of at each startup, the server scans the references
+    # of a node for duplicates when adding one
+    implicit = implicit_references(nodes)
+    references = [ref for ref in references if _ref_key(ref.SourceNodeId, ref.ReferenceTypeId, ref.TargetNodeId, ref.IsForward) not in implicit]
+    data = b"".join(ua_binary.struct_to_binary(item) for item in nodes + references)
+    encoded = base64.b85encode(zlib.compress(data, 9)).decode("ascii")
+    lines = "\n".join(f'    "{encoded[i:i + _LINE_LENGTH]}"' for i in range(0, len(encoded), _LINE_LENGTH))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_HEADER.format(namespaces=", ".join(namespaces[1:])))
+        f.write(inspect.getsource(loader_runtime).split('"""', 2)[2].lstrip("\n"))
+        f.write(_FOOTER.format(namespaces=list(namespaces), node_count=len(nodes), reference_count=len(references), data=lines))
+    logger.info("Wrote loader of %s nodes and %s references to %s, %s bytes of model data", len(nodes), len(references), path, len(encoded))
+
+
+def import_loader(path):
+    """
+    import a generated loader module from path
+    """
+    spec = importlib.util.spec_from_file_location("uamodeler_generated_loader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def _new_server(nodesets):
+    server = Server()
+    await server.init()
+    for path in nodesets:
+        await server.import_xml(path)
+    return server
+
+
+async def _startup_times(loader_path, xml_path, nodesets):
+    server = await _new_server(nodesets)
+    start = time.perf_counter()
+    xml_nodes = await server.import_xml(xml_path)
+    xml_seconds = time.perf_counter() - start
+    server = await _new_server(nodesets)
+    start = time.perf_counter()
+    loader_nodes = await import_loader(loader_path).load(server)
+    loader_seconds = time.perf_counter() - start
+    return {
+        "xml_seconds": round(xml_seconds, 4),
+        "xml_nodes": len(xml_nodes),
+        "loader_seconds": round(loader_seconds, 4),
+        "loader_nodes": len(loader_nodes),
+        "speedup": round(xml_seconds / loader_seconds, 2) if loader_seconds else None,
+    }
+
+
+def _measure(loader_path, xml_path, nodesets):
+    logging.basicConfig(level=logging.WARNING)
+    return asyncio.run(_startup_times(loader_path, xml_path, nodesets))
+
+
+def measure_startup(loader_path, xml_path, nodesets=()):
+    """
+    time loading the model with the loader and with import_xml of the same model
+    in fresh asyncua servers where nodesets have been imported first
+    """
+    # in a spawned process, the modeler's own server and caches must not interfere
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        times = pool.submit(_measure, loader_path, xml_path, list(nodesets)).result()
+    logger.info("Startup from XML: %ss, from loader: %ss", times["xml_seconds"], times["loader_seconds"])
+    return times
@@ -1,11 +1,23 @@
+import io
+import os
 import time
 import logging
+import xml.etree.ElementTree as Et
 from threading import Thread
 
-from PyQt5.QtCore import QSettings
+from PyQt5.QtCore import QSettings, QStandardPaths
 
 from asyncua import ua
 from asyncua.sync import Server, Client, XmlExporter
+from asyncua.common.xmlexporter import indent
+
+from uamodeler.streaming_importer import StreamingXmlImporter, is_supported as streaming_supported
+from uamodeler.compression import is_compressed, open_decompressed, write_compressed
+from uamodeler.type_cache import TypeDefinitionCache, load_type_definitions
+from uamodeler.remote_import import DEFAULT_ROOTS, NamespaceMap, read_address_space
+from uamodeler.undo import NodeSnapshot, descendants, take_snapshot, restore_snapshot
+from uamodeler.node_tracker import NodeKeySet, node_key
+from uamodeler.namespace_table import NamespaceTable
 
 logger = logging.getLogger(__name__)
 
@@ -17,11 +29,25 @@ except ImportError as ex:
     OPEN62541 = False
 
 
+def _chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class ServerManager(object):
+
+    batch_size = 1000  # max number of operations sent in one service request
+
     def __init__(self, action):
         self._backend = ServerPython()
         self._action = action
+        self.namespaces = NamespaceTable()  # cached namespace array, observers get each change
+        self._watched = False  # namespaces is updated by the server itself
         self._settings = QSettings()
+        default_cache_dir = os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "type_definitions")
+        cache_dir = self._settings.value("type_cache_dir", default_cache_dir)
+        self.type_cache = TypeDefinitionCache(cache_dir) if cache_dir else None
 
         if OPEN62541:
             use_open62541 = int(self._settings.value("use_open62541_server", 0))
@@ -53,35 +79,285 @@ class ServerManager(object):
         return self._backend.get_node(node)
 
     def get_namespace_array(self):
-        return self._backend.get_namespace_array()
+        """
+        namespace array of the server, read from the cache when the server keeps it up to date
+        """
+        if self._watched:
+            return list(self.namespaces.uris)
+        uris = self._backend.get_namespace_array()
+        self.namespaces.update(uris)
+        return uris
+
+    def write_namespace_array(self, uris):
+        self._backend.nodes.namespace_array.write_value(uris)
+        if not self._watched:
+            self.namespaces.update(uris)
 
     def add_default_namespace(self):
-        uris = self._backend.nodes.namespace_array.read_value()
-        uris.append("http//freeopcua/defaults/modeler")
-        self._backend.nodes.namespace_array.write_value(uris)
+        self.write_namespace_array(self.get_namespace_array() + ["http//freeopcua/defaults/modeler"])
 
     def start_server(self, endpoint):
         self._action.setEnabled(False)
         self._backend.start_server(endpoint)
+        self._watched = self._backend.run(self._backend.watch_namespace_array(self.namespaces.update))
+        self.namespaces.update(self._backend.get_namespace_array())
 
     def stop_server(self):
+        self._watched = False
+        self.namespaces.clear()
         self._backend.stop_server()
         self._action.setEnabled(True)
         if OPEN62541:
             self._settings.setValue("use_open62541_server", int(self._action.isChecked()))
 
-    def import_xml(self, path):
+    def import_xml(self, path, streaming=False, batch_size=None):
+        """
+        import nodes of xml file. A streaming import parses the file
+        incrementally and creates nodes in batches, for very large files.
+        Compressed files are always streamed while being decompressed
+        """
+        if (streaming or is_compressed(path)) and not streaming_supported():
+            logger.warning("Streaming import not supported by this asyncua version, importing %s at once", path)
+            with open_decompressed(path) as f:
+                return self._backend.import_xml(xmlstring=f.read())
+        if streaming or is_compressed(path):
+            importer = StreamingXmlImporter(self._backend.get_server().aio_obj, batch_size or self.batch_size)
+            with open_decompressed(path) as f:
+                return self._backend.run(importer.import_xml(f))
         return self._backend.import_xml(path)
 
+    def import_etree(self, root):
+        """
+        import nodes of a NodeSet2 etree in batches, return added nodeids
+        """
+        if not streaming_supported():
+            return self._backend.import_xml(xmlstring=Et.tostring(root))
+        importer = StreamingXmlImporter(self._backend.get_server().aio_obj, self.batch_size)
+        return self._backend.run(importer.import_xml(io.BytesIO(Et.tostring(root))))
+
+    def read_xml_attributes(self, path, wanted):
+        """
+        read attributes of nodes of xml file as Variants, without importing them.
+        wanted is a {nodeid: attribute names} dict
+        """
+        if not streaming_supported():
+            raise RuntimeError("Reading nodes of xml files is not supported by this asyncua version")
+        importer = StreamingXmlImporter(self._backend.get_server().aio_obj, self.batch_size)
+        with open_decompressed(path) as f:
+            return self._backend.run(importer.read_attribute_values(f, wanted))
+
     def export_xml(self, nodes, path):
+        if is_compressed(path):
+            root = self._backend.export_etree(nodes)
+            indent(root)
+            tree = Et.ElementTree(root)
+            write_compressed(path, lambda f: tree.write(f, encoding="utf-8", xml_declaration=True))
+            return None
         return self._backend.export_xml(nodes, path)
 
+    def export_etree(self, nodes):
+        """
+        return root element of a NodeSet2 etree containing nodes, without writing it
+        """
+        return self._backend.export_etree(nodes)
+
     def load_type_definitions(self):
-        return self._backend.load_type_definitions()
+        """
+        generate classes of custom structures, using generated code cached on disk
+        """
+        return self._backend.run(load_type_definitions(self._backend.get_server().aio_obj, self.type_cache))
 
     def load_enums(self):
         return self._backend.load_enums()
 
+    def import_from_server(self, url, roots=DEFAULT_ROOTS, parent=None, limits=None):
+        """
+        copy the nodes below roots of the server at url, without the ones of namespace 0.
+        Missing namespaces of remote server are added, imported roots without a parent
+        go under parent, the Objects folder by default. Return nodeids of imported nodes
+        """
+        remote_uris, states = self._backend.run(read_address_space(url, roots, limits))
+        uris = self.get_namespace_array()
+        namespaces = NamespaceMap(remote_uris, uris)
+        snapshot = NodeSnapshot([namespaces.state(state) for state in states], [])
+        roots = NodeKeySet(namespaces.nodeid(root) for root in roots)
+        if len(namespaces.uris) > len(uris):
+            self.write_namespace_array(namespaces.uris)
+        parent = parent or ua.NodeId(ua.ObjectIds.ObjectsFolder)
+        for state in snapshot.states:
+            if state.parent is None and state.nodeid in roots:
+                state.parent = parent
+                state.reftype = ua.NodeId(ua.ObjectIds.Organizes)
+        restore_snapshot(self, snapshot)
+        return snapshot.nodeids()
+
+    def namespace_index(self):
+        """
+        nodeids of the address space grouped by namespace index, built in one pass
+        """
+        nodeids = self._backend.run(self._backend.address_space_nodeids())
+        if nodeids is None:
+            # only the nodes which can be browsed are visible through a client
+            nodeids = descendants(self, [ua.NodeId(ua.ObjectIds.RootFolder)])
+        index = {}
+        for nodeid in nodeids:
+            index.setdefault(nodeid.NamespaceIndex, []).append(nodeid)
+        return index
+
+    def renumber_namespaces(self, uris, nodeids):
+        """
+        write namespace array uris, where namespaces of nodeids have another index, and recreate
+        nodeids and their references with the new indexes. Return the new nodeids
+        """
+        old_uris = self.get_namespace_array()
+        snapshot = take_snapshot(self, nodeids)
+        # references only stored on other nodes, such as type definitions of instances, are not browsable from nodeids
+        removed = self.delete_namespace_nodes(nodeids)
+        namespaces = NamespaceMap(old_uris, uris)
+        external_refs = {(node_key(source), node_key(reftype), node_key(target), forward): (source, reftype, target, forward)
+                         for source, reftype, target, forward in snapshot.external_refs + (removed or [])}
+        external_refs = [(namespaces.nodeid(source), namespaces.nodeid(reftype), namespaces.nodeid(target), forward)
+                         for source, reftype, target, forward in external_refs.values()]
+        snapshot = NodeSnapshot([namespaces.state(state) for state in snapshot.states], external_refs)
+        if len(namespaces.uris) > len(uris):
+            logger.warning("Nodes still use removed namespaces %s, they are kept", namespaces.uris[len(uris):])
+        self.write_namespace_array(namespaces.uris)
+        restore_snapshot(self, snapshot)
+        return snapshot.nodeids()
+
+    def read_attributes(self, nodeids, attr=ua.AttributeIds.Value):
+        """
+        read one attribute of many nodes using batched Read requests
+        """
+        return self._read([(nodeid, attr) for nodeid in nodeids])
+
+    def read_node_attributes(self, nodeids, attrs):
+        """
+        read many attributes of many nodes using batched Read requests
+        return a list of {attribute: DataValue} dicts, one per nodeid,
+        attributes which cannot be read are left out
+        """
+        results = self._read([(nodeid, attr) for nodeid in nodeids for attr in attrs])
+        nodes_attrs = []
+        for idx in range(len(nodeids)):
+            dvs = results[idx * len(attrs):(idx + 1) * len(attrs)]
+            nodes_attrs.append({attr: dv for attr, dv in zip(attrs, dvs) if dv.StatusCode.is_good()})
+        return nodes_attrs
+
+    def _read(self, pairs):
+        session = self._backend.get_session()
+        results = []
+        for chunk in _chunks(pairs, self.batch_size):
+            params = ua.ReadParameters()
+            for nodeid, attr in chunk:
+                rv = ua.ReadValueId()
+                rv.NodeId = nodeid
+                rv.AttributeId = attr
+                params.NodesToRead.append(rv)
+            results.extend(self._backend.run(session.read(params)))
+        return results
+
+    def write_attributes(self, items):
+        """
+        write (nodeid, attribute, DataValue) items using batched Write requests
+        """
+        results = []
+        for chunk in _chunks(items, self.batch_size):
+            params = ua.WriteParameters()
+            for nodeid, attr, dv in chunk:
+                wv = ua.WriteValue()
+                wv.NodeId = nodeid
+                wv.AttributeId = attr
+                wv.Value = dv
+                params.NodesToWrite.append(wv)
+            results.extend(self.write_parameters(params))
+        return results
+
+    def write_parameters(self, params):
+        """
+        send a prepared Write request, for nodes written again and again
+        """
+        return self._backend.run(self._backend.get_session().write(params))
+
+    def add_nodes(self, items):
+        """
+        add AddNodesItem in batched AddNodes requests, items are added in order
+        """
+        session = self._backend.get_session()
+        results = []
+        for chunk in _chunks(items, self.batch_size):
+            results.extend(self._backend.run(session.add_nodes(chunk)))
+        return results
+
+    def add_references(self, items):
+        session = self._backend.get_session()
+        results = []
+        for chunk in _chunks(items, self.batch_size):
+            results.extend(self._backend.run(session.add_references(chunk)))
+        return results
+
+    def delete_references(self, items):
+        session = self._backend.get_session()
+        results = []
+        for chunk in _chunks(items, self.batch_size):
+            results.extend(self._backend.run(session.delete_references(chunk)))
+        return results
+
+    def delete_nodes(self, nodeids, delete_references=True):
+        """
+        delete many nodes using batched DeleteNodes requests. Not recursive
+        """
+        session = self._backend.get_session()
+        results = []
+        for chunk in _chunks(nodeids, self.batch_size):
+            params = ua.DeleteNodesParameters()
+            for nodeid in chunk:
+                item = ua.DeleteNodesItem()
+                item.NodeId = nodeid
+                item.DeleteTargetReferences = delete_references
+                params.NodesToDelete.append(item)
+            results.extend(self._backend.run(session.delete_nodes(params)))
+        return results
+
+    def delete_namespace_nodes(self, nodeids):
+        """
+        delete the many nodes of namespaces being removed or renumbered. References to them are
+        removed in one pass over the address space when the backend can, instead of one pass per node.
+        Return removed references of other nodes, None if left to DeleteNodes
+        """
+        nodeids = list(nodeids)
+        removed = self._backend.run(self._backend.remove_references_to(nodeids)) if nodeids else []
+        self.delete_nodes(nodeids, delete_references=removed is None)
+        return removed
+
+    def browse(self, nodeids, reftype=ua.ObjectIds.HierarchicalReferences, direction=ua.BrowseDirection.Forward):
+        """
+        browse many nodes using batched Browse and BrowseNext requests
+        return a list of ReferenceDescription lists, one per nodeid
+        """
+        session = self._backend.get_session()
+        results = []
+        for chunk in _chunks(nodeids, self.batch_size):
+            params = ua.BrowseParameters()
+            for nodeid in chunk:
+                desc = ua.BrowseDescription()
+                desc.NodeId = nodeid
+                desc.BrowseDirection = direction
+                desc.ReferenceTypeId = ua.NodeId(reftype)
+                desc.IncludeSubtypes = True
+                desc.NodeClassMask = 0
+                desc.ResultMask = ua.BrowseResultMask.All
+                params.NodesToBrowse.append(desc)
+            for res in self._backend.run(session.browse(params)):
+                refs = list(res.References)
+                while res.ContinuationPoint:
+                    next_params = ua.BrowseNextParameters()
+                    next_params.ContinuationPoints = [res.ContinuationPoint]
+                    res = self._backend.run(session.browse_next(next_params))[0]
+                    refs.extend(res.References)
+                results.append(refs)
+        return results
+
 
 class ServerPython(object):
     def __init__(self):
@@ -93,6 +369,47 @@ class ServerPython(object):
     def get_server(self):
         return self._server
 
+    def get_session(self):
+        return self._server.aio_obj.iserver.isession
+
+    def run(self, coro):
+        return self._server.tloop.post(coro)
+
+    async def address_space_nodeids(self):
+        return list(self._server.aio_obj.iserver.aspace.keys())
+
+    async def remove_references_to(self, nodeids):
+        """
+        remove references to nodeids from all nodes in one pass over the address space,
+        DeleteNodes does one pass per deleted node. Return removed references of other nodes
+        """
+        aspace = self._server.aio_obj.iserver.aspace
+        keys = {node_key(nodeid) for nodeid in nodeids}
+        removed = []
+        for nodeid in list(aspace.keys()):
+            nodedata = aspace[nodeid]
+            kept = [ref for ref in nodedata.references if (ref.NodeId.NamespaceIndex, ref.NodeId.Identifier) not in keys]
+            if len(kept) == len(nodedata.references):
+                continue
+            if node_key(nodeid) not in keys:
+                removed.extend((nodeid, ref.ReferenceTypeId, ref.NodeId, ref.IsForward) for ref in nodedata.references
+                               if (ref.NodeId.NamespaceIndex, ref.NodeId.Identifier) in keys)
+            nodedata.references = kept
+        return removed
+
+    async def watch_namespace_array(self, callback):
+        """
+        call callback with the namespace array each time it is written, in the server loop.
+        Return True if the callback could be registered
+        """
+        async def datachange(handle, dv, *status):
+            if dv is not None:
+                callback(dv.Value.Value)
+
+        aspace = self._server.aio_obj.iserver.aspace
+        status, _ = aspace.add_datachange_callback(ua.NodeId(ua.ObjectIds.Server_NamespaceArray), ua.AttributeIds.Value, datachange)
+        return status.is_good()
+
     def start_server(self, endpoint):
         logger.info("Starting python-opcua server")
         self._server = Server()
@@ -101,7 +418,6 @@ class ServerPython(object):
         self.nodes = self._server.nodes
         self.get_node = self._server.get_node
         self.get_namespace_array = self._server.get_namespace_array
-        self.load_type_definitions = self._server.load_type_definitions
         self.load_enums = self._server.load_enums
         # now remove freeopcua namespace, not necessary when modeling and
         # ensures correct idx for exported nodesets
@@ -117,14 +433,19 @@ class ServerPython(object):
             self.get_node = None
             self.get_namespace_array = None
 
-    def import_xml(self, path):
-        return self._server.import_xml(path)
+    def import_xml(self, path=None, xmlstring=None):
+        return self._server.import_xml(path, xmlstring)
 
     def export_xml(self, nodes, path):
         exp = XmlExporter(self._server)
         exp.build_etree(nodes)
         exp.write_xml(path)
 
+    def export_etree(self, nodes):
+        exp = XmlExporter(self._server)
+        exp.build_etree(nodes)
+        return exp.aio_obj.etree.getroot()
+
 
 class UAServer(Thread):
     def __init__(self):
@@ -154,6 +475,21 @@ class ServerC(object):
     def get_server(self):
         return self._client
 
+    def get_session(self):
+        return self._client.aio_obj.uaclient
+
+    def run(self, coro):
+        return self._client.tloop.post(coro)
+
+    async def address_space_nodeids(self):
+        return None  # not available through a client
+
+    async def remove_references_to(self, nodeids):
+        return None  # left to DeleteNodes
+
+    async def watch_namespace_array(self, callback):
+        return False  # the array is read through the client
+
     def start_server(self, endpoint):
         self._server = UAServer()
         self._server.endpoint = 48400  # enpoint not supported yet
@@ -183,11 +519,16 @@ class ServerC(object):
             self.get_node = None
             self.get_namespace_array = None
 
-    def import_xml(self, path):
-        return self._client.import_xml(path)
+    def import_xml(self, path=None, xmlstring=None):
+        return self._client.import_xml(path, xmlstring)
 
     def export_xml(self, nodes, path):
         exp = XmlExporter(self._client)
         exp.build_etree(nodes)
         exp.write_xml(path)
 
+    def export_etree(self, nodes):
+        exp = XmlExporter(self._client)
+        exp.build_etree(nodes)
+        return exp.aio_obj.etree.getroot()
+
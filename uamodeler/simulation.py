@@ -0,0 +1,245 @@
+"""
+Simulation of variable values while the model is served.
+Generators compute the values of a whole group of variables for each tick,
+which are written with one batched Write request per batch of variables,
+reusing the same WriteValue objects every tick. A tick which cannot be
+written in time is skipped instead of delaying the next ones, the lag
+behind the target rate is reported. Original values are written back
+when the simulation stops so that simulated values are never saved,
+a value written by the user during the simulation replaces the original one
+"""
+
+import math
+import time
+import random
+import logging
+from datetime import datetime, timezone
+from threading import Thread
+
+from asyncua import ua
+
+from uamodeler.tag_import import csv_rows
+from uamodeler.node_tracker import node_key
+
+logger = logging.getLogger(__name__)
+
+_NUMERIC_TYPES = (
+    ua.VariantType.SByte, ua.VariantType.Byte, ua.VariantType.Int16, ua.VariantType.UInt16,
+    ua.VariantType.Int32, ua.VariantType.UInt32, ua.VariantType.Int64, ua.VariantType.UInt64,
+    ua.VariantType.Float, ua.VariantType.Double, ua.VariantType.Boolean,
+)
+_FLOAT_TYPES = (ua.VariantType.Float, ua.VariantType.Double)
+
+
+class Ramp(object):
+    """
+    values going from low to high in period seconds, each variable shifted by its position in the group
+    """
+
+    def __init__(self, low=0, high=100, period=10):
+        self.low = low
+        self.high = high
+        self.period = period
+
+    def values(self, t, tick, count):
+        span = self.high - self.low
+        start = t / self.period
+        return [self.low + span * ((start + i / count) % 1) for i in range(count)]
+
+
+class Sine(object):
+
+    def __init__(self, amplitude=50, offset=50, period=10):
+        self.amplitude = amplitude
+        self.offset = offset
+        self.period = period
+
+    def values(self, t, tick, count):
+        angle = 2 * math.pi * t / self.period
+        step = 2 * math.pi / count
+        return [self.offset + self.amplitude * math.sin(angle + i * step) for i in range(count)]
+
+
+class Random(object):
+
+    def __init__(self, low=0, high=100, seed=None):
+        self.low = low
+        self.high = high
+        self._random = random.Random(seed)
+
+    def values(self, t, tick, count):
+        span = self.high - self.low
+        rnd = self._random.random
+        return [self.low + span * rnd() for _ in range(count)]
+
+
+class Replay(object):
+    """
+    values of the rows of a CSV file, one row per tick and one column per variable,
+    columns are reused when there are more variables than columns. The first row may be a header
+    """
+
+    def __init__(self, path):
+        self.rows = []
+        for row in csv_rows(path):
+            try:
+                self.rows.append([float(cell) for cell in row])
+            except ValueError:
+                if self.rows:
+                    raise ValueError(f"Invalid number in row {len(self.rows) + 1} of {path}")
+        if not self.rows or not self.rows[0]:
+            raise ValueError(f"No values in {path}")
+
+    def values(self, t, tick, count):
+        row = self.rows[tick % len(self.rows)]
+        width = len(row)
+        return [row[i % width] for i in range(count)]
+
+
+GENERATORS = {"Ramp": Ramp, "Sine": Sine, "Random": Random, "Replay": Replay}
+
+
+def _cast(value, vtype):
+    if vtype in _FLOAT_TYPES:
+        return float(value)
+    if vtype == ua.VariantType.Boolean:
+        return int(value) % 2 == 1
+    return int(value)
+
+
+class _Group(object):
+    __slots__ = ("generator", "nodeids", "vtypes", "requests")
+
+    def __init__(self, generator, nodeids, vtypes, batch_size):
+        self.generator = generator
+        self.nodeids = nodeids
+        self.vtypes = vtypes
+        self.requests = []  # WriteParameters of a batch of variables, written every tick
+        for i in range(0, len(nodeids), batch_size):
+            params = ua.WriteParameters()
+            for nodeid in nodeids[i:i + batch_size]:
+                wv = ua.WriteValue()
+                wv.NodeId = nodeid
+                wv.AttributeId = ua.AttributeIds.Value
+                params.NodesToWrite.append(wv)
+            self.requests.append(params)
+
+
+class Simulation(Thread):
+    """
+    write generated values to groups of variables rate times per second until stopped
+    """
+
+    def __init__(self, server_mgr, rate=10.0, batch_size=None):
+        Thread.__init__(self, daemon=True)
+        self.server_mgr = server_mgr
+        self.rate = rate
+        self.batch_size = batch_size or server_mgr.batch_size
+        self._groups = []
+        self._originals = {}  # node key -> (nodeid, attribute, DataValue) written back when stopped
+        self._stop_requested = False
+        self._stats = {"ticks": 0, "missed_ticks": 0, "late_ticks": 0, "lag": 0, "max_lag": 0, "write": 0, "elapsed": 0, "errors": 0}
+
+    def add(self, nodeids, generator):
+        """
+        simulate values of the scalar numeric and boolean variables of nodeids with generator,
+        return the number of simulated variables
+        """
+        nodeids = list(nodeids)
+        dvs = self.server_mgr.read_attributes(nodeids, ua.AttributeIds.Value)
+        simulated = []
+        vtypes = []
+        for nodeid, dv in zip(nodeids, dvs):
+            variant = dv.Value
+            if dv.StatusCode.is_good() and variant is not None and not variant.is_array and variant.VariantType in _NUMERIC_TYPES:
+                simulated.append(nodeid)
+                vtypes.append(variant.VariantType)
+                self._originals[node_key(nodeid)] = (nodeid, ua.AttributeIds.Value, dv)
+        if simulated:
+            self._groups.append(_Group(generator, simulated, vtypes, self.batch_size))
+        logger.info("Simulating %s of %s variables with %s", len(simulated), len(nodeids), type(generator).__name__)
+        return len(simulated)
+
+    def edited(self, nodeid, dv):
+        """
+        value dv of nodeid was written by the user, it is written back instead of the original when stopped
+        """
+        key = node_key(nodeid)
+        if key in self._originals:
+            self._originals[key] = (nodeid, ua.AttributeIds.Value, ua.DataValue(dv.Value))
+
+    @property
+    def size(self):
+        return sum(len(group.nodeids) for group in self._groups)
+
+    def stop(self):
+        self._stop_requested = True
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        period = 1 / self.rate
+        start = time.perf_counter()
+        tick = 0
+        try:
+            while not self._stop_requested:
+                deadline = start + tick * period
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self._write_tick(deadline - start, tick)
+                done = time.perf_counter()
+                lag = done - deadline
+                self._stats["ticks"] += 1
+                self._stats["lag"] += lag
+                self._stats["max_lag"] = max(self._stats["max_lag"], lag)
+                if lag > period:
+                    self._stats["late_ticks"] += 1
+                # skip ticks we are late for instead of writing them in a burst
+                next_tick = max(tick + 1, int((done - start) / period))
+                self._stats["missed_ticks"] += next_tick - tick - 1
+                tick = next_tick
+                self._stats["elapsed"] = done - start
+        except Exception:
+            logger.exception("Simulation stopped")
+        finally:
+            self._restore()
+
+    def _write_tick(self, t, tick):
+        now = datetime.now(timezone.utc)
+        write_start = time.perf_counter()
+        for group in self._groups:
+            values = iter(group.generator.values(t, tick, len(group.nodeids)))
+            vtypes = iter(group.vtypes)
+            for params in group.requests:
+                for wv in params.NodesToWrite:
+                    vtype = next(vtypes)
+                    wv.Value = ua.DataValue(ua.Variant(_cast(next(values), vtype), vtype), SourceTimestamp=now, ServerTimestamp=now)
+                results = self.server_mgr.write_parameters(params)
+                self._stats["errors"] += sum(1 for result in results if not result.is_good())
+        self._stats["write"] += time.perf_counter() - write_start
+
+    def _restore(self):
+        if self._originals and self.server_mgr.get_server() is not None:
+            self.server_mgr.write_attributes(list(self._originals.values()))
+            logger.info("Restored values of %s simulated variables", len(self._originals))
+
+    def report(self):
+        """
+        achieved update rate and lag behind the target rate
+        """
+        stats = dict(self._stats)
+        ticks = stats["ticks"] or 1
+        return {
+            "variables": self.size,
+            "target_rate": self.rate,
+            "actual_rate": round(stats["ticks"] / stats["elapsed"], 2) if stats["elapsed"] else None,
+            "ticks": stats["ticks"],
+            "missed_ticks": stats["missed_ticks"],
+            "late_ticks": stats["late_ticks"],
+            "mean_lag_ms": round(1000 * stats["lag"] / ticks, 3),
+            "max_lag_ms": round(1000 * stats["max_lag"], 3),
+            "mean_write_ms": round(1000 * stats["write"] / ticks, 3),
+            "write_errors": stats["errors"],
+            "values_per_second": round(stats["ticks"] * self.size / stats["elapsed"]) if stats["elapsed"] else None,
+        }
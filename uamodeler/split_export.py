@@ -0,0 +1,132 @@
+"""
+Export of a model as one NodeSet2 file per namespace.
+Node trees are built by the exporter in the main process, which talks to the
+server, then pretty printed, serialized and compressed concurrently in worker
+processes. Each file declares its namespace as model, requiring the
+namespaces of the parents and types of its nodes
+"""
+
+import os
+import re
+import logging
+import multiprocessing
+import xml.etree.ElementTree as Et
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+from uamodeler.compression import is_compressed, write_compressed
+
+logger = logging.getLogger(__name__)
+
+UA_MODEL_URI = "http://opcfoundation.org/UA/"
+_ns_re = re.compile(r"ns=(\d+);")
+
+
+def namespace_file_name(base, uri, ext=".xml"):
+    """
+    return path of file of namespace uri for model saved at base
+    """
+    name = re.sub(r"[^\w.-]+", "_", uri).strip("_.")
+    return f"{base}.{name}{ext}"
+
+
+def _dependency_nodeids(root):
+    """
+    yield nodeids, as written in file, the nodes of file depend on: parents,
+    type definitions, data types and reference types. Children are not dependencies
+    """
+    aliases = {alias_el.attrib["Alias"]: alias_el.text for alias_el in root.iterfind("Aliases/Alias")}
+    for node_el in root:
+        if not node_el.tag.startswith("UA"):
+            continue
+        for attr in ("ParentNodeId", "DataType"):
+            if attr in node_el.attrib:
+                yield aliases.get(node_el.attrib[attr], node_el.attrib[attr])
+        for ref_el in node_el.iterfind("References/Reference"):
+            reftype = aliases.get(ref_el.attrib["ReferenceType"], ref_el.attrib["ReferenceType"])
+            yield reftype
+            if ref_el.attrib.get("IsForward") == "false" or reftype == "i=40":  # HasTypeDefinition
+                yield aliases.get(ref_el.text, ref_el.text)
+
+
+def add_models_element(root, model_uri, publication_date=None, known_dates=None):
+    """
+    add Models element to exported etree, model requires the namespaces its nodes depend on.
+    known_dates gives publication date of required models, default is publication_date
+    """
+    known_dates = known_dates or {}
+    if publication_date is None:
+        publication_date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    uris_el = root.find("NamespaceUris")
+    uris = [uri_el.text for uri_el in uris_el] if uris_el is not None else []
+    required = [UA_MODEL_URI]
+    for nodeid in _dependency_nodeids(root):
+        match = _ns_re.match(nodeid or "")
+        if match and 0 < int(match.group(1)) <= len(uris):
+            uri = uris[int(match.group(1)) - 1]
+            if uri != model_uri and uri not in required:
+                required.append(uri)
+    models_el = Et.Element("Models")
+    model_el = Et.SubElement(models_el, "Model", ModelUri=model_uri, PublicationDate=publication_date)
+    for uri in required:
+        Et.SubElement(model_el, "RequiredModel", ModelUri=uri, PublicationDate=known_dates.get(uri, publication_date))
+    root.insert(1 if uris_el is not None else 0, models_el)
+    return root
+
+
+def required_models(root):
+    models_el = root.find("Models")
+    if models_el is None:
+        return []
+    return [req_el.attrib["ModelUri"] for model_el in models_el for req_el in model_el.findall("RequiredModel")]
+
+
+def dependency_order(trees):
+    """
+    sort (model uri, etree root, path) so that files come after the files of models they require
+    """
+    by_uri = {uri: (uri, root, path) for uri, root, path in trees}
+    ordered = []
+    done = set()
+
+    def visit(uri, visiting):
+        if uri in done or uri not in by_uri:
+            return
+        if uri in visiting:
+            logger.warning("Circular dependency between namespaces including %s", uri)
+            return
+        visiting.add(uri)
+        for req in required_models(by_uri[uri][1]):
+            visit(req, visiting)
+        visiting.discard(uri)
+        done.add(uri)
+        ordered.append(by_uri[uri])
+
+    for uri, _, _ in trees:
+        visit(uri, set())
+    return ordered
+
+
+def write_nodeset(root, path):
+    Et.indent(root, space="  ")
+    tree = Et.ElementTree(root)
+    if is_compressed(path):
+        write_compressed(path, lambda f: tree.write(f, encoding="utf-8", xml_declaration=True))
+    else:
+        tree.write(path, encoding="utf-8", xml_declaration=True)
+    return path
+
+
+def write_nodesets(trees, max_workers=None):
+    """
+    write (etree root, path) pairs, each in its own worker process
+    """
+    if len(trees) < 2:
+        return [write_nodeset(root, path) for root, path in trees]
+    max_workers = min(len(trees), max_workers or os.cpu_count() or 1)
+    # spawn, forking a process running the server thread is not safe
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(write_nodeset, root, path) for root, path in trees]
+        paths = [future.result() for future in futures]
+    logger.info("Wrote %s nodesets with %s workers", len(paths), max_workers)
+    return paths
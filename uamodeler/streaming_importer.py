@@ -0,0 +1,321 @@
+"""
+Import of NodeSet2 files too large to be loaded in memory at once.
+Top level elements are parsed one by one with iterparse and freed as soon as
+they are converted, nodes are created in batches. Nodes whose parent, type or
+data type do not exist yet wait until it is created and references to nodes
+not created yet are kept in a deferred table until their target appears.
+Nodes without ParentNodeId wait for the reference of their parent in any batch
+"""
+
+import logging
+import xml.etree.ElementTree as Et
+
+from asyncua import ua
+from asyncua.common.xmlimporter import XmlImporter
+from asyncua.common.xmlparser import XMLParser
+
+logger = logging.getLogger(__name__)
+
+_HEADER_TAGS = ("NamespaceUris", "Aliases", "Models")
+_IGNORED_TAGS = ("Extensions", "ServerUris")
+_TYPE_NODES = ("UAObjectType", "UAVariableType", "UADataType", "UAReferenceType")
+
+
+# attributes of nodes as written by XMLParser in NodeData, Value needs the importer
+_ATTRIBUTE_VALUES = {
+    "BrowseName": lambda ndata: ua.Variant(ndata.browsename),
+    "DisplayName": lambda ndata: ua.Variant(ua.LocalizedText(ndata.displayname)),
+    "Description": lambda ndata: ua.Variant(ua.LocalizedText(ndata.desc)),
+    "InverseName": lambda ndata: ua.Variant(ua.LocalizedText(ndata.inversename)),
+    "DataType": lambda ndata: ua.Variant(ndata.datatype),
+    "ValueRank": lambda ndata: ua.Variant(ndata.rank, ua.VariantType.Int32),
+    "ArrayDimensions": lambda ndata: ua.Variant(ndata.dimensions or [], ua.VariantType.UInt32),
+    "AccessLevel": lambda ndata: ua.Variant(ndata.accesslevel, ua.VariantType.Byte),
+    "UserAccessLevel": lambda ndata: ua.Variant(ndata.useraccesslevel, ua.VariantType.Byte),
+    "MinimumSamplingInterval": lambda ndata: ua.Variant(ndata.minsample, ua.VariantType.Double),
+    "Historizing": lambda ndata: ua.Variant(ndata.historizing, ua.VariantType.Boolean),
+    "IsAbstract": lambda ndata: ua.Variant(ndata.abstract, ua.VariantType.Boolean),
+    "Symmetric": lambda ndata: ua.Variant(ndata.symmetric, ua.VariantType.Boolean),
+    "EventNotifier": lambda ndata: ua.Variant(ndata.eventnotifier, ua.VariantType.Byte),
+}
+WRITABLE_ATTRIBUTES = ("Value",) + tuple(_ATTRIBUTE_VALUES)
+
+# private members of asyncua the streaming importer relies on, they are not
+# a stable interface and are checked before use
+_IMPORTER_INTERNALS = ("_add_missing_reverse_references", "_add_node_data", "_add_variable_value",
+                       "_check_if_namespace_meta_information_is_added", "_check_required_models", "_get_server",
+                       "_map_aliases", "_map_namespaces", "_sort_nodes")
+_PARSER_INTERNALS = ("_parse_node",)
+
+
+def is_supported():
+    """
+    True if installed asyncua has what the streaming importer needs, else files must be imported at once
+    """
+    return all(hasattr(XmlImporter, name) for name in _IMPORTER_INTERNALS) and all(hasattr(XMLParser, name) for name in _PARSER_INTERNALS)
+
+
+def _local_tag(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+class _HeaderParser(XMLParser):
+    """
+    XMLParser whose root only contains the header elements of the file,
+    nodes are parsed one by one as they are read
+    """
+
+    def __init__(self):
+        XMLParser.__init__(self)
+        self.root = Et.Element("UANodeSet")
+        self.required_models = []
+
+    def list_required_models(self, xmlpath=None, xmlstring=None):
+        return list(self.required_models)
+
+
+class StreamingXmlImporter(XmlImporter):
+
+    def __init__(self, server, batch_size=1000, strict_mode=True):
+        XmlImporter.__init__(self, server, strict_mode)
+        self.batch_size = batch_size
+        self._started = False
+        self._pending_refs = []  # references of nodes of current batch
+        self._deferred_refs = {}  # missing target nodeid -> references waiting for it
+        self._waiting = {}  # missing nodeid -> nodes which cannot be created before it
+        self._parents = {}  # child nodeid -> (parent nodeid, reftype) of HasComponent and HasProperty references read so far
+        self._orphans = {}  # nodeid -> node without ParentNodeId whose parent reference was not read yet
+
+    async def import_xml(self, xmlpath=None, xmlstring=None):
+        """
+        import xml file, given as a path or a binary file object, and return added nodeids
+        """
+        if xmlpath is None:
+            raise ValueError("Streaming import requires a file path or a file object")
+        logger.info("Streaming import of XML file %s", xmlpath)
+        self.refs = []
+        nodes = []
+        batch = []
+        for tag, el in self._node_elements(xmlpath):
+            if not self._started:
+                await self._start()
+            batch.append(self.parser._parse_node(tag, el))
+            if len(batch) >= self.batch_size:
+                nodes.extend(await self._import_batch(batch))
+                batch = []
+        if not self._started:
+            await self._start()
+        nodes.extend(await self._import_batch(batch))
+        # no element of the file references them as children, added without parent as import_xml does
+        orphans, self._orphans = list(self._orphans.values()), {}
+        nodes.extend(await self._add_nodes(orphans))
+        nodes.extend(await self._add_waiting_nodes())
+        for refs in self._deferred_refs.values():
+            self.refs.extend(refs)
+        self._deferred_refs = {}
+        if self.refs:
+            logger.warning("The following references could not be imported and are probably broken: %s", self.refs)
+        await self._check_if_namespace_meta_information_is_added()
+        logger.info("Imported %s nodes from %s", len(nodes), xmlpath)
+        return nodes
+
+    def _node_elements(self, xmlpath):
+        """
+        yield (tag, element) of the nodes of file, header elements are given to the parser
+        """
+        self.parser = _HeaderParser()
+        depth = 0
+        root = None
+        for event, el in Et.iterparse(xmlpath, events=("start", "end")):
+            if event == "start":
+                if depth == 0:
+                    root = el
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            tag = _local_tag(el.tag)
+            if tag in _HEADER_TAGS:
+                if tag == "Models":
+                    self.parser.required_models.extend(child.attrib for child in el.iter() if _local_tag(child.tag) == "RequiredModel")
+                self.parser.root.append(el)  # header elements are small, keep them for the parser
+            elif tag not in _IGNORED_TAGS:
+                yield tag, el
+            root.clear()  # free what has been parsed
+
+    async def read_attribute_values(self, xmlpath, wanted):
+        """
+        return {nodeid: {attribute name: Variant}} of nodes of xml file, without creating them.
+        wanted is a {nodeid: attribute names} dict, nodeids as they are on server
+        """
+        values = {}
+        for tag, el in self._node_elements(xmlpath):
+            if not self._started:
+                await self._start()
+            ndata = self.make_objects([self.parser._parse_node(tag, el)])[0]
+            if ndata.nodeid not in wanted:
+                continue
+            values[ndata.nodeid] = {}
+            for name in wanted[ndata.nodeid]:
+                if name == "Value":
+                    if ndata.value is not None:
+                        values[ndata.nodeid][name] = await self._add_variable_value(ndata)
+                elif name in _ATTRIBUTE_VALUES:
+                    values[ndata.nodeid][name] = _ATTRIBUTE_VALUES[name](ndata)
+        return values
+
+    async def _start(self):
+        """
+        namespaces, aliases and models are written before nodes in NodeSet2 files
+        """
+        await self._check_required_models()
+        self.namespaces = await self._map_namespaces()
+        logger.info("namespace map: %s", self.namespaces)
+        self._unmigrated_aliases = self.parser.get_aliases()
+        self.aliases = self._map_aliases(self._unmigrated_aliases)
+        self._started = True
+
+    async def _import_batch(self, ndatas):
+        if not ndatas:
+            return []
+        return await self._add_nodes(self._resolve_parents(self.make_objects(ndatas)))
+
+    def _resolve_parents(self, ndatas):
+        """
+        set parent of nodes without ParentNodeId from the forward HasComponent and HasProperty
+        references of the nodes read so far, in any batch. Nodes whose parent reference was not
+        read yet are held back until it is. Return the nodes of the batch and the released ones
+        """
+        reftypes = (self.session.nodes.HasComponent.nodeid, self.session.nodes.HasProperty.nodeid)
+        ready = []
+        for ndata in ndatas:
+            for ref in ndata.refs:
+                if ref.forward and ref.reftype in reftypes:
+                    self._parents[ref.target] = (ndata.nodeid, ref.reftype)
+            if not ndata.parent or ndata.parent == ndata.nodeid:
+                self._orphans[ndata.nodeid] = ndata
+            else:
+                ready.append(ndata)
+        for nodeid in [nodeid for nodeid in self._orphans if nodeid in self._parents]:
+            ndata = self._orphans.pop(nodeid)
+            ndata.parent, ndata.parentlink = self._parents.pop(nodeid)
+            ready.append(ndata)
+        return ready
+
+    async def _add_nodes(self, ndatas):
+        created = []
+        while ndatas:
+            ready = await self._hold_back(ndatas)
+            new_nodes = []
+            for ndata in self._sort_nodes(ready):
+                nodeid = await self._try_add_node_data(ndata)
+                if nodeid is not None:
+                    new_nodes.append(nodeid)
+            await self._flush_refs(new_nodes)
+            await self._add_missing_reverse_references(new_nodes)
+            created.extend(new_nodes)
+            # nodes which were waiting for the ones we just created
+            ndatas = [ndata for nodeid in new_nodes for ndata in self._waiting.pop(nodeid, [])]
+        return created
+
+    async def _add_waiting_nodes(self):
+        """
+        add nodes whose dependencies never appeared, as the non streaming importer would
+        """
+        ndatas = [ndata for ndatas in self._waiting.values() for ndata in ndatas]
+        self._waiting = {}
+        if not ndatas:
+            return []
+        logger.warning("%s nodes depend on nodes missing in file and server", len(ndatas))
+        created = []
+        for ndata in ndatas:
+            nodeid = await self._try_add_node_data(ndata)
+            if nodeid is not None:
+                created.append(nodeid)
+        await self._flush_refs(created)
+        return created
+
+    async def _try_add_node_data(self, ndata):
+        try:
+            return await self._add_node_data(ndata, no_namespace_migration=True)
+        except Exception as ex:
+            logger.warning("failure adding node %s %s", ndata, ex)
+            if self.strict_mode:
+                raise
+        return None
+
+    @staticmethod
+    def _dependencies(ndata):
+        deps = []
+        if ndata.parent is not None and ndata.parent != ndata.nodeid:
+            deps.append(ndata.parent)
+        if ndata.typedef is not None and ndata.nodetype not in _TYPE_NODES:
+            deps.append(ndata.typedef)
+        if ndata.datatype is not None:
+            deps.append(ndata.datatype)
+        return deps
+
+    async def _hold_back(self, ndatas):
+        """
+        return nodes which can be created now, the others wait for their missing dependency
+        """
+        in_batch = {ndata.nodeid for ndata in ndatas}
+        outside = list({dep for ndata in ndatas for dep in self._dependencies(ndata) if dep not in in_batch})
+        missing = set(dep for dep, exists in zip(outside, await self._exist(outside)) if not exists)
+        ready = list(ndatas)
+        changed = True
+        while changed:
+            changed = False
+            still_ready = []
+            for ndata in ready:
+                dep = next((dep for dep in self._dependencies(ndata) if dep in missing), None)
+                if dep is None:
+                    still_ready.append(ndata)
+                else:
+                    self._waiting.setdefault(dep, []).append(ndata)
+                    missing.add(ndata.nodeid)
+                    changed = True
+            ready = still_ready
+        return ready
+
+    async def _exist(self, nodeids):
+        if not nodeids:
+            return []
+        params = ua.ReadParameters()
+        for nodeid in nodeids:
+            rv = ua.ReadValueId()
+            rv.NodeId = nodeid
+            rv.AttributeId = ua.AttributeIds.NodeClass
+            params.NodesToRead.append(rv)
+        results = await self._get_server().read(params)
+        return [dv.StatusCode.is_good() for dv in results]
+
+    async def _add_refs(self, obj):
+        """
+        references are sent for a whole batch once its nodes are created
+        """
+        for data in obj.refs:
+            ref = ua.AddReferencesItem()
+            ref.IsForward = data.forward
+            ref.ReferenceTypeId = data.reftype
+            ref.SourceNodeId = obj.nodeid
+            ref.TargetNodeId = data.target
+            self._pending_refs.append(ref)
+
+    async def _flush_refs(self, new_nodes):
+        refs, self._pending_refs = self._pending_refs, []
+        for nodeid in new_nodes:
+            refs.extend(self._deferred_refs.pop(nodeid, []))
+        if not refs:
+            return
+        results = []
+        for idx in range(0, len(refs), self.batch_size):
+            results.extend(await self._get_server().add_references(refs[idx:idx + self.batch_size]))
+        for ref, result in zip(refs, results):
+            if result.is_good():
+                continue
+            if result.value == ua.StatusCodes.BadTargetNodeIdInvalid:
+                self._deferred_refs.setdefault(ref.TargetNodeId, []).append(ref)
+            else:
+                self.refs.append(ref)
@@ -0,0 +1,251 @@
+"""
+Import of tag lists, as exported by PLC tools, as folders and variables.
+Rows are read one at a time from CSV or XLSX files and the nodes of each
+batch of rows are created with a few AddNodes calls: one per folder depth
+for the missing folders of the batch, then one for its variables
+"""
+
+import csv
+import logging
+
+from asyncua import ua
+from asyncua.common.ua_utils import string_to_val
+from asyncua.sync import data_type_to_variant_type
+
+from uamodeler.node_tracker import node_key
+
+logger = logging.getLogger(__name__)
+
+try:
+    import openpyxl
+except ImportError as ex:
+    logger.info("Could not import openpyxl, XLSX tag lists will not be supported: %s", ex)
+    openpyxl = None
+
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
+PATH_SEPARATOR = "/"
+
+# header of a column, lower case without spaces, dashes and underscores -> field of Tag
+_COLUMNS = {
+    "path": "path", "folder": "path",
+    "name": "name", "tag": "name", "tagname": "name",
+    "datatype": "datatype", "type": "datatype",
+    "arrayrank": "rank", "rank": "rank", "valuerank": "rank",
+    "initialvalue": "value", "value": "value",
+    "nodeid": "nodeid",
+}
+
+
+class Tag(object):
+    __slots__ = ("line", "path", "name", "datatype", "rank", "value", "nodeid")
+
+    def __init__(self, line, path="", name="", datatype="", rank="", value="", nodeid=""):
+        self.line = line
+        self.path = path
+        self.name = name
+        self.datatype = datatype
+        self.rank = rank
+        self.value = value
+        self.nodeid = nodeid
+
+
+def csv_rows(path):
+    """
+    yield the rows of a CSV file, its delimiter is sniffed among comma, semicolon and tab
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _xlsx_rows(path):
+    if openpyxl is None:
+        raise RuntimeError("openpyxl must be installed to import XLSX tag lists")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if cell is None else str(cell) for cell in row]
+    finally:
+        workbook.close()
+
+
+def read_tags(path):
+    """
+    yield a Tag for each row of a CSV or XLSX tag list, the first row is the header
+    """
+    rows = _xlsx_rows(path) if path.lower().endswith(XLSX_EXTENSIONS) else csv_rows(path)
+    header = next(rows, [])
+    fields = [_COLUMNS.get(name.strip().lower().replace(" ", "").replace("_", "").replace("-", "")) for name in header]
+    if "name" not in fields:
+        raise ValueError(f"Tag list {path} has no Name column")
+    for line, row in enumerate(rows, 2):
+        values = {field: value.strip() for field, value in zip(fields, row) if field is not None}
+        if not any(values.values()):
+            continue
+        yield Tag(line, **values)
+
+
+class TagImporter(object):
+    """
+    create folders and variables of tags under parent, batch_size tags at a time.
+    Folders of tag paths are reused if they already exist
+    """
+
+    def __init__(self, server_mgr, parent, idx, batch_size=1000):
+        self.server_mgr = server_mgr
+        self.idx = idx
+        self.batch_size = batch_size
+        self.created = []  # nodeids of created folders and variables
+        self.errors = []  # (line, message) of tags not imported
+        self._folders = {(): parent}  # path -> nodeid
+        self._failed = {}  # path -> status of folders that could not be created
+        self._children = {}  # folder key -> {name: nodeid} of its child folders
+        self._datatypes = {}  # text of DataType column -> (datatype nodeid, VariantType)
+
+    def run(self, tags):
+        batch = []
+        for tag in tags:
+            batch.append(tag)
+            if len(batch) >= self.batch_size:
+                self._add_batch(batch)
+                batch = []
+        if batch:
+            self._add_batch(batch)
+        return self.created
+
+    def _add_batch(self, tags):
+        self._add_folders(set(self._path(tag) for tag in tags))
+        items = []
+        added = []
+        for tag in tags:
+            try:
+                items.append(self._variable_item(tag))
+            except Exception as ex:
+                self.errors.append((tag.line, str(ex)))
+                continue
+            added.append(tag)
+        for tag, result in zip(added, self.server_mgr.add_nodes(items)):
+            if result.StatusCode.is_good():
+                self.created.append(result.AddedNodeId)
+            else:
+                self.errors.append((tag.line, result.StatusCode.name))
+
+    @staticmethod
+    def _path(tag):
+        return tuple(name.strip() for name in tag.path.split(PATH_SEPARATOR) if name.strip())
+
+    def _add_folders(self, paths):
+        """
+        create missing folders of paths, parents before children, one AddNodes call per depth
+        """
+        missing = set()
+        for path in paths:
+            for depth in range(1, len(path) + 1):
+                if path[:depth] in self._failed:
+                    break
+                if path[:depth] not in self._folders:
+                    missing.add(path[:depth])
+        for depth in sorted(set(len(path) for path in missing)):
+            # children of a folder that failed at the previous depth are skipped
+            level = sorted(path for path in missing if len(path) == depth and path[:-1] in self._folders)
+            self._browse_folders([self._folders[path[:-1]] for path in level])
+            new = []
+            for path in level:
+                existing = self._children[node_key(self._folders[path[:-1]])].get(path[-1])
+                if existing is not None:
+                    self._folders[path] = existing
+                else:
+                    new.append(path)
+            for path, result in zip(new, self.server_mgr.add_nodes([self._folder_item(path) for path in new])):
+                if not result.StatusCode.is_good():
+                    self._failed[path] = result.StatusCode.name
+                    continue
+                self._folders[path] = result.AddedNodeId
+                self._children[node_key(result.AddedNodeId)] = {}
+                self.created.append(result.AddedNodeId)
+
+    def _browse_folders(self, nodeids):
+        """
+        read names of the child objects of folders that existed before the import
+        """
+        nodeids = [nodeid for nodeid in set(nodeids) if node_key(nodeid) not in self._children]
+        for nodeid, refs in zip(nodeids, self.server_mgr.browse(nodeids)):
+            self._children[node_key(nodeid)] = {ref.BrowseName.Name: ref.NodeId for ref in refs if ref.NodeClass == ua.NodeClass.Object}
+
+    def _folder_item(self, path):
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = ua.NodeId(NamespaceIndex=self.idx)
+        item.BrowseName = ua.QualifiedName(path[-1], self.idx)
+        item.NodeClass = ua.NodeClass.Object
+        item.ParentNodeId = self._folders[path[:-1]]
+        item.ReferenceTypeId = ua.NodeId(ua.ObjectIds.Organizes)
+        item.TypeDefinition = ua.NodeId(ua.ObjectIds.FolderType)
+        attrs = ua.ObjectAttributes()
+        attrs.EventNotifier = 0
+        attrs.Description = ua.LocalizedText(path[-1])
+        attrs.DisplayName = ua.LocalizedText(path[-1])
+        attrs.WriteMask = 0
+        attrs.UserWriteMask = 0
+        item.NodeAttributes = attrs
+        return item
+
+    def _datatype(self, text):
+        """
+        DataType nodeid and VariantType of a built-in type name or of a nodeid string
+        """
+        if text not in self._datatypes:
+            if hasattr(ua.VariantType, text) and hasattr(ua.ObjectIds, text):
+                datatype = ua.NodeId(getattr(ua.ObjectIds, text))
+                self._datatypes[text] = (datatype, getattr(ua.VariantType, text))
+            else:
+                try:
+                    datatype = ua.NodeId.from_string(text)
+                except ua.UaStringParsingError:
+                    raise ValueError(f"Unknown DataType {text}")
+                self._datatypes[text] = (datatype, data_type_to_variant_type(self.server_mgr.get_node(datatype)))
+        return self._datatypes[text]
+
+    def _variable_item(self, tag):
+        if not tag.name:
+            raise ValueError("Tag has no name")
+        if not tag.datatype:
+            raise ValueError(f"Tag {tag.name} has no DataType")
+        path = self._path(tag)
+        for depth in range(1, len(path) + 1):
+            if path[:depth] in self._failed:
+                raise ValueError(f"Folder {PATH_SEPARATOR.join(path[:depth])} could not be created: {self._failed[path[:depth]]}")
+        datatype, vtype = self._datatype(tag.datatype)
+        rank = int(tag.rank) if tag.rank else ua.ValueRank.Scalar
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = ua.NodeId.from_string(tag.nodeid) if tag.nodeid else ua.NodeId(NamespaceIndex=self.idx)
+        item.BrowseName = ua.QualifiedName(tag.name, self.idx)
+        item.NodeClass = ua.NodeClass.Variable
+        item.ParentNodeId = self._folders[path]
+        item.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasComponent)
+        item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseDataVariableType)
+        attrs = ua.VariableAttributes()
+        attrs.Description = ua.LocalizedText(tag.name)
+        attrs.DisplayName = ua.LocalizedText(tag.name)
+        attrs.DataType = datatype
+        attrs.ValueRank = rank
+        if rank > 0:
+            attrs.ArrayDimensions = [0] * rank
+            text = tag.value if tag.value.startswith("[") else f"[{tag.value}]"
+            value = string_to_val(text, vtype) if tag.value else []
+        elif vtype == ua.VariantType.Null or not tag.value:
+            value = None
+        else:
+            value = string_to_val(tag.value, vtype)
+        attrs.Value = ua.Variant(value, vtype)
+        attrs.WriteMask = 0
+        attrs.UserWriteMask = 0
+        attrs.Historizing = False
+        attrs.AccessLevel = ua.AccessLevel.CurrentRead.mask
+        attrs.UserAccessLevel = ua.AccessLevel.CurrentRead.mask
+        item.NodeAttributes = attrs
+        return item
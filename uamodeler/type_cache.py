@@ -0,0 +1,123 @@
+"""
+Persistent cache of the python classes generated for the structures and enums
+of type dictionaries. Generating and compiling their code is slow for large
+dictionaries, so the compiled code is stored on disk, keyed by the content of
+the dictionary, the asyncua version and the python bytecode version
+"""
+
+import os
+import sys
+import uuid
+import typing
+import marshal
+import hashlib
+import logging
+from enum import IntEnum, EnumMeta
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from importlib.metadata import version
+
+from asyncua import ua
+from asyncua.ua.uatypes import _set_ua_attribute
+from asyncua.common.structures import StructGenerator, clean_name
+
+logger = logging.getLogger(__name__)
+
+
+def _environment():
+    """
+    globals needed by generated code, as set by asyncua when generating classes
+    """
+    return {
+        "ua": ua,
+        "datetime": datetime,
+        "timezone": timezone,
+        "uuid": uuid,
+        "IntEnum": IntEnum,
+        "dataclass": dataclass,
+        "field": field,
+        "Optional": typing.Optional,
+    }
+
+
+class TypeDefinitionCache(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._prefix = f"{version('asyncua')} {sys.implementation.cache_tag}\n".encode()
+
+    def _path(self, xml):
+        return os.path.join(self.directory, hashlib.sha256(self._prefix + xml).hexdigest() + ".bin")
+
+    def get(self, xml):
+        path = self._path(xml)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError) as ex:
+            logger.warning("Ignoring broken type definition cache file %s: %s", path, ex)
+            return None
+
+    def put(self, xml, code):
+        path = self._path(xml)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                marshal.dump(code, f)
+            os.replace(path + ".tmp", path)
+        except OSError as ex:
+            logger.warning("Could not write type definition cache file %s: %s", path, ex)
+
+
+def compile_dictionary(xml, cache=None):
+    """
+    return code object defining classes of type dictionary xml, from cache if possible
+    """
+    if cache is not None:
+        code = cache.get(xml)
+        if code is not None:
+            return code
+    generator = StructGenerator()
+    generator.make_model_from_string(xml)
+    source = "\n\n".join(element.get_code() for element in generator.model)
+    code = compile(source, "<type dictionary>", "exec")
+    if cache is not None:
+        cache.put(xml, code)
+    return code
+
+
+async def load_type_definitions(server, cache=None):
+    """
+    same as asyncua load_type_definitions but generated code is taken from cache
+    return a dict of structures {name: class}
+    """
+    nodes = []
+    for desc in await server.nodes.opc_binary.get_children_descriptions():
+        if desc.BrowseName != ua.QualifiedName("Opc.Ua"):
+            nodes.append(server.get_node(desc.NodeId))
+
+    structs_dict = _environment()
+    for node in nodes:
+        xml = await node.read_value()
+        if not xml:
+            continue
+        if isinstance(xml, str):
+            xml = xml.encode("utf-8")
+        exec(compile_dictionary(xml, cache), structs_dict)
+        # every child of dictionary node with a description is a class to register
+        for ndesc in await node.get_children_descriptions():
+            ndesc_node = server.get_node(ndesc.NodeId)
+            ref_desc_list = await ndesc_node.get_references(refs=ua.ObjectIds.HasDescription, direction=ua.BrowseDirection.Inverse)
+            if ref_desc_list:
+                name = clean_name(ndesc.BrowseName.Name)
+                if name not in structs_dict:
+                    logger.warning("%s is found as child of binary definition node but is not found in xml", name)
+                    continue
+                ua.register_extension_object(name, ref_desc_list[0].NodeId, structs_dict[name])
+
+    for key, val in structs_dict.items():
+        if isinstance(val, EnumMeta) and key != "IntEnum":
+            _set_ua_attribute(key, val, getattr(val, "data_type", None))
+    return structs_dict
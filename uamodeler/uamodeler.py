@@ -5,8 +5,9 @@ import os
 import logging
 
 from PyQt5.QtCore import QTimer, QSettings, QModelIndex, Qt, QCoreApplication, QObject, pyqtSignal
-from PyQt5.QtGui import QIcon, QFont
+from PyQt5.QtGui import QIcon, QFont, QKeySequence
 from PyQt5.QtWidgets import QMainWindow, QApplication, QFileDialog, QMessageBox, QStyledItemDelegate, QMenu, QAction
+from PyQt5.QtWidgets import QDockWidget, QWidget, QVBoxLayout, QLineEdit, QTreeView, QAbstractItemView, QInputDialog
 
 
 from asyncua import ua
@@ -22,23 +23,36 @@ from uawidgets.logger import QtHandler
 from uamodeler.uamodeler_ui import Ui_UaModeler
 from uamodeler.namespace_widget import NamespaceWidget
 from uamodeler.refnodesets_widget import RefNodeSetsWidget
+from uamodeler.search_widget import SearchWidget
+from uamodeler.diff_widget import DiffWidget
+from uamodeler.merge_dialog import MergeConflictsDialog
+from uamodeler.validation_widget import ValidationWidget
+from uamodeler.validation import ERROR
+from uamodeler.node_tracker import node_key
 from uamodeler.model_manager import ModelManager
+from uamodeler.binary_model import BINARY_MODEL_EXTENSION
+from uamodeler.simulation import GENERATORS, Replay
+from uamodeler.server_loader import LOADER_EXTENSION
 
 
 logger = logging.getLogger(__name__)
 
+MODELLING_RULES = ["Mandatory", "Optional", "MandatoryPlaceholder", "OptionalPlaceholder", "ExposesItsArray"]
+SELECTION_REFERENCE_TYPES = ["Organizes", "HasComponent", "HasProperty", "HasOrderedComponent", "HasInterface", "HasAddIn",
+                             "GeneratesEvent", "HasEventSource", "HasNotifier"]
+
 
 class BoldDelegate(QStyledItemDelegate):
 
-    def __init__(self, parent, model, added_node_list):
+    def __init__(self, parent, model, added_nodes):
         QStyledItemDelegate.__init__(self, parent)
-        self.added_node_list = added_node_list
+        self.added_nodes = added_nodes
         self.model = model
 
     def paint(self, painter, option, idx):
         new_idx = idx.sibling(idx.row(), 0)
         item = self.model.itemFromIndex(new_idx)
-        if item and item.data(Qt.UserRole) in self.added_node_list:
+        if item and item.data(Qt.UserRole) in self.added_nodes:
             option.font.setWeight(QFont.Bold)
         QStyledItemDelegate.paint(self, painter, option, idx)
 
@@ -177,6 +191,9 @@ class ModelManagerUI(QObject):
 
     error = pyqtSignal(Exception)
     titleChanged = pyqtSignal(str)
+    searchIndexReady = pyqtSignal()
+    undoStateChanged = pyqtSignal()
+    simulationStateChanged = pyqtSignal(bool)
 
     def __init__(self, modeler):
         QObject.__init__(self)
@@ -184,6 +201,9 @@ class ModelManagerUI(QObject):
         self._model_mgr = ModelManager(modeler)
         self._model_mgr.error.connect(self.error)
         self._model_mgr.titleChanged.connect(self.titleChanged)
+        self._model_mgr.searchIndexReady.connect(self.searchIndexReady)
+        self._model_mgr.undoStateChanged.connect(self.undoStateChanged)
+        self._model_mgr.simulationStateChanged.connect(self.simulationStateChanged)
         self.settings = QSettings()
         self._last_model_dir = self.settings.value("last_model_dir", ".")
         self._copy_clipboard = None
@@ -194,6 +214,12 @@ class ModelManagerUI(QObject):
     def get_new_nodes(self):
         return self._model_mgr.new_nodes
 
+    def get_search_index(self):
+        return self._model_mgr.search_index
+
+    def get_undo_stack(self):
+        return self._model_mgr.undo_stack
+
     def setModified(self, val=True):
         self._model_mgr.modified = val
 
@@ -208,6 +234,93 @@ class ModelManagerUI(QObject):
         node = self.modeler.get_current_node()
         self._model_mgr.delete_node(node)
 
+    @trycatchslot
+    def undo(self):
+        self._model_mgr.undo()
+
+    @trycatchslot
+    def redo(self):
+        self._model_mgr.redo()
+
+    @trycatchslot
+    def export_selection(self):
+        nodes = self.modeler.get_selected_nodes()
+        if not nodes:
+            return
+        path, ok = QFileDialog.getSaveFileName(self.modeler, caption="Export Selection", filter="XML Files (*.xml *.XML *.xml.gz *.xml.zst)")
+        if ok:
+            self._model_mgr.export_selection(nodes, path)
+
+    @trycatchslot
+    def export_loader(self):
+        path, ok = QFileDialog.getSaveFileName(self.modeler, caption="Export Server Loader", directory=self._last_model_dir, filter="Python Files (*.py)")
+        if not ok:
+            return
+        if not path.endswith(LOADER_EXTENSION):
+            path += LOADER_EXTENSION
+        times = self._model_mgr.export_loader(path)
+        self.modeler.show_msg(f"Loader starts in {times['loader_seconds']}s, XML import in {times['xml_seconds']}s ({times['speedup']}x)")
+
+    @trycatchslot
+    def validate(self):
+        self.modeler.show_issues(self._model_mgr.validate())
+
+    @trycatchslot
+    def simulate(self, checked):
+        if not checked:
+            report = self._model_mgr.stop_simulation()
+            if report is not None:
+                self.modeler.show_msg(f"Simulated {report['variables']} variables at {report['actual_rate']} Hz, target {report['target_rate']} Hz")
+            return
+        names = list(GENERATORS)
+        name, ok = QInputDialog.getItem(self.modeler, "Simulate Values", "Generator:", names, names.index(self.settings.value("last_generator", "Sine")), False)
+        if not ok:
+            self.modeler.actionSimulate.setChecked(False)
+            return
+        self.settings.setValue("last_generator", name)
+        if name == "Replay":
+            path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Replay Values", filter="CSV Files (*.csv *.txt)", directory=self.settings.value("last_import_dir", "."))
+            if not ok:
+                self.modeler.actionSimulate.setChecked(False)
+                return
+            generator = Replay(path)
+        else:
+            generator = GENERATORS[name]()
+        rate, ok = QInputDialog.getDouble(self.modeler, "Simulate Values", "Updates per second:", float(self.settings.value("simulation_rate", 10.0)), 0.1, 1000, 1)
+        if not ok:
+            self.modeler.actionSimulate.setChecked(False)
+            return
+        self.settings.setValue("simulation_rate", rate)
+        try:
+            self._model_mgr.start_simulation(generator, rate)
+        except Exception:
+            self.modeler.actionSimulate.setChecked(False)
+            raise
+
+    @trycatchslot
+    def diff_with_file(self):
+        path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Compare With File", directory=self._last_model_dir, filter="XML Files (*.xml *.XML *.xml.gz *.xml.zst)")
+        if not ok:
+            return
+        diff = self._model_mgr.diff_with_file(path)
+        self.modeler.show_diff(diff)
+
+    @trycatchslot
+    def merge(self):
+        xml_filter = "XML Files (*.xml *.XML *.xml.gz *.xml.zst)"
+        base_path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Select Base Model", directory=self._last_model_dir, filter=xml_filter)
+        if not ok:
+            return
+        their_path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Select Model To Merge", directory=self._last_model_dir, filter=xml_filter)
+        if not ok:
+            return
+        plan = self._model_mgr.merge(base_path, their_path)
+        if not plan.conflicts:
+            return
+        dia = MergeConflictsDialog(self.modeler, plan.conflicts)
+        if dia.exec_() and dia.taken_conflicts():
+            self._model_mgr.resolve_conflicts(their_path, dia.taken_conflicts())
+
     @trycatchslot
     def copy(self):
         node = self.modeler.get_current_node()
@@ -240,7 +353,7 @@ class ModelManagerUI(QObject):
     def open(self):
         if not self.try_close_model():
             return
-        path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Open OPC UA XML", filter="XML Files (*.xml *.XML *.uamodel)", directory=self._last_model_dir)
+        path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Open OPC UA XML", filter="Model Files (*.xml *.XML *.xml.gz *.xml.zst *.uamodel *.uamb)", directory=self._last_model_dir)
         if not ok:
             return
         if self._last_model_dir != os.path.dirname(path):
@@ -255,32 +368,55 @@ class ModelManagerUI(QObject):
     @trycatchslot
     def import_xml(self):
         last_import_dir = self.settings.value("last_import_dir", ".")
-        path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Import reference OPC UA XML", filter="XML Files (*.xml *.XML)", directory=last_import_dir)
+        path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Import reference OPC UA XML", filter="XML Files (*.xml *.XML *.xml.gz *.xml.zst)", directory=last_import_dir)
         if not ok:
             return
         self.settings.setValue("last_import_dir", last_import_dir)
         self._model_mgr.import_xml(path)
 
+    @trycatchslot
+    def import_from_server(self):
+        endpoint = self.settings.value("last_remote_endpoint", "opc.tcp://localhost:4840")
+        endpoint, ok = QInputDialog.getText(self.modeler, "Import From Server", "Endpoint of server:", text=endpoint)
+        if not ok or not endpoint.strip():
+            return
+        self.settings.setValue("last_remote_endpoint", endpoint.strip())
+        roots, ok = QInputDialog.getMultiLineText(self.modeler, "Import From Server", "Nodes to import, one nodeid per line:", "i=85\ni=86")
+        if not ok:
+            return
+        roots = [line.strip() for line in roots.splitlines() if line.strip()]
+        self._model_mgr.import_from_server(endpoint.strip(), roots or None)
+
     @trycatchslot
     def save_as(self):
         self._save_as()
 
     def _save_as(self):
-        path, ok = QFileDialog.getSaveFileName(self.modeler, caption="Save OPC UA XML", filter="XML Files (*.xml *.XML)")
+        path, ok = QFileDialog.getSaveFileName(self.modeler, caption="Save OPC UA XML", filter="XML Files (*.xml *.XML *.xml.gz *.xml.zst);;XML Files Split By Namespace (*.uamodel);;Binary Model (*.uamb)")
         if ok:
             if self._last_model_dir != os.path.dirname(path):
                 self._last_model_dir = os.path.dirname(path)
                 self.settings.setValue("last_model_dir", self._last_model_dir)
-            self._model_mgr.save_xml(path)
+            if ok.startswith("Binary") and not path.endswith(BINARY_MODEL_EXTENSION):
+                path += BINARY_MODEL_EXTENSION
+            self._model_mgr.split_namespaces = ok.startswith("XML Files Split")
+            if not path.endswith(BINARY_MODEL_EXTENSION):
+                self._model_mgr.save_xml(path)
             path = self._model_mgr.save_ua_model(path)
             self.modeler.update_recent_files(path)
 
     @trycatchslot
     def save(self):
+        if int(self.settings.value("validate_on_save", 1)):
+            issues = self._model_mgr.validate()
+            if any(issue.severity == ERROR for issue in issues):
+                logger.warning("Saving model with %s validation issues", len(issues))
+                self.modeler.show_issues(issues)
         if not self._model_mgr.current_path:
             self.save_as()
         else:
-            self._model_mgr.save_xml()
+            if not self._model_mgr.binary_model:
+                self._model_mgr.save_xml()
             self._model_mgr.save_ua_model()
 
     @trycatchslot
@@ -311,14 +447,60 @@ class ModelManagerUI(QObject):
             # FIXME: in this particular case we may want to navigate recursively to add ref
             self._add_modelling_rule(nodes)
 
+    @trycatchslot
+    def add_objects(self):
+        args, ok = NewUaObjectDialog.getArgs(self.modeler, "Add Objects", self._model_mgr.server_mgr, base_node_type=self._model_mgr.server_mgr.nodes.base_object_type)
+        if not ok:
+            return
+        count, ok = QInputDialog.getInt(self.modeler, "Add Objects", "Number of objects:", 2, 1, 1000000)
+        if ok:
+            nodes = self._model_mgr.add_objects(*args, count)
+            self._add_modelling_rule(nodes)
+
     def _add_modelling_rule(self, nodes):
         if not isinstance(nodes, (list, tuple)):
             nodes = [nodes]
-        for node in nodes:
-            path = node.get_path()
-            if self._model_mgr.server_mgr.nodes.base_object_type in path:
-                # we are creating a new type, add modeling rule
-                node.set_modelling_rule(True)
+        # added nodes have a common parent, we are creating a new type if the first one is in a type
+        if nodes and self._model_mgr.server_mgr.nodes.base_object_type in nodes[0].get_path():
+            # undoing the add removes the rules with the nodes
+            self._model_mgr.set_modelling_rule(nodes, ua.NodeId(ua.ObjectIds.ModellingRule_Mandatory), undoable=False)
+
+    @trycatchslot
+    def write_attribute_to_selection(self):
+        current = self.modeler.get_current_node()
+        nodes = [node for node in self.modeler.get_selected_nodes() if node != current]
+        if current is None or not nodes:
+            return
+        attrs = [attr for attr in ua.AttributeIds if attr not in (ua.AttributeIds.NodeId, ua.AttributeIds.NodeClass)]
+        values = self._model_mgr.server_mgr.read_node_attributes([current.nodeid], attrs)[0]
+        name, ok = QInputDialog.getItem(self.modeler, "Copy Attribute To Selection", f"Attribute of {current.read_display_name().Text} to write to {len(nodes)} nodes:",
+                                        [attr.name for attr in values], 0, False)
+        if ok:
+            attr = getattr(ua.AttributeIds, name)
+            self._model_mgr.write_attribute_to_nodes(nodes, attr, values[attr])
+
+    @trycatchslot
+    def set_modelling_rule_of_selection(self):
+        nodes = self.modeler.get_selected_nodes()
+        if not nodes:
+            return
+        rules = ["None"] + MODELLING_RULES
+        name, ok = QInputDialog.getItem(self.modeler, "Set Modelling Rule", f"Modelling rule of {len(nodes)} nodes:", rules, 1, False)
+        if ok:
+            rule = ua.NodeId(getattr(ua.ObjectIds, f"ModellingRule_{name}")) if name != "None" else None
+            self._model_mgr.set_modelling_rule(nodes, rule)
+
+    @trycatchslot
+    def add_reference_to_selection(self):
+        current = self.modeler.get_current_node()
+        nodes = [node for node in self.modeler.get_selected_nodes() if node != current]
+        if current is None or not nodes:
+            return
+        name, ok = QInputDialog.getItem(self.modeler, "Add Reference", f"Type of the references from {len(nodes)} nodes to {current.read_display_name().Text}:",
+                                        SELECTION_REFERENCE_TYPES, 0, False)
+        if ok:
+            reftype = ua.NodeId(getattr(ua.ObjectIds, name))
+            self._model_mgr.change_references([(node.nodeid, reftype, current.nodeid, True) for node in nodes], text=f"Add {name} references")
 
     @trycatchslot
     def add_data_type(self):
@@ -333,6 +515,20 @@ class ModelManagerUI(QObject):
             node = self._model_mgr.add_variable(*args)
             self._add_modelling_rule(node)
 
+    @trycatchslot
+    def add_tags(self):
+        last_import_dir = self.settings.value("last_import_dir", ".")
+        path, ok = QFileDialog.getOpenFileName(self.modeler, caption="Import Tag List", filter="Tag Lists (*.csv *.txt *.xlsx *.xlsm)", directory=last_import_dir)
+        if not ok:
+            return
+        uris = self._model_mgr.server_mgr.get_namespace_array()
+        idx = min(int(self.settings.value("last_namespace", len(uris) - 1)), len(uris) - 1)
+        uri, ok = QInputDialog.getItem(self.modeler, "Import Tag List", "Namespace of created nodes:", uris, idx, False)
+        if not ok:
+            return
+        self.settings.setValue("last_namespace", uris.index(uri))
+        self._model_mgr.add_tags(path, uris.index(uri))
+
     @trycatchslot
     def add_property(self):
         args, ok = NewUaVariableDialog.getArgs(self.modeler, "Add Property", self._model_mgr.server_mgr)
@@ -394,6 +590,13 @@ class UaModeler(QMainWindow):
         self.actions = ActionsManager(self, self.ui, self.model_mgr)
 
         self.setup_context_menu_tree()
+        self.setup_search_dock()
+        self.setup_diff_dock()
+        self.setup_validation_dock()
+        self.setup_undo_actions()
+        self.setup_import_actions()
+        self.setup_export_loader_action()
+        self.setup_simulation_action()
 
         delegate = BoldDelegate(self, self.tree_ui.model, self.model_mgr.get_new_nodes())
         self.ui.treeView.setItemDelegate(delegate)
@@ -435,6 +638,14 @@ class UaModeler(QMainWindow):
     def get_current_node(self, idx=None):
         return self.tree_ui.get_current_node(idx)
 
+    def get_selected_nodes(self):
+        indexes = [idx for idx in self.ui.treeView.selectionModel().selectedIndexes() if idx.column() == 0]
+        nodes = [self.tree_ui.get_current_node(idx) for idx in indexes]
+        if not nodes:
+            node = self.get_current_node()
+            return [node] if node else []
+        return nodes
+
     def get_current_server(self):
         """
         Used by tests
@@ -447,6 +658,9 @@ class UaModeler(QMainWindow):
         self.attrs_ui.clear()
         self.idx_ui.clear()
         self.nodesets_ui.clear()
+        self.search_ui.clear()
+        self.diff_ui.clear()
+        self.validation_ui.clear()
 
     @trycatchslot
     def _update_actions_state(self, current, previous):
@@ -464,16 +678,282 @@ class UaModeler(QMainWindow):
         self._contextMenu.addAction(self.ui.actionDelete)
         self._contextMenu.addSeparator()
         self._contextMenu.addAction(self.tree_ui.actionReload)
+        self.actionExportSelection = QAction("Export Selection...", self)
+        self.actionExportSelection.triggered.connect(self.model_mgr.export_selection)
+        self._contextMenu.addAction(self.actionExportSelection)
+        selectionMenu = self._contextMenu.addMenu("Edit Selection")
+        self.actionWriteAttributeToSelection = selectionMenu.addAction("Copy Attribute To Selection...")
+        self.actionWriteAttributeToSelection.triggered.connect(self.model_mgr.write_attribute_to_selection)
+        self.actionSetModellingRule = selectionMenu.addAction("Set Modelling Rule...")
+        self.actionSetModellingRule.triggered.connect(self.model_mgr.set_modelling_rule_of_selection)
+        self.actionAddReferenceToSelection = selectionMenu.addAction("Add Reference To Current Node...")
+        self.actionAddReferenceToSelection.triggered.connect(self.model_mgr.add_reference_to_selection)
+        self.ui.treeView.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self._contextMenu.addSeparator()
         self._contextMenu.addAction(self.ui.actionAddFolder)
         self._contextMenu.addAction(self.ui.actionAddObject)
+        self.actionAddObjects = QAction("Add Objects...", self)
+        self.actionAddObjects.triggered.connect(self.model_mgr.add_objects)
+        self.ui.actionAddObject.changed.connect(lambda: self.actionAddObjects.setEnabled(self.ui.actionAddObject.isEnabled()))
+        self.actionAddObjects.setEnabled(self.ui.actionAddObject.isEnabled())
+        self._contextMenu.addAction(self.actionAddObjects)
         self._contextMenu.addAction(self.ui.actionAddVariable)
+        self.actionAddTags = QAction("Import Tag List...", self)
+        self.actionAddTags.triggered.connect(self.model_mgr.add_tags)
+        # tags are created in folders, they can be imported where folders can be added
+        self.ui.actionAddFolder.changed.connect(lambda: self.actionAddTags.setEnabled(self.ui.actionAddFolder.isEnabled()))
+        self.actionAddTags.setEnabled(self.ui.actionAddFolder.isEnabled())
+        self._contextMenu.addAction(self.actionAddTags)
         self._contextMenu.addAction(self.ui.actionAddProperty)
         self._contextMenu.addAction(self.ui.actionAddMethod)
         self._contextMenu.addAction(self.ui.actionAddObjectType)
         self._contextMenu.addAction(self.ui.actionAddVariableType)
         self._contextMenu.addAction(self.ui.actionAddDataType)
 
+    def setup_search_dock(self):
+        self.searchDock = QDockWidget("Search", self)
+        self.searchDock.setObjectName("searchDock")
+        widget = QWidget(self.searchDock)
+        layout = QVBoxLayout(widget)
+        layout.setContentsMargins(2, 2, 2, 2)
+        self.searchLineEdit = QLineEdit(widget)
+        self.searchView = QTreeView(widget)
+        self.searchView.setEditTriggers(QTreeView.NoEditTriggers)
+        layout.addWidget(self.searchLineEdit)
+        layout.addWidget(self.searchView)
+        self.searchDock.setWidget(widget)
+        self.addDockWidget(Qt.LeftDockWidgetArea, self.searchDock)
+
+        self.search_ui = SearchWidget(self.searchLineEdit, self.searchView)
+        self.search_ui.error.connect(self.show_error)
+        self.search_ui.set_index(self.model_mgr.get_search_index())
+        self.search_ui.path_activated.connect(self.expand_to_path)
+        self.model_mgr.searchIndexReady.connect(self.search_ui.search)
+
+        self.actionFindNode = QAction("Find Node", self)
+        self.actionFindNode.setShortcut(QKeySequence.Find)
+        self.actionFindNode.triggered.connect(self._focus_search)
+        self.addAction(self.actionFindNode)
+        self.ui.menuOPC_UA_Client.insertAction(self.ui.actionUseOpenUa, self.actionFindNode)
+
+    def setup_diff_dock(self):
+        self.diffDock = QDockWidget("Model Diff", self)
+        self.diffDock.setObjectName("diffDock")
+        self.diffView = QTreeView(self.diffDock)
+        self.diffView.setEditTriggers(QTreeView.NoEditTriggers)
+        self.diffDock.setWidget(self.diffView)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.diffDock)
+        self.diffDock.hide()
+
+        self.diff_ui = DiffWidget(self.diffView)
+        self.diff_ui.error.connect(self.show_error)
+
+        self.actionDiffWithFile = QAction("Compare With File...", self)
+        self.actionDiffWithFile.triggered.connect(self.model_mgr.diff_with_file)
+        self.ui.menuOPC_UA_Client.insertAction(self.actionFindNode, self.actionDiffWithFile)
+        self.actionMerge = QAction("Merge Model...", self)
+        self.actionMerge.triggered.connect(self.model_mgr.merge)
+        self.ui.menuOPC_UA_Client.insertAction(self.actionFindNode, self.actionMerge)
+
+    def show_diff(self, diff):
+        self.diff_ui.show_diff(diff)
+        self.diffDock.show()
+
+    def setup_validation_dock(self):
+        self.validationDock = QDockWidget("Validation", self)
+        self.validationDock.setObjectName("validationDock")
+        self.validationView = QTreeView(self.validationDock)
+        self.validationView.setEditTriggers(QTreeView.NoEditTriggers)
+        self.validationDock.setWidget(self.validationView)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.validationDock)
+        self.validationDock.hide()
+
+        self.validation_ui = ValidationWidget(self.validationView)
+        self.validation_ui.error.connect(self.show_error)
+        self.validation_ui.node_activated.connect(self._show_node)
+
+        self.actionValidate = QAction("Validate Model", self)
+        self.actionValidate.setShortcut(QKeySequence("F7"))
+        self.actionValidate.triggered.connect(self.model_mgr.validate)
+        self.addAction(self.actionValidate)
+        self.ui.menuOPC_UA_Client.insertAction(self.actionFindNode, self.actionValidate)
+
+    def show_issues(self, issues):
+        self.validation_ui.show_issues(issues)
+        self.validationDock.show()
+
+    def _show_node(self, nodeid):
+        path = self.model_mgr.get_search_index().path(nodeid)
+        if not self.expand_to_path(path):
+            logger.warning("Could not find %s in tree", nodeid)
+
+    def setup_import_actions(self):
+        self.actionImportFromServer = QAction("Import From Server...", self)
+        self.actionImportFromServer.triggered.connect(self.model_mgr.import_from_server)
+        self.ui.actionImport.changed.connect(lambda: self.actionImportFromServer.setEnabled(self.ui.actionImport.isEnabled()))
+        self.actionImportFromServer.setEnabled(self.ui.actionImport.isEnabled())
+        self.ui.menuOPC_UA_Client.insertAction(self.ui.actionSave, self.actionImportFromServer)
+
+    def setup_export_loader_action(self):
+        self.actionExportLoader = QAction("Export Server Loader...", self)
+        self.actionExportLoader.triggered.connect(self.model_mgr.export_loader)
+        self.ui.actionImport.changed.connect(lambda: self.actionExportLoader.setEnabled(self.ui.actionImport.isEnabled()))
+        self.actionExportLoader.setEnabled(self.ui.actionImport.isEnabled())
+        self.ui.menuOPC_UA_Client.insertAction(self.ui.actionSave, self.actionExportLoader)
+
+    def setup_simulation_action(self):
+        self.actionSimulate = QAction("Simulate Values", self)
+        self.actionSimulate.setCheckable(True)
+        self.actionSimulate.toggled.connect(self.model_mgr.simulate)
+        self.ui.actionImport.changed.connect(lambda: self.actionSimulate.setEnabled(self.ui.actionImport.isEnabled()))
+        self.actionSimulate.setEnabled(self.ui.actionImport.isEnabled())
+        self.model_mgr.simulationStateChanged.connect(self._update_simulation_action)
+        self.ui.menuOPC_UA_Client.insertAction(self.actionFindNode, self.actionSimulate)
+
+    def _update_simulation_action(self, running):
+        self.actionSimulate.blockSignals(True)
+        self.actionSimulate.setChecked(running)
+        self.actionSimulate.blockSignals(False)
+
+    def setup_undo_actions(self):
+        self.actionUndo = QAction(QIcon.fromTheme("edit-undo"), "Undo", self)
+        self.actionUndo.setShortcut(QKeySequence.Undo)
+        self.actionUndo.triggered.connect(self.model_mgr.undo)
+        self.actionRedo = QAction(QIcon.fromTheme("edit-redo"), "Redo", self)
+        self.actionRedo.setShortcut(QKeySequence.Redo)
+        self.actionRedo.triggered.connect(self.model_mgr.redo)
+        for action in (self.actionUndo, self.actionRedo):
+            self.addAction(action)
+            self.ui.menuOPC_UA_Client.insertAction(self.actionFindNode, action)
+            self.ui.toolBar.insertAction(self.ui.actionCopy, action)
+        self.model_mgr.undoStateChanged.connect(self._update_undo_actions)
+        self._update_undo_actions()
+
+    def _update_undo_actions(self):
+        stack = self.model_mgr.get_undo_stack()
+        self.actionUndo.setEnabled(stack.can_undo())
+        self.actionUndo.setText(" ".join(("Undo", stack.undo_text())).strip())
+        self.actionRedo.setEnabled(stack.can_redo())
+        self.actionRedo.setText(" ".join(("Redo", stack.redo_text())).strip())
+
+    def _focus_search(self):
+        self.searchDock.show()
+        self.searchLineEdit.setFocus()
+        self.searchLineEdit.selectAll()
+
+    @trycatchslot
+    def expand_to_path(self, path):
+        """
+        Expand tree along a list of nodeids starting at root node and select last one.
+        Only children of the nodes on the path are fetched
+        """
+        model = self.tree_ui.model
+        item = model.item(0, 0)
+        if item is None or not path or item.data(Qt.UserRole).nodeid != path[0]:
+            return False
+        for nodeid in path[1:]:
+            idx = model.indexFromItem(item)
+            if model.canFetchMore(idx):
+                model.fetchMore(idx)
+            self.ui.treeView.setExpanded(idx, True)
+            for row in range(item.rowCount()):
+                child = item.child(row, 0)
+                if child.data(Qt.UserRole).nodeid == nodeid:
+                    item = child
+                    break
+            else:
+                logger.warning("Could not find %s in tree while expanding to %s", nodeid, path[-1])
+                return False
+        idx = model.indexFromItem(item)
+        self.ui.treeView.setCurrentIndex(idx)
+        self.ui.treeView.scrollTo(idx)
+        self.ui.treeView.activated.emit(idx)
+        return True
+
+    def renumber_tree_namespaces(self, indexes, deleted):
+        """
+        Update loaded tree items after namespaces changed, instead of reloading the tree which collapses it.
+        indexes maps old namespace indexes to new ones, items of deleted nodes are removed.
+        Children of renumbered items are fetched again, expanded ones are expanded again
+        """
+        def renumber(nodeid):
+            if indexes.get(nodeid.NamespaceIndex, nodeid.NamespaceIndex) == nodeid.NamespaceIndex:
+                return nodeid
+            return ua.NodeId(nodeid.Identifier, indexes[nodeid.NamespaceIndex], nodeid.NodeIdType)
+
+        model = self.tree_ui.model
+        current = self._tree_path(self.ui.treeView.currentIndex())
+        root = model.item(0, 0)
+        items = [root] if root is not None else []
+        while items:
+            parent = items.pop()
+            for row in reversed(range(parent.rowCount())):
+                item = parent.child(row, 0)
+                node = item.data(Qt.UserRole)
+                if node.nodeid in deleted:
+                    model.reset_cache(node)
+                    parent.removeRow(row)
+                    continue
+                bname_item = parent.child(row, 1)
+                bname = ua.QualifiedName.from_string(bname_item.text())
+                if indexes.get(bname.NamespaceIndex, bname.NamespaceIndex) != bname.NamespaceIndex:
+                    bname_item.setText(ua.QualifiedName(bname.Name, indexes[bname.NamespaceIndex]).to_string())
+                nodeid = renumber(node.nodeid)
+                if nodeid == node.nodeid:
+                    items.append(item)
+                    continue
+                expanded = self._forget_subtree(item, renumber)
+                item.setData(self.get_current_server().get_node(nodeid), Qt.UserRole)
+                parent.child(row, 2).setText(nodeid.to_string())
+                if item.rowCount():
+                    item.removeRows(0, item.rowCount())
+                    self._fetch_expanded(item, expanded)
+        if current and not any(nodeid in deleted for nodeid in current):
+            path = [renumber(nodeid) for nodeid in current]
+            if path != self._tree_path(self.ui.treeView.currentIndex()):
+                self.expand_to_path(path)
+
+    def _tree_path(self, idx):
+        """
+        nodeids of the tree items from root node to the item of idx
+        """
+        path = []
+        while idx.isValid():
+            path.insert(0, self.tree_ui.model.itemFromIndex(idx.sibling(idx.row(), 0)).data(Qt.UserRole).nodeid)
+            idx = idx.parent()
+        return path
+
+    def _forget_subtree(self, item, renumber):
+        """
+        reset fetched state of the nodes of item and its loaded children,
+        return keys of the renumbered nodeids of the expanded ones
+        """
+        model = self.tree_ui.model
+        expanded = set()
+        items = [item]
+        while items:
+            item = items.pop()
+            node = item.data(Qt.UserRole)
+            model.reset_cache(node)
+            if self.ui.treeView.isExpanded(model.indexFromItem(item)):
+                expanded.add(node_key(renumber(node.nodeid)))
+            items.extend(item.child(row, 0) for row in range(item.rowCount()))
+        return expanded
+
+    def _fetch_expanded(self, item, expanded):
+        """
+        fetch children of item if it was expanded and again for its children which were expanded
+        """
+        model = self.tree_ui.model
+        idx = model.indexFromItem(item)
+        if node_key(item.data(Qt.UserRole).nodeid) not in expanded:
+            return
+        if model.canFetchMore(idx):
+            model.fetchMore(idx)
+        self.ui.treeView.setExpanded(idx, True)
+        for row in range(item.rowCount()):
+            self._fetch_expanded(item.child(row, 0), expanded)
+
     def _show_context_menu_tree(self, position):
         node = self.tree_ui.get_current_node()
         if node:
@@ -518,7 +998,6 @@ class UaModeler(QMainWindow):
             self.attrs_ui.show_attrs(node)
 
     def nodesets_change(self, data):
-        self.idx_ui.reload()
         self.tree_ui.reload()
         self.refs_ui.clear()
         self.attrs_ui.clear()
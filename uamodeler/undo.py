@@ -0,0 +1,377 @@
+"""
+Undo and redo of model edits.
+Commands only store what is needed to invert them: the nodeids of created nodes,
+the state of deleted nodes or the previous value of a written attribute.
+Nodes are deleted and recreated with batched service calls
+"""
+
+import logging
+from collections import deque
+
+from asyncua import ua
+
+from uamodeler.node_tracker import NodeKeySet
+
+logger = logging.getLogger(__name__)
+
+
+_ATTRIBUTE_CLASSES = {
+    ua.NodeClass.Object: ua.ObjectAttributes,
+    ua.NodeClass.Variable: ua.VariableAttributes,
+    ua.NodeClass.Method: ua.MethodAttributes,
+    ua.NodeClass.ObjectType: ua.ObjectTypeAttributes,
+    ua.NodeClass.VariableType: ua.VariableTypeAttributes,
+    ua.NodeClass.ReferenceType: ua.ReferenceTypeAttributes,
+    ua.NodeClass.DataType: ua.DataTypeAttributes,
+    ua.NodeClass.View: ua.ViewAttributes,
+}
+
+# attributes which can be given when adding a node
+SNAPSHOT_ATTRIBUTES = [attr for attr in ua.AttributeIds if hasattr(ua.NodeAttributesMask, attr.name)
+               and attr not in (ua.AttributeIds.NodeId, ua.AttributeIds.NodeClass, ua.AttributeIds.BrowseName)]
+
+
+class NodeState(object):
+    """
+    what is needed to recreate a deleted node
+    """
+    __slots__ = ("nodeid", "nodeclass", "browse_name", "parent", "reftype", "typedef", "attrs", "refs", "added")
+
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+        self.nodeclass = None
+        self.browse_name = None
+        self.parent = None
+        self.reftype = None
+        self.typedef = ua.NodeId()
+        self.attrs = {}
+        self.refs = []  # (reftype, target, is_forward) stored on node
+        self.added = False  # node was part of the nodes we save
+
+
+class NodeSnapshot(object):
+    """
+    state of a set of nodes and of the references other nodes have to them
+    """
+
+    def __init__(self, states, external_refs):
+        self.states = states
+        self.external_refs = external_refs  # (source, reftype, target, is_forward)
+
+    def __len__(self):
+        return len(self.states)
+
+    def nodeids(self):
+        return [state.nodeid for state in self.states]
+
+    def neighbours(self):
+        return list(NodeKeySet(source for source, _, _, _ in self.external_refs))
+
+
+def descendants(server_mgr, nodeids, skip_reftypes=()):
+    """
+    return given nodes and all their hierarchical children, parents first.
+    references of types in skip_reftypes are not followed
+    """
+    result = NodeKeySet(nodeids)
+    level = list(result)
+    while level:
+        next_level = []
+        for refs in server_mgr.browse(level):
+            for ref in refs:
+                if ref.NodeId not in result and ref.ReferenceTypeId not in skip_reftypes:
+                    result.add(ref.NodeId)
+                    next_level.append(ref.NodeId)
+        level = next_level
+    return list(result)
+
+
+def take_snapshot(server_mgr, nodeids):
+    """
+    read attributes and references of nodes with batched Read and Browse calls
+    """
+    nodeids = list(nodeids)
+    inside = NodeKeySet(nodeids)
+    nodes_attrs = server_mgr.read_node_attributes(nodeids, [ua.AttributeIds.NodeClass, ua.AttributeIds.BrowseName] + SNAPSHOT_ATTRIBUTES)
+    nodes_refs = server_mgr.browse(nodeids, ua.ObjectIds.References, ua.BrowseDirection.Both)
+    nodes_parents = server_mgr.browse(nodeids, direction=ua.BrowseDirection.Inverse)
+    states = []
+    outside = NodeKeySet()
+    for nodeid, attrs, refs, parents in zip(nodeids, nodes_attrs, nodes_refs, nodes_parents):
+        if ua.AttributeIds.NodeClass not in attrs:
+            logger.warning("Node %s does not exist, it is not in snapshot", nodeid)
+            continue
+        state = NodeState(nodeid)
+        state.nodeclass = ua.NodeClass(attrs.pop(ua.AttributeIds.NodeClass).Value.Value)
+        state.browse_name = attrs.pop(ua.AttributeIds.BrowseName).Value.Value
+        state.attrs = {attr: dv.Value for attr, dv in attrs.items()}
+        if parents:
+            state.parent = parents[0].NodeId
+            state.reftype = parents[0].ReferenceTypeId
+        for ref in refs:
+            state.refs.append((ref.ReferenceTypeId, ref.NodeId, ref.IsForward))
+            if ref.IsForward and ref.ReferenceTypeId == ua.NodeId(ua.ObjectIds.HasTypeDefinition):
+                state.typedef = ref.NodeId
+            if ref.NodeId not in inside:
+                outside.add(ref.NodeId)
+        states.append(state)
+    # references from other nodes are not always the inverse of the ones stored on our nodes
+    external_refs = []
+    outside = list(outside)
+    for source, refs in zip(outside, server_mgr.browse(outside, ua.ObjectIds.References, ua.BrowseDirection.Both)):
+        for ref in refs:
+            if ref.NodeId in inside:
+                external_refs.append((source, ref.ReferenceTypeId, ref.NodeId, ref.IsForward))
+    return NodeSnapshot(_parents_first(states), external_refs)
+
+
+def _parents_first(states):
+    by_key = {state.nodeid: state for state in states}
+    ordered = []
+    done = set()
+
+    def visit(state, visiting):
+        if state.nodeid in done or state.nodeid in visiting:
+            return
+        visiting.add(state.nodeid)
+        parent = by_key.get(state.parent)
+        if parent is not None:
+            visit(parent, visiting)
+        done.add(state.nodeid)
+        ordered.append(state)
+
+    for state in states:
+        visit(state, set())
+    return ordered
+
+
+def _node_attributes(state):
+    attributes = _ATTRIBUTE_CLASSES[state.nodeclass]()
+    for attr, variant in state.attrs.items():
+        if not hasattr(attributes, attr.name) or (variant.Value is None and attr != ua.AttributeIds.Value):
+            continue
+        setattr(attributes, attr.name, variant if attr == ua.AttributeIds.Value else variant.Value)
+        attributes.SpecifiedAttributes |= getattr(ua.NodeAttributesMask, attr.name)
+    return attributes
+
+
+def node_items(snapshot):
+    """
+    return AddNodesItem recreating nodes of snapshot with their original nodeids, parents first
+    """
+    items = []
+    for state in snapshot.states:
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = state.nodeid
+        item.BrowseName = state.browse_name
+        item.NodeClass = state.nodeclass
+        item.ParentNodeId = state.parent if state.parent is not None else ua.NodeId()
+        item.ReferenceTypeId = state.reftype if state.reftype is not None else ua.NodeId()
+        item.TypeDefinition = state.typedef
+        item.NodeAttributes = _node_attributes(state)
+        items.append(item)
+    return items
+
+
+def reference_items(snapshot):
+    """
+    return AddReferencesItem for references of nodes of snapshot and references to them
+    """
+    refs = []
+    for state in snapshot.states:
+        for reftype, target, forward in state.refs:
+            refs.append(_add_ref_item(state.nodeid, reftype, target, forward))
+    for source, reftype, target, forward in snapshot.external_refs:
+        refs.append(_add_ref_item(source, reftype, target, forward))
+    return refs
+
+
+def restore_snapshot(server_mgr, snapshot):
+    """
+    recreate nodes of snapshot with their original nodeids using one batched
+    AddNodes call followed by one batched AddReferences call
+    """
+    for state, result in zip(snapshot.states, server_mgr.add_nodes(node_items(snapshot))):
+        if not result.StatusCode.is_good():
+            logger.warning("Could not recreate node %s: %s", state.nodeid, result.StatusCode)
+    refs = reference_items(snapshot)
+    failed = [ref for ref, result in zip(refs, server_mgr.add_references(refs)) if not result.is_good()]
+    if failed:
+        logger.info("%s references could not be recreated, they most probably already exist", len(failed))
+
+
+def _add_ref_item(source, reftype, target, forward):
+    item = ua.AddReferencesItem()
+    item.SourceNodeId = source
+    item.ReferenceTypeId = reftype
+    item.TargetNodeId = target
+    item.IsForward = forward
+    item.TargetNodeClass = ua.NodeClass.Unspecified
+    return item
+
+
+class AddNodesCommand(object):
+    """
+    nodes created by an add or a paste, undone by deleting them
+    """
+
+    def __init__(self, text, nodeids):
+        self.text = text
+        self.nodeids = nodeids
+        self.snapshot = None  # only set while undone
+
+    @property
+    def size(self):
+        return len(self.snapshot) if self.snapshot is not None else len(self.nodeids)
+
+    def undo(self, mgr):
+        self.snapshot = mgr.remove_nodes(self.nodeids)
+
+    def redo(self, mgr):
+        mgr.restore_nodes(self.snapshot)
+        self.snapshot = None
+
+
+class DeleteNodesCommand(object):
+    """
+    deleted nodes, undone by recreating them from their snapshot
+    """
+
+    def __init__(self, text, snapshot):
+        self.text = text
+        self.snapshot = snapshot
+
+    @property
+    def size(self):
+        return len(self.snapshot)
+
+    def undo(self, mgr):
+        mgr.restore_nodes(self.snapshot)
+
+    def redo(self, mgr):
+        self.snapshot = mgr.remove_nodes(self.snapshot.nodeids())
+
+
+class WriteAttributeCommand(object):
+    """
+    attribute written, undone by writing back previous value
+    """
+
+    size = 1
+
+    def __init__(self, text, nodeid, attr, old, new):
+        self.text = text
+        self.nodeid = nodeid
+        self.attr = attr
+        self.old = old
+        self.new = new
+
+    def undo(self, mgr):
+        mgr.write_attribute_value(self.nodeid, self.attr, self.old)
+
+    def redo(self, mgr):
+        mgr.write_attribute_value(self.nodeid, self.attr, self.new)
+
+
+class WriteAttributesCommand(object):
+    """
+    one attribute value written to many nodes, undone by writing back their previous values
+    """
+
+    def __init__(self, text, attr, olds, new):
+        self.text = text
+        self.attr = attr
+        self.olds = olds  # (nodeid, previous DataValue)
+        self.new = new
+
+    @property
+    def size(self):
+        return len(self.olds)
+
+    def undo(self, mgr):
+        mgr.write_attribute_values([(nodeid, self.attr, old) for nodeid, old in self.olds])
+
+    def redo(self, mgr):
+        mgr.write_attribute_values([(nodeid, self.attr, self.new) for nodeid, _ in self.olds])
+
+
+class ReferencesCommand(object):
+    """
+    references added and deleted, (source, reference type, target, forward) tuples,
+    undone by deleting the added ones and adding the deleted ones
+    """
+
+    def __init__(self, text, added, deleted):
+        self.text = text
+        self.added = added
+        self.deleted = deleted
+
+    @property
+    def size(self):
+        return len(self.added) + len(self.deleted)
+
+    def undo(self, mgr):
+        mgr.apply_references(self.deleted, self.added)
+
+    def redo(self, mgr):
+        mgr.apply_references(self.added, self.deleted)
+
+
+class UndoStack(object):
+    """
+    Bounded undo and redo stacks. Oldest commands are dropped when there are
+    more than max_depth commands or when they hold more than max_nodes nodes
+    """
+
+    def __init__(self, max_depth=100, max_nodes=100000):
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self._undo = deque()
+        self._redo = deque()
+
+    def __len__(self):
+        return len(self._undo)
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo_text(self):
+        return self._undo[-1].text if self._undo else ""
+
+    def redo_text(self):
+        return self._redo[-1].text if self._redo else ""
+
+    def push(self, command):
+        self._undo.append(command)
+        self._redo.clear()
+        self._evict()
+
+    def undo(self, mgr):
+        command = self._undo.pop()
+        command.undo(mgr)
+        self._redo.append(command)
+        self._evict()
+        return command
+
+    def redo(self, mgr):
+        command = self._redo.pop()
+        command.redo(mgr)
+        self._undo.append(command)
+        self._evict()
+        return command
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+
+    def _evict(self):
+        while len(self._undo) > self.max_depth:
+            self._undo.popleft()
+        size = sum(command.size for command in self._undo) + sum(command.size for command in self._redo)
+        while size > self.max_nodes and len(self._undo) + len(self._redo) > 1:
+            # drop oldest undo first, then the farthest redo
+            command = self._undo.popleft() if self._undo else self._redo.popleft()
+            size -= command.size
@@ -0,0 +1,284 @@
+"""
+Validation of a model before it is saved.
+Attributes and references of the model nodes are read once with batched Read
+and Browse calls into an indexed snapshot, then independent rules check it
+concurrently. After a first full pass only the nodes changed since the
+previous pass, their siblings and the nodes referencing them are read again and checked
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asyncua import ua
+
+from uamodeler.node_tracker import NodeKeySet, node_key, key_to_nodeid
+from uamodeler.undo import descendants
+
+logger = logging.getLogger(__name__)
+
+ERROR = "Error"
+WARNING = "Warning"
+
+_INSTANCE_CLASSES = (ua.NodeClass.Object, ua.NodeClass.Variable)
+_TYPE_CLASSES = (ua.NodeClass.ObjectType, ua.NodeClass.VariableType)
+_HAS_TYPE_DEFINITION = node_key(ua.NodeId(ua.ObjectIds.HasTypeDefinition))
+
+
+class Issue(object):
+    __slots__ = ("severity", "rule", "nodeid", "message")
+
+    def __init__(self, severity, rule, nodeid, message):
+        self.severity = severity
+        self.rule = rule
+        self.nodeid = nodeid  # None for issues of the whole model
+        self.message = message
+
+    def __repr__(self):
+        return f"Issue({self.severity}, {self.rule}, {self.nodeid}, {self.message})"
+
+
+class _NodeInfo(object):
+    __slots__ = ("nodeid", "nodeclass", "browse_name", "datatype", "definition", "refs", "parent")
+
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+        self.nodeclass = None
+        self.browse_name = None
+        self.datatype = None
+        self.definition = None
+        self.refs = []  # (reftype, target, is_forward)
+        self.parent = None
+
+
+def _targets(info):
+    """
+    nodes referenced by node info, with its data types
+    """
+    targets = [target for _, target, _ in info.refs]
+    if info.datatype is not None:
+        targets.append(info.datatype)
+    if isinstance(info.definition, ua.StructureDefinition):
+        targets.extend(field.DataType for field in info.definition.Fields)
+    return targets
+
+
+class ModelSnapshot(object):
+    """
+    model nodes indexed by node key, with the node class of the nodes they point to
+    """
+
+    def __init__(self, server_mgr):
+        self.server_mgr = server_mgr
+        self.nodes = {}  # node key -> _NodeInfo
+        self.external = {}  # node key -> NodeClass of nodes outside of model, None if missing
+        self.children = {}  # parent key -> keys of children in model
+        self.referrers = {}  # node key -> keys of model nodes referencing it
+        self.namespace_array = []
+        self._hierarchical = set(node_key(nodeid) for nodeid in descendants(server_mgr, [ua.NodeId(ua.ObjectIds.HierarchicalReferences)]))
+
+    def read(self, nodeids):
+        """
+        read nodes of model, replacing what we knew about them
+        """
+        attrs = [ua.AttributeIds.NodeClass, ua.AttributeIds.BrowseName, ua.AttributeIds.DataType, ua.AttributeIds.DataTypeDefinition]
+        nodes_attrs = self.server_mgr.read_node_attributes(nodeids, attrs)
+        nodes_refs = self.server_mgr.browse(nodeids, ua.ObjectIds.References, ua.BrowseDirection.Both)
+        for nodeid, attrs, refs in zip(nodeids, nodes_attrs, nodes_refs):
+            info = _NodeInfo(nodeid)
+            info.nodeclass = ua.NodeClass(attrs[ua.AttributeIds.NodeClass].Value.Value)
+            info.browse_name = attrs[ua.AttributeIds.BrowseName].Value.Value
+            if ua.AttributeIds.DataType in attrs:
+                info.datatype = attrs[ua.AttributeIds.DataType].Value.Value
+            if ua.AttributeIds.DataTypeDefinition in attrs:
+                info.definition = attrs[ua.AttributeIds.DataTypeDefinition].Value.Value
+            for ref in refs:
+                info.refs.append((ref.ReferenceTypeId, ref.NodeId, ref.IsForward))
+                if not ref.IsForward and info.parent is None and node_key(ref.ReferenceTypeId) in self._hierarchical:
+                    info.parent = ref.NodeId
+            key = node_key(nodeid)
+            self.nodes[key] = info
+            self.external.pop(key, None)
+
+    def remove(self, keys):
+        for key in keys:
+            self.nodes.pop(key, None)
+            self.external.pop(key, None)
+
+    def read_external(self, keys):
+        """
+        read node class of the nodes outside of model referenced by nodes of keys
+        """
+        missing = NodeKeySet()
+        for key in keys:
+            for target in _targets(self.nodes[key]):
+                if node_key(target) not in self.nodes and node_key(target) not in self.external:
+                    missing.add(target)
+        nodeids = list(missing)
+        for nodeid, dv in zip(nodeids, self.server_mgr.read_attributes(nodeids, ua.AttributeIds.NodeClass)):
+            self.external[node_key(nodeid)] = ua.NodeClass(dv.Value.Value) if dv.StatusCode.is_good() else None
+
+    def index(self):
+        self.namespace_array = self.server_mgr.get_namespace_array()
+        self.children = {}
+        self.referrers = {}
+        for key, info in self.nodes.items():
+            if info.parent is not None:
+                self.children.setdefault(node_key(info.parent), []).append(key)
+            for target in _targets(info):
+                self.referrers.setdefault(node_key(target), []).append(key)
+
+    def nodeclass(self, nodeid):
+        """
+        NodeClass of node, None if it does not exist
+        """
+        key = node_key(nodeid)
+        if key in self.nodes:
+            return self.nodes[key].nodeclass
+        return self.external.get(key)
+
+
+def check_references(snapshot, keys):
+    issues = []
+    for key in keys:
+        info = snapshot.nodes[key]
+        for reftype, target, forward in info.refs:
+            if snapshot.nodeclass(target) is None:
+                issues.append(Issue(ERROR, "Dangling reference", info.nodeid, f"Reference {reftype.to_string()} to missing node {target.to_string()}"))
+    return issues
+
+
+def check_type_definitions(snapshot, keys):
+    issues = []
+    for key in keys:
+        info = snapshot.nodes[key]
+        if info.nodeclass not in _INSTANCE_CLASSES:
+            continue
+        typedefs = [target for reftype, target, forward in info.refs if forward and node_key(reftype) == _HAS_TYPE_DEFINITION]
+        if not typedefs:
+            issues.append(Issue(ERROR, "Type definition", info.nodeid, "Node has no type definition"))
+        for typedef in typedefs:
+            if snapshot.nodeclass(typedef) not in _TYPE_CLASSES:
+                issues.append(Issue(ERROR, "Type definition", info.nodeid, f"Type definition {typedef.to_string()} is not an existing type"))
+    return issues
+
+
+def check_data_types(snapshot, keys):
+    issues = []
+    for key in keys:
+        info = snapshot.nodes[key]
+        if info.datatype is not None and snapshot.nodeclass(info.datatype) != ua.NodeClass.DataType:
+            issues.append(Issue(ERROR, "Data type", info.nodeid, f"DataType {info.datatype.to_string()} cannot be resolved"))
+        if isinstance(info.definition, ua.StructureDefinition):
+            for field in info.definition.Fields:
+                if snapshot.nodeclass(field.DataType) != ua.NodeClass.DataType:
+                    issues.append(Issue(ERROR, "Data type", info.nodeid, f"DataType {field.DataType.to_string()} of field {field.Name} cannot be resolved"))
+    return issues
+
+
+def check_browse_names(snapshot, keys):
+    issues = []
+    for key in keys:
+        info = snapshot.nodes[key]
+        if info.parent is None:
+            continue
+        siblings = snapshot.children.get(node_key(info.parent), [])
+        if sum(1 for sibling in siblings if snapshot.nodes[sibling].browse_name == info.browse_name) > 1:
+            issues.append(Issue(ERROR, "Duplicate BrowseName", info.nodeid, f"BrowseName {info.browse_name.to_string()} is used by another child of {info.parent.to_string()}"))
+    return issues
+
+
+def check_namespaces(snapshot):
+    """
+    namespaces neither used by model nodes nor by what they reference
+    """
+    used = {0}
+    for info in snapshot.nodes.values():
+        used.add(info.nodeid.NamespaceIndex)
+        used.add(info.browse_name.NamespaceIndex)
+        used.update(target.NamespaceIndex for _, target, _ in info.refs)
+        if info.datatype is not None:
+            used.add(info.datatype.NamespaceIndex)
+    return [Issue(WARNING, "Unused namespace", None, f"Namespace {uri} is not used by the model")
+            for idx, uri in enumerate(snapshot.namespace_array) if idx not in used]
+
+
+NODE_RULES = (check_references, check_type_definitions, check_data_types, check_browse_names)
+
+
+class ModelValidator(object):
+    """
+    run the rules on the model nodes, only on changed ones after the first run.
+    mark() is a ChangeLog observer
+    """
+
+    def __init__(self, server_mgr):
+        self.server_mgr = server_mgr
+        self.snapshot = None
+        self._issues = {}  # node key -> issues
+        self._model_issues = []
+        self._dirty = NodeKeySet()
+
+    def reset(self):
+        self.snapshot = None
+        self._issues = {}
+        self._model_issues = []
+        self._dirty.clear()
+
+    def mark(self, nodes, change=None):
+        if nodes is None:
+            self.snapshot = None  # something not tracked per node changed, check everything again
+        else:
+            self._dirty.update(nodes)
+
+    def validate(self, model_nodes):
+        """
+        check model nodes, return list of issues
+        """
+        if self.snapshot is None:
+            self.snapshot = ModelSnapshot(self.server_mgr)
+            self._dirty.clear()
+            checked = self._read(list(model_nodes))
+        else:
+            checked = self._read_changed(model_nodes)
+        self.snapshot.read_external(checked)
+        self.snapshot.index()
+        with ThreadPoolExecutor(len(NODE_RULES) + 1) as pool:
+            futures = [pool.submit(rule, self.snapshot, checked) for rule in NODE_RULES]
+            model_issues = pool.submit(check_namespaces, self.snapshot)
+            for key in checked:
+                self._issues.pop(key, None)
+            for future in futures:
+                for issue in future.result():
+                    self._issues.setdefault(node_key(issue.nodeid), []).append(issue)
+            self._model_issues = model_issues.result()
+        logger.info("Validated %s of %s nodes", len(checked), len(self.snapshot.nodes))
+        return self.issues()
+
+    def _read(self, nodeids):
+        self.snapshot.read(nodeids)
+        return [node_key(nodeid) for nodeid in nodeids]
+
+    def _read_changed(self, model_nodes):
+        dirty = self._dirty.keys()
+        self._dirty.clear()
+        old_parents = [self.snapshot.nodes[key].parent for key in dirty if key in self.snapshot.nodes]
+        # deleting a node also deletes the references to it, changing a node may break the ones to it
+        changed = NodeKeySet(dirty)
+        for key in dirty:
+            changed.update(self.snapshot.referrers.get(key, []))
+        deleted = [key for key in dirty if key not in model_nodes]
+        self.snapshot.remove(deleted)
+        for key in deleted:
+            self._issues.pop(key, None)
+        checked = self._read([key_to_nodeid(key) for key in changed.keys() if key in model_nodes])
+        parents = old_parents + [self.snapshot.nodes[key].parent for key in checked]
+        # renaming, adding or deleting a node changes the duplicates among its siblings
+        siblings = NodeKeySet(checked)
+        for parent in parents:
+            if parent is not None:
+                siblings.update(self.snapshot.children.get(node_key(parent), []))
+        return [key for key in siblings.keys() if key in self.snapshot.nodes]
+
+    def issues(self):
+        issues = [issue for issues in self._issues.values() for issue in issues] + self._model_issues
+        return sorted(issues, key=lambda issue: (issue.severity, issue.rule, str(issue.nodeid)))
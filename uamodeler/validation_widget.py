@@ -0,0 +1,46 @@
+import logging
+
+from PyQt5.QtCore import pyqtSignal, Qt, QObject
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+
+from uawidgets.utils import trycatchslot
+
+
+logger = logging.getLogger(__name__)
+
+
+class ValidationWidget(QObject):
+    """
+    Show issues found by model validation and emit the nodeid of the activated issue
+    """
+
+    error = pyqtSignal(Exception)
+    node_activated = pyqtSignal(object)
+
+    def __init__(self, view):
+        QObject.__init__(self, view)
+        self.view = view
+        self.model = QStandardItemModel()
+        self.view.setModel(self.model)
+        self.model.setHorizontalHeaderLabels(['Severity', 'Rule', 'Node', 'Message'])
+        self.view.activated.connect(self._activated)
+        self.view.clicked.connect(self._activated)
+
+    @trycatchslot
+    def show_issues(self, issues):
+        self.model.removeRows(0, self.model.rowCount())
+        for issue in issues:
+            severity_item = QStandardItem(issue.severity)
+            severity_item.setData(issue.nodeid, Qt.UserRole)
+            node_text = issue.nodeid.to_string() if issue.nodeid is not None else ""
+            self.model.appendRow([severity_item, QStandardItem(issue.rule), QStandardItem(node_text), QStandardItem(issue.message)])
+
+    @trycatchslot
+    def _activated(self, idx):
+        item = self.model.item(idx.row(), 0)
+        if item is None or item.data(Qt.UserRole) is None:
+            return
+        self.node_activated.emit(item.data(Qt.UserRole))
+
+    def clear(self):
+        self.model.removeRows(0, self.model.rowCount())
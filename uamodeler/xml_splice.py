@@ -0,0 +1,153 @@
+"""
+Replace, add and remove node elements of a NodeSet2 file previously written by us,
+without re-exporting the nodes which did not change.
+Works on the text of the file: our exporter writes one top level element per
+node, each starting on a new line indented with two spaces
+"""
+
+import os
+import re
+import html
+import logging
+import xml.etree.ElementTree as Et
+
+from asyncua import ua
+
+logger = logging.getLogger(__name__)
+
+_nodeid_re = re.compile(r'\sNodeId="([^"]*)"')
+_tag_re = re.compile(r"<([\w:]+)")
+
+
+def _split(text):
+    """
+    split file text in header, list of top level element chunks and footer
+    """
+    lines = text.splitlines(keepends=True)
+    header = []
+    chunks = []
+    footer = []
+    current = None
+    for line in lines:
+        if line.startswith("</UANodeSet"):
+            footer.append(line)
+            current = footer
+        elif line.startswith("  <") and not line.startswith("  </"):
+            current = [line]
+            chunks.append(current)
+        elif current is None:
+            header.append(line)
+        else:
+            current.append(line)
+    return "".join(header), ["".join(chunk) for chunk in chunks], "".join(footer)
+
+
+def _chunk_tag(chunk):
+    return _tag_re.search(chunk).group(1)
+
+
+def _chunk_nodeid(chunk):
+    first_line = chunk.split("\n", 1)[0]
+    match = _nodeid_re.search(first_line)
+    if match is None:
+        return None
+    return html.unescape(match.group(1))
+
+
+def _to_chunk(el):
+    el.tail = None
+    Et.indent(el, space="  ", level=1)
+    return "  " + Et.tostring(el, encoding="unicode") + "\n"
+
+
+def _uris(el):
+    return [uri_el.text for uri_el in el]
+
+
+def splice_nodeset(path, partial, deleted, ns_array):
+    """
+    update NodeSet2 file at path with the node elements of partial, an etree root
+    built by our exporter, and remove deleted nodes (NodeIds from the server).
+    return False if file cannot be spliced and a full export is necessary
+    """
+    if not os.path.exists(path):
+        return False
+    with open(path, encoding="utf-8") as f:
+        header, chunks, footer = _split(f.read())
+    if not footer or not chunks:
+        return False
+
+    old_uris = []
+    aliases_idx = None
+    by_nodeid = {}
+    for idx, chunk in enumerate(chunks):
+        tag = _chunk_tag(chunk)
+        if tag == "NamespaceUris":
+            old_uris = _uris(Et.fromstring(chunk))
+        elif tag == "Aliases":
+            aliases_idx = idx
+        else:
+            nodeid = _chunk_nodeid(chunk)
+            if nodeid is not None:
+                by_nodeid[nodeid] = idx
+
+    new_aliases = {}
+    new_nodes = []
+    for el in partial:
+        if el.tag == "NamespaceUris":
+            uris = _uris(el)
+            if uris != old_uris[:len(uris)]:
+                logger.info("Namespace table changed, cannot splice %s", path)
+                return False
+        elif el.tag == "Aliases":
+            new_aliases = {alias_el.attrib["Alias"]: alias_el.text for alias_el in el}
+        else:
+            new_nodes.append(el)
+
+    if new_aliases:
+        if aliases_idx is None:
+            return False
+        aliases_el = Et.fromstring(chunks[aliases_idx])
+        aliases = {alias_el.attrib["Alias"]: alias_el.text for alias_el in aliases_el}
+        for name, text in new_aliases.items():
+            if name not in aliases:
+                Et.SubElement(aliases_el, "Alias", Alias=name).text = text
+            elif aliases[name] != text:
+                logger.info("Alias %s changed, cannot splice %s", name, path)
+                return False
+        chunks[aliases_idx] = _to_chunk(aliases_el)
+
+    for nodeid in deleted:
+        nodeid_str = _file_nodeid(nodeid, ns_array, old_uris)
+        if nodeid_str in by_nodeid:
+            chunks[by_nodeid.pop(nodeid_str)] = ""
+
+    for el in new_nodes:
+        chunk = _to_chunk(el)
+        idx = by_nodeid.get(el.attrib["NodeId"])
+        if idx is None:
+            chunks.append(chunk)
+        else:
+            chunks[idx] = chunk
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(header)
+        f.writelines(chunks)
+        f.write(footer)
+    os.replace(tmp_path, path)
+    logger.info("Spliced %s changed and %s deleted nodes into %s", len(new_nodes), len(deleted), path)
+    return True
+
+
+def _file_nodeid(nodeid, ns_array, uris):
+    """
+    return string of nodeid as written in file using namespace table of file
+    """
+    if nodeid.NamespaceIndex == 0:
+        return nodeid.to_string()
+    try:
+        idx = uris.index(ns_array[nodeid.NamespaceIndex]) + 1
+    except (ValueError, IndexError):
+        return None
+    return ua.NodeId(nodeid.Identifier, idx).to_string()